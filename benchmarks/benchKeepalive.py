@@ -0,0 +1,46 @@
+#!/usr/bin/python
+
+# Compares the request throughput of VSDConnecter with and without the
+# persistent connection pool against the local mock VSD server.
+#
+# Usage: PYTHONPATH=source python benchmarks/benchKeepalive.py [--requests N]
+
+import base64
+import time
+import argparse
+
+import connectVSD
+from mockVSD import MockVSD
+
+def run(con, nrequests):
+    start = time.time()
+    for oid in range(1, nrequests + 1):
+        con.getObject(oid)
+    return nrequests / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the VSDConnecter connection pool.')
+    parser.add_argument('--requests', dest='requests', type=int, default=2000,
+                        help='number of getObject calls per run')
+    args = parser.parse_args()
+    
+    server = MockVSD(nobjects = args.requests)
+    server.start()
+    
+    con = connectVSD.VSDConnecter(authstr = base64.b64encode('user:password'))
+    con.setUrl(server.url)
+    
+    con.setConnectionPool(poolsize = 0)
+    unpooled = run(con, args.requests)
+    con.setConnectionPool(poolsize = 4)
+    pooled = run(con, args.requests)
+    
+    print 'without pooling: {:8.1f} requests/s'.format(unpooled)
+    print 'with pooling:    {:8.1f} requests/s'.format(pooled)
+    print 'speedup:         {:8.2f}x'.format(pooled / unpooled)
+    
+    con.setConnectionPool(poolsize = 0)
+    server.stop()
+
+if __name__ == '__main__':
+    main()
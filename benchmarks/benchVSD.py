@@ -0,0 +1,220 @@
+#!/usr/bin/python
+
+# Benchmarks the main VSDConnecter operations against the in-process mock
+# VSD server, reporting throughput, latency percentiles and peak memory.
+# Each scenario runs in a child process, such that its peak memory is
+# measured on its own. Results can be saved and compared between versions.
+#
+# Usage: PYTHONPATH=source python benchmarks/benchVSD.py [--latency S] [--bandwidth B/s]
+#            [--save results.json] [--compare results.json] [scenario ...]
+
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+
+import connectVSD
+from mockVSD import MockVSD
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the progress output of the connecter."""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def folders(con, server, args):
+    """List all folders page by page and build the folder structures."""
+    folderList = con.getFolderList(rpp = 25)
+    con.readFolders(folderList)
+    con.getFolderIndex(rpp = 25)
+    return len(folderList['items']), 0
+
+def getObject(con, server, args):
+    """Retrieve objects one after another."""
+    for oid in range(1, args.count + 1):
+        con.getObject(oid)
+    return args.count, 0
+
+def getObjects(con, server, args):
+    """Retrieve objects with a batched, parallel request."""
+    con.getObjects(range(1, args.count + 1), workers = args.workers)
+    return args.count, 0
+
+def downloadSingle(con, server, args):
+    """Download single file objects."""
+    oids = [oid for oid in range(1, server.nobjects + 1) if len(server.objects[oid]['files']) == 1]
+    return download(con, oids[:args.count], args)
+
+def downloadMulti(con, server, args):
+    """Download multi-file objects, fetching the files in parallel."""
+    oids = [oid for oid in range(1, server.nobjects + 1) if len(server.objects[oid]['files']) > 1]
+    return download(con, oids[:max(1, args.count // 10)], args)
+
+def download(con, oids, args):
+    target = tempfile.mkdtemp(prefix = 'benchVSD')
+    try:
+        nbytes = 0
+        for oid in oids:
+            filename = os.path.join(target, con.generateBaseFilenameFromOntology(oid))
+            nbytes += con.downloadFile(oid, filename, workers = args.workers).bytes
+        return len(oids), nbytes
+    finally:
+        shutil.rmtree(target)
+
+def uploadFile(con, server, args):
+    """Upload files of the fixture file size."""
+    fd, filename = tempfile.mkstemp(prefix = 'benchVSD', suffix = '.nii')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(server.content(0, server.filesize))
+        for i in range(args.count):
+            con.uploadFile(filename)
+        return args.count, args.count * server.filesize
+    finally:
+        os.remove(filename)
+
+def folderPage(server, nfolders):
+    """A folder listing of nfolders folders, each with the members of the
+    fixture folders, 50 contained objects and 10 rights of each kind."""
+    items = []
+    for i in range(nfolders):
+        folder = dict(server.folders[i % server.nfolders + 1], id = i + 1,
+                      selfUrl = '{}/folders/{}'.format(server.url, i + 1))
+        folder['containedObjects'] = [{'selfUrl': '{}/objects/{}'.format(server.url, 50 * i + k)} for k in range(50)]
+        for member in ('folderGroupRights', 'folderUserRights'):
+            folder[member] = [{'selfUrl': '{}/folder-rights/{}'.format(server.url, k)} for k in range(10)]
+        items.append(folder)
+    return json.dumps({'totalCount': nfolders, 'items': items})
+
+def decodeFull(con, server, args):
+    """Decode a large folder listing with all members."""
+    return decode(con, server, args, None)
+
+def decodeFolders(con, server, args):
+    """Decode a large folder listing keeping the folder tree members, as
+    getFolderIndex does."""
+    return decode(con, server, args, connectVSD.FOLDER_FIELDS)
+
+def decode(con, server, args, fields):
+    body = folderPage(server, 10 * args.count)
+    for i in range(5):
+        con.decoder.loads(body, fields)
+    return 5 * 10 * args.count, 5 * len(body)
+
+SCENARIOS = [folders, getObject, getObjects, downloadSingle, downloadMulti, uploadFile, decodeFull, decodeFolders]
+
+def quantile(latencies, q):
+    """Estimate a latency quantile over all requests from the histogram
+    snapshots of the endpoints."""
+    if not latencies:
+        return 0.
+    buckets = sorted((float('inf') if bound is None else bound, n)
+                     for latency in latencies for bound, n in latency['buckets'])
+    maximum = max(latency['max'] for latency in latencies)
+    rank = q * sum(n for _, n in buckets)
+    seen = 0
+    for bound, n in buckets:
+        seen += n
+        if seen >= rank:
+            return min(bound, maximum)
+    return maximum
+
+def run(scenario, server, args):
+    """Run a scenario and measure it. The peak memory is reported relative to
+    the memory in use when the scenario is started, i.e. the growth by the
+    scenario itself."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    con = connectVSD.VSDConnecter(authstr = base64.b64encode('user:password'))
+    con.setUrl(server.url)
+    metrics = con.setMetrics(connectVSD.Metrics())
+    start = time.time()
+    with quiet():
+        operations, nbytes = scenario(con, server, args)
+    elapsed = time.time() - start
+    con.setConnectionPool(poolsize = 0)
+    latencies = [endpoint['latency'] for endpoint in metrics.snapshot()['requests'].values()]
+    return {'operations': operations,
+            'requests': sum(latency['count'] for latency in latencies),
+            'seconds': elapsed,
+            'opsPerSecond': operations / elapsed,
+            'MiBPerSecond': nbytes / 1048576. / elapsed,
+            'p50ms': 1000 * quantile(latencies, 0.5),
+            'p99ms': 1000 * quantile(latencies, 0.99),
+            'peakRSSMiB': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024.}
+
+def isolated(scenario, server, args):
+    """Run a scenario in a child process. The peak memory reported by
+    getrusage is the maximum over the lifetime of a process, hence it
+    would otherwise include the scenarios run before. The server keeps
+    running in this process, hence its counters are reset here."""
+    server.reset()
+    receiver, sender = multiprocessing.Pipe(duplex = False)
+    child = multiprocessing.Process(target = lambda: sender.send(run(scenario, server, args)))
+    child.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError('Scenario {} failed'.format(scenario.__name__))
+    finally:
+        child.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark VSDConnecter against a local mock server.')
+    parser.add_argument('scenarios', nargs='*', default=[scenario.__name__ for scenario in SCENARIOS],
+                        help='scenarios to run, out of: ' + ', '.join(scenario.__name__ for scenario in SCENARIOS))
+    parser.add_argument('--count', dest='count', type=int, default=200,
+                        help='number of operations per scenario')
+    parser.add_argument('--workers', dest='workers', type=int, default=8,
+                        help='number of parallel requests of batched operations')
+    parser.add_argument('--filesize', dest='filesize', type=int, default=1048576,
+                        help='size of the served files in bytes')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.,
+                        help='server latency per request in seconds')
+    parser.add_argument('--bandwidth', dest='bandwidth', type=float, default=None,
+                        help='server bandwidth per response in bytes per second')
+    parser.add_argument('--save', dest='save', default=None,
+                        help='write the results as JSON to this file')
+    parser.add_argument('--compare', dest='compare', default=None,
+                        help='compare with the results saved in this file')
+    args = parser.parse_args()
+
+    byname = dict((scenario.__name__, scenario) for scenario in SCENARIOS)
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    server = MockVSD(nobjects = max(args.count, 100), nfolders = 50, filesize = args.filesize,
+                     latency = args.latency, bandwidth = args.bandwidth)
+    with server:
+        print '{:<16} {:>6} {:>8} {:>9} {:>10} {:>9} {:>9} {:>9} {:>10}'.format(
+              'scenario', 'ops', 'requests', 'seconds', 'ops/s', 'MiB/s', 'p50 ms', 'p99 ms', 'peak +MiB')
+        for name in args.scenarios:
+            result = results[name] = isolated(byname[name], server, args)
+            line = '{:<16} {:>6} {:>8} {:>9.2f} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.1f}'.format(
+                   name, result['operations'], result['requests'], result['seconds'], result['opsPerSecond'],
+                   result['MiBPerSecond'], result['p50ms'], result['p99ms'], result['peakRSSMiB'])
+            if name in baseline:
+                line += '  {:+.0%} ops/s'.format(result['opsPerSecond'] / baseline[name]['opsPerSecond'] - 1)
+            print line
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent = 2, sort_keys = True)
+
+if __name__ == '__main__':
+    main()
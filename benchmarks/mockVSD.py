@@ -0,0 +1,540 @@
+#!/usr/bin/python
+
+# In-process mock of the VSD REST API serving synthetic fixtures, for
+# offline benchmarks of VSDConnecter.
+#
+# Usage:
+#
+#     with MockVSD(nobjects = 100, latency = 0.01) as server:
+#         con = connectVSD.VSDConnecter(authstr = base64.b64encode('user:password'))
+#         con.setUrl(server.url)
+#         con.getObject(1)
+
+import re
+import sys
+import json
+import hashlib
+import time
+import random
+import socket
+import urlparse
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+
+class MockVSD(object):
+    """Mock VSD API on a local port.
+
+    Serves `/objects`, `/folders`, `/files` including downloads, `/upload`,
+    `/object-links`, `/object-ontologies`, `/ontologies`,
+    `/object-group-rights` and `/object-user-rights` from
+    deterministic, synthetic fixtures. List resources are paginated with the
+    `rpp` and `page` parameters, and link to the next page unless
+    `nextPageUrls` is cleared. Downloads honor Range requests unless
+    `ignoreRange` is set, and If-Range with the ETag of the file, which
+    changes with its 'version'. The byte counts in `cutoffs` interrupt the
+    next downloads after as many bytes. Upload responses reference the created object
+    unless `relatedObjects` is cleared, and the bodies in `uploadReplies`
+    are sent verbatim to the next uploads instead. Resources carry ETags,
+    which are checked against If-Match on folder updates, unless `etags`
+    is cleared. The callables in `hooks`, by route name, are each called
+    once before the next request of their route is handled, e.g. to
+    simulate concurrent modifications. The (status, body) tuples in
+    `overrides`, by request path, are sent instead of the fixtures, and
+    the lists of (status, body, headers) tuples in `queued` one per
+    request before them, e.g. to simulate transient errors.
+
+    Parameters
+    ----------
+    nobjects : int
+        Number of objects.
+    nfolders : int
+        Number of folders, forming a tree with `fanout` children per folder.
+        The objects are distributed evenly over the folders.
+    fanout : int
+    filesize : int
+        Size of each file in bytes.
+    multifile : int
+        Every multifile-th object is a multi-file object, e.g. a DICOM series,
+        with `nslices` files. 0 disables multi-file objects.
+    nslices : int
+    latency : float
+        Seconds each request is delayed before it is answered.
+    bandwidth : float
+        Maximum bytes per second sent per response. None is unlimited.
+    """
+
+    def __init__(self, nobjects = 100, nfolders = 20, fanout = 4, filesize = 65536,
+                 multifile = 10, nslices = 8, latency = 0., bandwidth = None):
+        self.nobjects = nobjects
+        self.nfolders = nfolders
+        self.fanout = fanout
+        self.filesize = filesize
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ignoreRange = False
+        self.nextPageUrls = True
+        self.relatedObjects = True
+        self.uploadReplies = []
+        self.etags = True
+        self.hooks = {}
+        self.overrides = {}
+        self.queued = {}
+        self.cutoffs = []
+        self.counts = collections.Counter()
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.url = None
+        self.__block = ''.join(chr(random.Random(0).randint(0, 255)) for i in range(4096))
+        self.digest = self.__digest()
+        self.__fixtures(multifile, nslices)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Start serving in a background thread and return the base url."""
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.mock = self
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://{}:{}/api'.format(*self.server.server_address)
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """Reset the request counters."""
+        with self.lock:
+            self.counts.clear()
+            self.bytesSent = 0
+            self.bytesReceived = 0
+
+    def content(self, offset, size):
+        """The bytes of a file between offset and offset + size."""
+        block = self.__block
+        start = offset % len(block)
+        data = block[start:] + block * ((size + start) // len(block))
+        return data[:size]
+
+    def __digest(self):
+        """The sha1 hex digest of the file content, reported as fileHashCode."""
+        digest = hashlib.sha1()
+        for offset in range(0, self.filesize, 1048576):
+            digest.update(self.content(offset, min(1048576, self.filesize - offset)))
+        return digest.hexdigest()
+
+    ################################## FIXTURES ##################################
+
+    def __fixtures(self, multifile, nslices):
+        self.objects = {}
+        self.files = {}
+        self.folders = {}
+        self.links = {}
+        self.relations = {}
+        self.rights = {'object-group-rights': {}, 'object-user-rights': {}}
+        for fid in range(1, self.nfolders + 1):
+            self.folders[fid] = {'id': fid,
+                                 'name': 'Folder{}'.format(fid),
+                                 'parentFolder': None if fid == 1 else {'selfUrl': '/folders/{}'.format((fid - 2) // self.fanout + 1)},
+                                 'childFolders': [{'selfUrl': '/folders/{}'.format(child)}
+                                                  for child in range(fid * self.fanout - self.fanout + 2, fid * self.fanout + 2)
+                                                  if child <= self.nfolders] or None,
+                                 'containedObjects': []}
+        for oid in range(1, self.nobjects + 1):
+            nfiles = nslices if multifile and oid % multifile == 0 else 1
+            obj = self.newObject(1, 'image{}.nii'.format(oid) if nfiles == 1 else 'series{}.dcm'.format(oid), nfiles)
+            relation = self.newRelation(0, oid, obj['id'])
+            obj['ontologyItems'].append({'selfUrl': '/ontologies/0/{}'.format(oid)})
+            obj['ontologyItemRelations'].append({'selfUrl': '/object-ontologies/0/{}'.format(relation['id'])})
+            if self.nfolders:
+                self.folders[oid % self.nfolders + 1]['containedObjects'].append({'selfUrl': '/objects/{}'.format(oid)})
+        for folder in self.folders.values():
+            folder['containedObjects'] = folder['containedObjects'] or None
+
+    def newObject(self, objtype, name, nfiles = 1, size = None, digest = None):
+        """Create an object with nfiles files and return it. The files have
+        the fixture content unless size and digest are given."""
+        with self.lock:
+            oid = len(self.objects) + 1
+            files = []
+            for i in range(nfiles):
+                fileid = len(self.files) + 1
+                self.files[fileid] = {'id': fileid,
+                                      'size': self.filesize if size is None else size,
+                                      'fileHashCode': self.digest if digest is None else digest,
+                                      'createdDate': '2015-01-01T00:00:00',
+                                      'originalFileName': name,
+                                      'downloadUrl': '/files/{}/download'.format(fileid),
+                                      'objects': {'items': [{'selfUrl': '/objects/{}'.format(oid)}]}}
+                files.append({'selfUrl': '/files/{}'.format(fileid)})
+            obj = {'id': oid,
+                   'type': objtype,
+                   'name': name,
+                   'files': files,
+                   'ontologyItems': [],
+                   'ontologyItemRelations': [],
+                   'linkedObjects': [],
+                   'objectGroupRights': [],
+                   'objectUserRights': []}
+            self.objects[oid] = obj
+            return obj
+
+    def newRelation(self, ontotype, itemid, oid, position = 0):
+        with self.lock:
+            relid = sum(len(rels) for rels in self.relations.values()) + 1
+            relation = {'id': relid,
+                        'type': ontotype,
+                        'position': position,
+                        'object': {'selfUrl': '/objects/{}'.format(oid)},
+                        'ontologyItem': {'selfUrl': '/ontologies/{}/{}'.format(ontotype, itemid)}}
+            self.relations.setdefault(ontotype, {})[relid] = relation
+            return relation
+
+    def newRight(self, resource, oid, principal, rights):
+        """Grant rights on an object to a group or user, e.g.
+        `newRight('object-group-rights', 1, '/groups/2', [{'selfUrl': '/object-rights/1'}])`."""
+        member, key = _RIGHTS[resource]
+        with self.lock:
+            rightid = len(self.rights[resource]) + 1
+            right = {'id': rightid,
+                     'relatedObject': {'selfUrl': '/objects/{}'.format(oid)},
+                     key: {'selfUrl': principal},
+                     'relatedRights': rights}
+            self.rights[resource][rightid] = right
+            if oid in self.objects:
+                self.objects[oid][member].append({'selfUrl': '/{}/{}'.format(resource, rightid)})
+            return right
+
+_RIGHTS = {'object-group-rights': ('objectGroupRights', 'relatedGroup'),
+           'object-user-rights': ('objectUserRights', 'relatedUser')}
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Dispatches the requests to the MockVSD fixtures."""
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    ROUTES = [('GET', r'/(objects|folders)$', 'list'),
+              ('GET', r'/objects/(\d+)$', 'object'),
+              ('GET', r'/folders/(\d+)$', 'folder'),
+              ('PUT', r'/folders$', 'putFolder'),
+              ('GET', r'/files/(\d+)$', 'file'),
+              ('GET', r'/files/(\d+)/download$', 'download'),
+              ('POST', r'/upload$', 'upload'),
+              ('POST', r'/object-links$', 'link'),
+              ('GET', r'/object-ontologies/(\d+)/(\d+)$', 'relation'),
+              ('POST', r'/object-ontologies/(\d+)$', 'addRelation'),
+              ('GET', r'/ontologies/(\d+)/(\d+)$', 'ontology'),
+              ('GET', r'/(object-group-rights|object-user-rights)/(\d+)$', 'right'),
+              ('POST', r'/(object-group-rights|object-user-rights)$', 'addRight')]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+    def dispatch(self, method):
+        mock = self.server.mock
+        parts = urlparse.urlsplit(self.path)
+        path = re.sub('/{2,}', '/', parts.path)
+        if path.startswith('/api'):
+            path = path[4:]
+        self.query = urlparse.parse_qs(parts.query)
+        self.base = 'http://{}:{}/api'.format(*self.server.server_address)
+        if mock.latency:
+            time.sleep(mock.latency)
+        handler = None
+        for routemethod, pattern, name in self.ROUTES:
+            match = re.match(pattern, path)
+            if match and routemethod == method:
+                with mock.lock:
+                    mock.counts[name] += 1
+                    hook = mock.hooks.pop(name, None)
+                if hook is not None:
+                    hook()
+                handler = getattr(self, 'handle_' + name), match.groups()
+                break
+        with mock.lock:
+            queued = mock.queued.get(path)
+            response = queued.pop(0) if queued else mock.overrides.get(path)
+        if response is not None:
+            self.discard()
+            return self.send(*response)
+        if handler is None:
+            self.discard()
+            return self.reply(None, 404)
+        handler[0](mock, *handler[1])
+
+    ################################## RESPONSES ##################################
+
+    def absolute(self, obj):
+        """Prefix the relative selfUrls of a fixture with the base url."""
+        if isinstance(obj, dict):
+            return dict((key, self.base + value if key in ('selfUrl', 'downloadUrl', 'nextPageUrl') else self.absolute(value))
+                        for key, value in obj.items())
+        if isinstance(obj, list):
+            return [self.absolute(value) for value in obj]
+        return obj
+
+    def reply(self, obj, status = 200, selfUrl = None):
+        """Send a JSON response. Successful GET responses carry an ETag and
+        are answered with 304 if the client presents it."""
+        if obj is None:
+            body = ''
+        else:
+            if selfUrl is not None:
+                obj = dict(obj, selfUrl = selfUrl)
+            body = json.dumps(self.absolute(obj))
+        etag = None
+        if self.command == 'GET' and status == 200 and body and self.server.mock.etags:
+            etag = self.etag(body)
+            if self.headers.get('If-None-Match') == etag:
+                with self.server.mock.lock:
+                    self.server.mock.counts['notModified'] += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.write(body)
+
+    def send(self, status, body, headers = ()):
+        """Send a response with a verbatim body."""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.write(body)
+
+    def etag(self, body):
+        return '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+
+    def write(self, data):
+        mock = self.server.mock
+        chunk = 65536
+        for offset in range(0, len(data), chunk):
+            start = time.time()
+            self.wfile.write(data[offset:offset + chunk])
+            if mock.bandwidth:
+                delay = min(chunk, len(data) - offset) / float(mock.bandwidth) - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+        with mock.lock:
+            mock.bytesSent += len(data)
+
+    def chunks(self):
+        """Iterate over the request body in chunks."""
+        length = int(self.headers.get('Content-Length') or 0)
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+        with self.server.mock.lock:
+            self.server.mock.bytesReceived += length
+
+    def read(self):
+        """Read the request body and return it, unless it is a file upload,
+        which is discarded."""
+        if self.headers.get('Content-Type', '').startswith('multipart/'):
+            for chunk in self.chunks():
+                pass
+            return ''
+        return ''.join(self.chunks())
+
+    discard = read
+
+    def receiveFile(self):
+        """Read a multipart upload of a single file without keeping it and
+        return the size and sha1 hex digest of the file."""
+        boundary = self.headers.get('Content-Type', '').split('boundary=')[-1]
+        end = int(self.headers.get('Content-Length') or 0) - len('\r\n--{}--\r\n'.format(boundary))
+        digest = hashlib.sha1()
+        head = ''
+        start = None
+        pos = 0
+        for chunk in self.chunks():
+            if start is None:
+                head += chunk
+                if '\r\n\r\n' not in head:
+                    continue
+                start = pos = head.index('\r\n\r\n') + 4
+                chunk = head[start:]
+            digest.update(chunk[:max(0, end - pos)])
+            pos += len(chunk)
+        return max(0, end - (start or 0)), digest.hexdigest()
+
+    def handle_list(self, mock, resource):
+        items = mock.objects if resource == 'objects' else mock.folders
+        rpp = int(self.query.get('rpp', ['25'])[0])
+        page = int(self.query.get('page', ['1'])[0])
+        keys = sorted(items)[(page - 1) * rpp:page * rpp]
+        result = {'totalCount': len(items),
+                  'items': [dict(items[key], selfUrl = '/{}/{}'.format(resource, key)) for key in keys]}
+        if page * rpp < len(items) and mock.nextPageUrls:
+            result['nextPageUrl'] = '/{}?rpp={}&page={}'.format(resource, rpp, page + 1)
+        self.reply(result)
+
+    def handle_object(self, mock, oid):
+        self.item(mock.objects, 'objects', oid)
+
+    def handle_folder(self, mock, fid):
+        self.item(mock.folders, 'folders', fid)
+
+    def handle_file(self, mock, fileid):
+        self.item(mock.files, 'files', fileid)
+
+    def handle_relation(self, mock, ontotype, relid):
+        self.item(mock.relations.get(int(ontotype), {}), 'object-ontologies/' + ontotype, relid)
+
+    def handle_ontology(self, mock, ontotype, itemid):
+        self.reply({'id': int(itemid), 'type': int(ontotype), 'term': 'Term {}'.format(itemid)},
+                   selfUrl = '/ontologies/{}/{}'.format(ontotype, itemid))
+
+    def handle_right(self, mock, resource, rightid):
+        self.item(mock.rights[resource], resource, rightid)
+
+    def handle_addRight(self, mock, resource):
+        right = json.loads(self.read())
+        oid = int(right['relatedObject']['selfUrl'].rsplit('/', 1)[-1])
+        created = mock.newRight(resource, oid, self.relative(right[_RIGHTS[resource][1]]['selfUrl']),
+                                [{'selfUrl': self.relative(r['selfUrl'])} for r in right['relatedRights']])
+        self.reply(created, selfUrl = '/{}/{}'.format(resource, created['id']))
+
+    def relative(self, url):
+        """The path of a url below the API root, e.g. '/groups/2'."""
+        path = urlparse.urlsplit(url).path
+        return path[4:] if path.startswith('/api/') else path
+
+    def item(self, items, resource, key):
+        item = items.get(int(key))
+        if item is None:
+            return self.reply(None, 404)
+        self.reply(item, selfUrl = '/{}/{}'.format(resource, key))
+
+    def handle_putFolder(self, mock):
+        folder = json.loads(self.read())
+        fid = int(folder['id'])
+        if fid not in mock.folders:
+            return self.reply(None, 404)
+        contained = [{'selfUrl': '/objects/{}'.format(entry['selfUrl'].rstrip('/').rsplit('/', 1)[-1])}
+                     for entry in folder.get('containedObjects') or ()]
+        selfUrl = '/folders/{}'.format(fid)
+        with mock.lock:
+            current = json.dumps(self.absolute(dict(mock.folders[fid], selfUrl = selfUrl)))
+            if mock.etags and self.headers.get('If-Match', self.etag(current)) != self.etag(current):
+                mock.counts['preconditionFailed'] += 1
+                conflict = True
+            else:
+                mock.folders[fid]['containedObjects'] = contained or None
+                conflict = False
+        if conflict:
+            return self.reply(None, 412)
+        self.reply(mock.folders[fid], selfUrl = selfUrl)
+
+    def handle_download(self, mock, fileid):
+        self.discard()
+        if int(fileid) not in mock.files:
+            return self.reply(None, 404)
+        size = mock.filesize
+        etag = '"{}-{}"'.format(mock.digest[:16], mock.files[int(fileid)].get('version', 0))
+        with mock.lock:
+            cutoff = mock.cutoffs.pop(0) if mock.cutoffs else None
+        start = 0
+        status = 200
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) != etag:
+            # changed since the partial transfer, send the whole file
+            with mock.lock:
+                mock.counts['rangeChanged'] += 1
+        elif match and not mock.ignoreRange:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, size - 1, size))
+        self.end_headers()
+        end = size if cutoff is None else min(size, start + cutoff)
+        chunk = 1048576
+        for offset in range(start, end, chunk):
+            self.write(mock.content(offset, min(chunk, end - offset)))
+        if end < size:
+            self.close_connection = True
+
+    def handle_upload(self, mock):
+        size, digest = self.receiveFile()
+        with mock.lock:
+            body = mock.uploadReplies.pop(0) if mock.uploadReplies else None
+        if body is not None:
+            return self.send(200, body)
+        obj = mock.newObject(2, 'segmentation.nii', size = size, digest = digest)
+        result = {'file': obj['files'][0]}
+        if mock.relatedObjects:
+            result['relatedObject'] = {'selfUrl': '/objects/{}'.format(obj['id'])}
+        self.reply(result)
+
+    def handle_link(self, mock):
+        link = json.loads(self.read())
+        ids = [int(link[key]['selfUrl'].rsplit('/', 1)[-1]) for key in ('object1', 'object2')]
+        with mock.lock:
+            linkid = len(mock.links) + 1
+            mock.links[linkid] = link
+            for a, b in (ids, ids[::-1]):
+                if a in mock.objects:
+                    mock.objects[a]['linkedObjects'].append({'selfUrl': '/objects/{}'.format(b)})
+        self.reply({'id': linkid}, selfUrl = '/object-links/{}'.format(linkid))
+
+    def handle_addRelation(self, mock, ontotype):
+        relation = json.loads(self.read())
+        oid = int(relation['object']['selfUrl'].rsplit('/', 1)[-1])
+        itemid = int(relation['ontologyItem']['selfUrl'].rsplit('/', 1)[-1])
+        created = mock.newRelation(int(ontotype), itemid, oid, relation.get('position', 0))
+        with mock.lock:
+            if oid in mock.objects:
+                mock.objects[oid]['ontologyItemRelations'].append(
+                        {'selfUrl': '/object-ontologies/{}/{}'.format(ontotype, created['id'])})
+        self.reply(created, selfUrl = '/object-ontologies/{}/{}'.format(ontotype, created['id']))
@@ -2,6 +2,7 @@
 
 import connectVSD
 import sys
+import logging
 import argparse
 
 parser = argparse.ArgumentParser(description='Download original image files from SMIR to a specific folder.')
@@ -13,10 +14,13 @@ parser.add_argument('--sourceFolderID', dest='sourceFolderID', required=0,
                    help='VSD ID of fodler to download')
 parser.add_argument('--sourceFolderName', dest='sourceFolderName', required=0,
                    help='Folder name of folder to download, must be unique, can contain parentfolders, does not need to be complete')
+parser.add_argument('--workers', dest='workers', type=int, default=4, required=0,
+                   help='number of objects or files downloaded concurrently')
 
 
 
 args=parser.parse_args()
+logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 if (args.targetProject=="" and args.sourceFolderID=="" and args.sourceFolderName==""):
     print "Arguments incomplete, need either ID or name of VSD folder"
@@ -31,8 +35,7 @@ print "Arguments:",args
 if args.sourceFolderID==None:
     #get information of all folders and search for the correct one
     print "Retrieving folder list from SMIR.."
-    folderList=con.getFolderList()
-    folderHash=con.readFolders(folderList)
+    folderIndex=con.getFolderIndex()
     OriginalFolder=None
     if (args.targetProject != ""):
         targetProject=args.targetProject
@@ -40,26 +43,26 @@ if args.sourceFolderID==None:
         
         print "Retrieving target folder IDs from folder list."
         searchstring="SSMPipeline/"+args.targetProject+"/01_Original"
-        for key,folder in folderHash.iteritems():
-            if searchstring in folder.fullName:
-                OriginalFolder=folder
     else:
-        for key,folder in folderHash.iteritems():
-            if args.sourceFolderName in folder.fullName:
-                OriginalFolder=folder
+        searchstring=args.sourceFolderName
+    matches=folderIndex.find(searchstring)
+    if matches:
+        OriginalFolder=matches[-1]
     if OriginalFolder==None:
         print "Error retrieving folder, exiting"
         sys.exit()
-    print "Retrieving file list from folder with ID", OriginalFolder.ID
-    fileIDList=OriginalFolder.containedObjects.keys()
+    print "Downloading objects from folder with ID", OriginalFolder.ID
+    report=con.downloadFolder(OriginalFolder,args.targetFolder,workers=args.workers,recursive=False)
 else:
     fileList=con.getFileListInFolder(args.sourceFolderID)
     fileIDList=con.getFileIDs(fileList)
+    report=connectVSD.TransferReport()
+    for ID in fileIDList:
+        print ID
+        filename=con.generateBaseFilenameFromOntology(ID)
+        filename=args.targetFolder+"/"+filename
+        report.merge(con.downloadFile(ID,filename,workers=args.workers))
 
-
-for ID in fileIDList:
-    print ID
-    filename=con.generateBaseFilenameFromOntology(ID)
-    filename=args.targetFolder+"/"+filename
-    con.downloadFile(ID,filename)
+for url,sfilename,err in report.failed:
+    print "Failed to download",url,"to",sfilename,err
 
@@ -14,7 +14,7 @@ con=connectVSD.VSDConnecter("ZGVtb0B2aXJ0dWFsc2tlbGV0b24uY2g6ZGVtbw==")
 con.seturl("https://demo.virtualskeleton.ch/api/")
 
 print "Retrieving folder list from SMIR.."
-folderList=con.getFolderList()
+folderList=con.getFolderList(fields=connectVSD.FOLDER_FIELDS)
 
 
 folderHash=con.readFolders(folderList)
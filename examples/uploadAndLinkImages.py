@@ -5,11 +5,11 @@ import sys
 import argparse
 
 parser = argparse.ArgumentParser(description='Upload segmentation files to the SMIR to a specific folder, optionally link to source image and create ontology based on a reference segmentation object.')
-parser.add_argument('--targetFolderID', dest='targetFolder', default="./", required=0,
+parser.add_argument('--targetFolderID', dest='targetFolder', type=int, default=None, required=0,
                    help='ID of folder to store images in')
 parser.add_argument('--id', dest='ID', default="./",required=1,
                    help='VSD object ID of original image ')
-parser.add_argument('--referenceSegID', dest='referenceSegID', default="./",required=0,
+parser.add_argument('--referenceSegID', dest='referenceSegID', type=int, default=None,required=0,
                    help='VSD object ID of reference segmentation object for passing the ontology ')
 parser.add_argument('--file', dest='filename', default="./",required=1,
                    help='filename of segmentation to upload')
@@ -25,22 +25,17 @@ if (segmentationOfOriginalObject!=None):
     sys.exit(0)
 
 
-print "Uploading ",args.filename
-segID=con.uploadSegmentation(int(args.ID),args.filename)
-con.addLink(segID,args.ID)
-print "done"
-
 if args.referenceSegID==None:
     args.referenceSegID=con.getLinkedSegmentation(args.ID)
 if args.referenceSegID==None:
     print "No reference seg ID was given on command line or could be found in the database, skipping ontology setting"
-else:
-    con.setOntologyBasedOnReferenceObject(segID,args.referenceSegID)
 
-if (args.targetFolder != None):
-    print "Copying file to target folder"
-    con.addFileToFolder(segID,int(args.targetFolder))
+print "Uploading ",args.filename
+report=con.uploadSegmentations([(args.filename,int(args.ID),args.referenceSegID,args.targetFolder)])
+print report
+for result in report.failed:
+    print "Failed to",result.stage,result.filename,":",result.error
 
 #print "Setting permissions based on reference"
 #con.setRightsBasedOnReferenceObject(segID,args.ID)
-sys.exit()
+sys.exit(0 if report.ok else 1)
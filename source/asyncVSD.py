@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+# asyncVSD 0.1
+# Coroutine interface to the Virtual Skeleton Database REST API, based on
+# trollius, the asyncio port for Python 2.
+
+# system imports
+import functools
+
+# third party imports
+import trollius as asyncio
+from trollius import From, Return
+from concurrent.futures import ThreadPoolExecutor
+
+# own imports
+from connectVSD import VSDConnecter
+
+# code
+class AsyncVSDConnecter(object):
+    """
+    Coroutine version of `VSDConnecter` for use on an asyncio event loop.
+
+    Each coroutine executes the corresponding `VSDConnecter` method on a
+    thread pool, hence URL building, JSON handling, connection pooling and
+    caching are shared with the blocking interface. A semaphore caps the
+    number of requests in flight, such that thousands of calls can be
+    scheduled at once without flooding the server.
+
+    Example: fetch many objects concurrently::
+
+        con = AsyncVSDConnecter('username', 'password')
+        loop = asyncio.get_event_loop()
+        objs = loop.run_until_complete(asyncio.gather(*[con.getObject(oid) for oid in oids]))
+
+    Parameters
+    ----------
+    username : string
+    password : string
+    authstr : string
+        See `VSDConnecter`.
+    maxconcurrent : int
+        Maximum number of requests in flight.
+    connecter : VSDConnecter
+        An existing, configured connecter to use instead of creating one
+        from the credentials.
+    loop : asyncio.AbstractEventLoop
+        The event loop, defaults to the current one.
+    """
+
+    def __init__(self, username = None, password = None, authstr = None,
+                 maxconcurrent = 16, connecter = None, loop = None):
+        if connecter is None:
+            connecter = VSDConnecter(username, password, authstr)
+            connecter.setConnectionPool(poolsize = maxconcurrent, maxperhost = maxconcurrent)
+        self.connecter = connecter
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.semaphore = asyncio.Semaphore(maxconcurrent, loop = self.loop)
+        self.executor = ThreadPoolExecutor(max_workers = maxconcurrent)
+
+    ################################## MISC ##################################
+
+    def setUrl(self, url):
+        """Set the server url.
+
+        Parameters
+        ----------
+        url : string
+        """
+        self.connecter.setUrl(url)
+
+    def close(self):
+        """Shut down the thread pool. Pending calls are completed first."""
+        self.executor.shutdown(wait = True)
+
+    ################################## REST-METHODS ##################################
+
+    @asyncio.coroutine
+    def getBySelfUrl(self, selfurl):
+        """Coroutine version of `VSDConnecter.getBySelfUrl()`."""
+        result = yield From(self.__call(self.connecter.getBySelfUrl, selfurl))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def getObject(self, oid):
+        """Coroutine version of `VSDConnecter.getObject()`."""
+        result = yield From(self.__call(self.connecter.getObject, oid))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def getFolder(self, fid):
+        """Coroutine version of `VSDConnecter.getFolder()`."""
+        result = yield From(self.__call(self.connecter.getFolder, fid))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def uploadFile(self, filename):
+        """Coroutine version of `VSDConnecter.uploadFile()`."""
+        result = yield From(self.__call(self.connecter.uploadFile, filename))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def downloadFile(self, ID, filename, **kwargs):
+        """Coroutine version of `VSDConnecter.downloadFile()`."""
+        result = yield From(self.__call(self.connecter.downloadFile, ID, filename, **kwargs))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def addLink(self, oid1, oid2, description = ""):
+        """Coroutine version of `VSDConnecter.addLink()`."""
+        result = yield From(self.__call(self.connecter.addLink, oid1, oid2, description))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def addOntology(self, oid, ontotype, ontoid):
+        """Coroutine version of `VSDConnecter.addOntology()`."""
+        result = yield From(self.__call(self.connecter.addOntology, oid, ontotype, ontoid))
+        raise Return(result)
+
+    ################################## REQUESTS ##################################
+
+    @asyncio.coroutine
+    def getRequest(self, request):
+        """Coroutine version of `VSDConnecter.getRequest()`."""
+        result = yield From(self.__call(self.connecter.getRequest, request))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def optionsRequest(self, request):
+        """Coroutine version of `VSDConnecter.optionsRequest()`."""
+        result = yield From(self.__call(self.connecter.optionsRequest, request))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def postRequest(self, request, data):
+        """Coroutine version of `VSDConnecter.postRequest()`."""
+        result = yield From(self.__call(self.connecter.postRequest, request, data))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def putRequest(self, request, data = None):
+        """Coroutine version of `VSDConnecter.putRequest()`."""
+        result = yield From(self.__call(self.connecter.putRequest, request, data))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def deleteRequest(self, request):
+        """Coroutine version of `VSDConnecter.deleteRequest()`."""
+        result = yield From(self.__call(self.connecter.deleteRequest, request))
+        raise Return(result)
+
+    @asyncio.coroutine
+    def __call(self, func, *args, **kwargs):
+        """Run a blocking connecter method on the thread pool, once the
+        semaphore admits another request."""
+        with (yield From(self.semaphore)):
+            result = yield From(self.loop.run_in_executor(
+                    self.executor, functools.partial(func, *args, **kwargs)))
+        raise Return(result)
@@ -0,0 +1,357 @@
+"""In-process and on-disk caching of server responses."""
+
+# system imports
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import urlparse
+import threading
+import collections
+
+# code
+def canonical_url(url):
+    """Normalize a resource url for use as cache key.
+
+    The request methods join the base url and the resource with a slash,
+    leading to duplicate slashes that are not present in the selfUrls
+    returned by the server.
+
+    >>> canonical_url('https://demo.virtualskeleton.ch/api//objects/1')
+    'https://demo.virtualskeleton.ch/api/objects/1'
+    """
+    parts = urlparse.urlsplit(url)
+    path = re.sub('/{2,}', '/', parts.path).rstrip('/')
+    return urlparse.urlunsplit((parts.scheme, parts.netloc.lower(), path, parts.query, ''))
+
+def _path(url):
+    return url.split('?', 1)[0]
+
+def _collection(url):
+    """The url of the collection a resource belongs to."""
+    return _path(url).rsplit('/', 1)[0]
+
+def _referenced(data):
+    """The selfUrls of a JSON request payload and of its direct members."""
+    if not isinstance(data, dict):
+        return []
+    return [value['selfUrl'] for value in [data] + data.values()
+            if isinstance(value, dict) and isinstance(value.get('selfUrl'), basestring)]
+
+class ResponseCache(object):
+    """LRU cache for the raw JSON bodies of GET requests with per resource type
+    time-to-live.
+
+    Entries are keyed by the canonical url of the resource, i.e. by its
+    selfUrl. Bodies are kept as strings and decoded on each hit, such that
+    callers can freely modify the returned objects.
+
+    Parameters
+    ----------
+    maxentries : int
+        Maximum number of cached responses.
+    maxbytes : int
+        Maximum total size of the cached responses in bytes.
+    ttl : float
+        Default time-to-live of an entry in seconds.
+    ttls : dict
+        Time-to-live per resource type, i.e. the url path segment naming the
+        collection such as 'objects', 'folders' or 'ontologies'. Overrides
+        `ttl`.
+    """
+
+    def __init__(self, maxentries = 4096, maxbytes = 64 * 1048576, ttl = 60, ttls = None):
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.ttls = {'ontologies': 3600} if ttls is None else ttls
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size = 0
+        self.__entries = collections.OrderedDict()
+        self.__bypath = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def ttlFor(self, url):
+        """The time-to-live of the resource behind url in seconds."""
+        for segment in urlparse.urlsplit(url).path.split('/'):
+            if segment in self.ttls:
+                return self.ttls[segment]
+        return self.ttl
+
+    def get(self, url):
+        """Look up a cached response body.
+
+        Parameters
+        ----------
+        url : string
+
+        Returns
+        -------
+        body : string or None
+            The cached body or None on a miss or if the entry expired.
+        """
+        key = canonical_url(url)
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None and entry[0] >= time.time():
+                self.__entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self.__forget(key, entry)
+            self.misses += 1
+            return None
+
+    def put(self, url, body):
+        """Cache a response body.
+
+        Parameters
+        ----------
+        url : string
+        body : string
+        """
+        key = canonical_url(url)
+        if len(body) > self.maxbytes:
+            return
+        expires = time.time() + self.ttlFor(key)
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.__forget(key, entry)
+            self.__entries[key] = (expires, body)
+            self.__bypath.setdefault(_path(key), set()).add(key)
+            self.size += len(body)
+            while len(self.__entries) > self.maxentries or self.size > self.maxbytes:
+                oldkey, oldentry = self.__entries.popitem(last = False)
+                self.__forget(oldkey, oldentry)
+                self.evictions += 1
+
+    def invalidate(self, url):
+        """Drop the cached responses of a resource and of its collection.
+
+        All query variants of both urls, e.g. the pages of a listing, are
+        dropped as well.
+
+        Parameters
+        ----------
+        url : string
+        """
+        key = canonical_url(url)
+        with self.__lock:
+            for path in (_path(key), _collection(key)):
+                for other in list(self.__bypath.get(path, ())):
+                    entry = self.__entries.pop(other, None)
+                    if entry is not None:
+                        self.__forget(other, entry)
+                        self.invalidations += 1
+
+    def invalidateData(self, data):
+        """Drop the cached responses of all resources referenced by a JSON
+        request payload, i.e. its own selfUrl and those of its direct members,
+        such as the objects of a link or the related object of a right.
+
+        Parameters
+        ----------
+        data : dict
+        """
+        for url in _referenced(data):
+            self.invalidate(url)
+
+    def clear(self):
+        """Drop all entries."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__bypath.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns
+        -------
+        stats : dict
+            hits, misses, evictions, invalidations, entries and bytes.
+        """
+        with self.__lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'entries': len(self.__entries),
+                    'bytes': self.size}
+
+    def __forget(self, key, entry):
+        self.size -= len(entry[1])
+        keys = self.__bypath.get(_path(key))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.__bypath[_path(key)]
+
+class DiskCache(object):
+    """Persistent cache of GET responses that are revalidated with the server.
+
+    Each response is stored as JSON file together with its ETag and
+    Last-Modified headers. Subsequent requests for the same url are sent with
+    If-None-Match / If-Modified-Since, such that an unchanged resource costs
+    a 304 response without body instead of a full transfer. Since responses
+    depend on the credentials, a cache directory should not be shared
+    between users.
+
+    Parameters
+    ----------
+    directory : string
+        The directory holding the cache files. Created if not existing.
+    maxage : float
+        Seconds during which a stored response is served without asking the
+        server. With the default of 0, each use is revalidated. Responses of
+        resources modified through `invalidate()` by this process are
+        revalidated regardless.
+    """
+
+    def __init__(self, directory, maxage = 0):
+        self.directory = directory
+        self.maxage = maxage
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.__expired = {}
+        self.__lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, url):
+        """Load the stored response for a url.
+
+        Parameters
+        ----------
+        url : string
+
+        Returns
+        -------
+        entry : dict or None
+            A dict with the keys 'url', 'body', 'etag', 'lastmodified' and
+            'stored' or None, if no response is stored.
+        """
+        try:
+            with open(self.__filename(url), 'rb') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            self.__count('misses')
+            return None
+        entry['body'] = entry['body'].encode('utf-8')
+        return entry
+
+    def isFresh(self, entry):
+        """Whether an entry may be used without revalidation."""
+        if time.time() - entry['stored'] >= self.maxage:
+            return False
+        with self.__lock:
+            expired = self.__expired.get(_path(entry['url']))
+        return expired is None or entry['stored'] > expired
+
+    def expire(self, url):
+        """Require the stored responses of a url and of all its query
+        variants to be revalidated before their next use."""
+        with self.__lock:
+            self.__expired[_path(canonical_url(url))] = time.time()
+
+    def hit(self, entry):
+        """Record the use of an entry without contacting the server."""
+        self.__count('hits')
+
+    def revalidated(self, entry):
+        """Record that the server confirmed an entry to be unchanged."""
+        self.__count('revalidations')
+        if self.maxage > 0:
+            self.__write(entry['url'], dict(entry, stored = time.time()))
+
+    def put(self, url, body, etag = None, lastmodified = None):
+        """Store a response.
+
+        Responses without validators are not stored, as they can not be
+        revalidated.
+
+        Parameters
+        ----------
+        url : string
+        body : string
+        etag : string
+            The value of the ETag response header.
+        lastmodified : string
+            The value of the Last-Modified response header.
+        """
+        if etag is None and lastmodified is None:
+            return
+        self.__write(url, {'url': canonical_url(url),
+                           'body': body,
+                           'etag': etag,
+                           'lastmodified': lastmodified,
+                           'stored': time.time()})
+
+    def invalidate(self, url):
+        """Remove the stored response of a url and expire those of its
+        query variants and of its collection, see `expire()`."""
+        try:
+            os.remove(self.__filename(url))
+        except OSError:
+            pass
+        key = canonical_url(url)
+        self.expire(key)
+        self.expire(_collection(key))
+
+    def invalidateData(self, data):
+        """Invalidate the stored responses of all resources referenced by a
+        JSON request payload, see `ResponseCache.invalidateData()`."""
+        for url in _referenced(data):
+            self.invalidate(url)
+
+    def clear(self):
+        """Remove all stored responses."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if len(name) == 2 and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors = True)
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns
+        -------
+        stats : dict
+            hits, revalidations and misses.
+        """
+        with self.__lock:
+            return {'hits': self.hits,
+                    'revalidations': self.revalidations,
+                    'misses': self.misses}
+
+    def __count(self, counter):
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __filename(self, url):
+        digest = hashlib.sha1(canonical_url(url)).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+    def __write(self, url, entry):
+        filename = self.__filename(url)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+        fd, tmpname = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump(entry, f)
+        os.rename(tmpname, filename)
@@ -0,0 +1,146 @@
+"""Checksums of transferred files, computed while the data is streamed."""
+
+# system imports
+import os
+import re
+import hashlib
+
+# code
+ALGORITHM = 'sha1'
+"""Default algorithm of the checksums recorded for transferred files."""
+
+HASH_KEYS = ('fileHashCode', 'anonymizedFileHashCode')
+"""Members of a file description that may hold a hex digest of its content.
+The server may deliver either version of the file."""
+
+_HEX_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+def hash_algorithm(code):
+    """Infer the algorithm of a hex digest from its length.
+
+    >>> hash_algorithm('2fd4e1c67a2d28fced849ee1bb76e7391b93eb12')
+    'sha1'
+    >>> hash_algorithm('not a digest') is None
+    True
+    """
+    if not isinstance(code, basestring) or not re.match('^[0-9a-fA-F]+$', code):
+        return None
+    return _HEX_ALGORITHMS.get(len(code))
+
+def expected_digests(fileObj):
+    """Extract the digests of a file from its description.
+
+    Parameters
+    ----------
+    fileObj : dict
+        The file described by a dict constructed from the servers JSON
+        response.
+
+    Returns
+    -------
+    digests : list
+        (algorithm, hexdigest) tuples of the recognized hash codes.
+
+    >>> expected_digests({'size': 3, 'fileHashCode': 'A9993E364706816ABA3E25717850C26C9CD0D89D'})
+    [('sha1', 'a9993e364706816aba3e25717850c26c9cd0d89d')]
+    """
+    digests = []
+    for key in HASH_KEYS:
+        code = fileObj.get(key)
+        algorithm = hash_algorithm(code)
+        if algorithm is not None:
+            digests.append((algorithm, code.lower()))
+    return digests
+
+class ChecksumError(Exception):
+    """The transferred data does not match the size or digest announced by the
+    server."""
+    pass
+
+class Checksum(object):
+    """Incremental hash of a byte stream.
+
+    Besides `algorithm`, the algorithms of the digests to verify against are
+    computed, such that the data needs to be read only once. The size of the
+    data is always counted.
+
+    Parameters
+    ----------
+    algorithm : string or None
+        The hashlib algorithm of `hexdigest()` and `value()`.
+    fileObj : dict
+        The description of the transferred file. Its size and hash codes are
+        checked by `verify()`.
+    extra : iterable
+        Further algorithms to compute, e.g. those of the hash codes the
+        server is expected to report after an upload.
+    """
+
+    def __init__(self, algorithm = ALGORITHM, fileObj = None, extra = ()):
+        self.algorithm = algorithm
+        self.expected = {} if fileObj is None else fileObj
+        self.size = 0
+        names = set(extra).union(name for name, _ in expected_digests(self.expected))
+        if algorithm is not None:
+            names.add(algorithm)
+        self.__hashes = dict((name, hashlib.new(name)) for name in names)
+
+    def update(self, data):
+        """Add a string or buffer to the hash."""
+        for h in self.__hashes.values():
+            h.update(data)
+        self.size += len(data)
+
+    def updateFile(self, path, size = None, bufsize = 1048576):
+        """Add the first size bytes of a file to the hash, e.g. of a partial
+        download that is resumed. None adds the whole file."""
+        if not self.__hashes:
+            self.size += os.path.getsize(path) if size is None else size
+            return
+        with open(path, 'rb') as f:
+            while size is None or size > 0:
+                chunk = f.read(bufsize if size is None else min(bufsize, size))
+                if not chunk:
+                    break
+                self.update(chunk)
+                if size is not None:
+                    size -= len(chunk)
+
+    def hexdigest(self, algorithm = None):
+        """The hex digest of the data so far, by default with `algorithm`."""
+        return self.__hashes[algorithm or self.algorithm].hexdigest()
+
+    def value(self):
+        """The checksum as '<algorithm>:<hexdigest>', as recorded in manifests,
+        or None without algorithm.
+
+        >>> c = Checksum('sha1'); c.update('abc'); c.value()
+        'sha1:a9993e364706816aba3e25717850c26c9cd0d89d'
+        """
+        if self.algorithm is None:
+            return None
+        return '{}:{}'.format(self.algorithm, self.hexdigest())
+
+    def verify(self):
+        """Check the data against the size and digests of the file description.
+
+        The digests are compared if any of them was computed, and the data
+        has to match one of those.
+
+        Raises
+        ------
+        ChecksumError
+            If the data does not match.
+
+        >>> Checksum(fileObj = {'size': 3, 'fileHashCode': 'a9993e364706816aba3e25717850c26c9cd0d89d'}).verify()
+        Traceback (most recent call last):
+        ...
+        ChecksumError: Size mismatch: 0 bytes transferred, 3 expected
+        """
+        size = self.expected.get('size')
+        if size is not None and int(size) != self.size:
+            raise ChecksumError('Size mismatch: {} bytes transferred, {} expected'.format(self.size, size))
+        digests = [(name, code) for name, code in expected_digests(self.expected) if name in self.__hashes]
+        if digests and not any(self.hexdigest(name) == code for name, code in digests):
+            raise ChecksumError('Checksum mismatch: {} {} does not match {}'.format(
+                                digests[0][0], self.hexdigest(digests[0][0]), digests[0][1]))
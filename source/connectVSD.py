@@ -6,16 +6,33 @@
 
 # system imports
 import os
-import sys
+import re
+import socket
 import urllib2
+import httplib
 import base64
+import copy
 import json
+import time
+import atexit
 import logging
+import threading
+import collections
 
 # third party imports
 
 # own imports
-from poster import encode_multipart
+from poster import encode_multipart_stream
+from keepalive import ConnectionPool, build_opener
+from workers import run_parallel, run_pipeline, HostLimiter, TransferReport, SingleFlight, Prefetch, UploadResult, UploadReport
+from cache import ResponseCache, DiskCache, canonical_url
+from manifest import Manifest, file_stamp
+from folderindex import FolderIndex
+from retry import RetryPolicy, CircuitBreaker, is_transient
+from ratelimit import RateLimiter, AIMDController, endpoint_class
+from metrics import Metrics, instrumented
+from decoder import Decoder, FOLDER_FIELDS
+from checksum import Checksum, ChecksumError
 
 # code
 class ConnectVSDException(Exception):
@@ -30,7 +47,38 @@ class RequestException(ConnectVSDException):
     """Request execution exception."""
     def __init__(self, message, errors):
         super(RequestException, self).__init__('{} : Signaled reason: {}'.format(message, errors))
+        self.errors = errors
     
+_RIGHTS = (('/object-group-rights', 'objectGroupRights', 'relatedGroup'),
+           ('/object-user-rights', 'objectUserRights', 'relatedUser'))
+"""The rights of an object: (resource, object member, principal member)."""
+
+def _ontologyKey(rel):
+    """Identify an ontology relation by its type and ontology item."""
+    return rel['type'], canonical_url(rel['ontologyItem']['selfUrl'])
+
+def _rightKey(resource, right):
+    """Identify a right by its kind, group or user and granted rights."""
+    principal = right.get('relatedGroup') or right.get('relatedUser')
+    return resource, canonical_url(principal['selfUrl']), json.dumps(right['relatedRights'], sort_keys = True)
+
+def _rangeValidator(headers):
+    """The validator of a response to send with If-Range when resuming it:
+    its strong ETag or else its Last-Modified date, None without either."""
+    etag = headers.getheader('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        return etag
+    return headers.getheader('Last-Modified')
+
+def _rangeTotal(contentRange):
+    """The complete length of a file announced by a Content-Range header.
+
+    >>> _rangeTotal('bytes */4096'), _rangeTotal('bytes 0-99/4096'), _rangeTotal(None)
+    (4096, 4096, None)
+    """
+    match = re.match(r'bytes\s+(?:\*|\d+-\d+)/(\d+)$', (contentRange or '').strip())
+    return int(match.group(1)) if match else None
+
 class Folder:
     name=''
     fullName=''
@@ -46,6 +94,10 @@ class Folder:
             else:
                 self.fullName=self.parentFolder.getFullName()+"/"+self.name
         return self.fullName
+    def getObjectIDs(self):
+        if self.containedObjects==None:
+            return ()
+        return sorted(int(objID) for objID in self.containedObjects)
 
 class VSDConnecter:
     """
@@ -53,9 +105,30 @@ class VSDConnecter:
     interface.
     
     !TODO: Describe __init__() here.
+    
+    Requests are sent over a per-host pool of persistent HTTP/1.1 connections,
+    see `setConnectionPool()`. Failed requests are retried with backoff and
+    a per-host circuit breaker stops hammering an unavailable server, see
+    `setTimeouts()`, `setRetries()` and `setCircuitBreaker()`. The request
+    rate and concurrency can be limited with `setRateLimits()` and
+    `setConcurrencyController()`. GET responses can optionally be cached in
+    memory, see `setCache()`, and on disk, see `setDiskCache()`.
     """
     
     url = 'https://www.virtualskeleton.ch/api'
+    cache = None
+    diskcache = None
+    concurrency = None
+    metrics = None
+    summary = False
+    __reporting = False
+    downloadretries = 3
+    downloadbackoff = 1.
+    downloadmaxbackoff = 60.
+    checksumalgorithm = 'sha1'
+    verifychecksums = True
+    connecttimeout = 10.
+    readtimeout = 120.
    
     def __init__(self, username = None, password = None, authstr = None):
         if not username is None and not password is None:
@@ -66,6 +139,13 @@ class VSDConnecter:
             raise ConnectionException('Either username and password or the authstr parameters must be provided.')
         
         logging.info("Authorization string: {}".format(self.authstr))
+        
+        self.inflight = SingleFlight()
+        self.setConnectionPool()
+        self.setRetries()
+        self.setCircuitBreaker()
+        self.setRateLimits()
+        self.setDecoder()
     
     ################################## MISC ##################################
     
@@ -78,6 +158,270 @@ class VSDConnecter:
         """
         self.url = url
 
+    def setConnectionPool(self, poolsize = 4, idletimeout = 60, maxperhost = 8):
+        """Configure the pool of persistent connections used for all requests.
+        
+        Parameters
+        ----------
+        poolsize : int
+            Maximum number of idle connections kept open per host. Set to 0 to
+            disable pooling and open a new connection for each request.
+        idletimeout : float
+            Seconds after which an idle connection is discarded.
+        maxperhost : int
+            Maximum number of requests executed concurrently against a single
+            host, when the connecter is shared between threads. None or 0
+            disables the limit.
+        """
+        self.hostlimiter = HostLimiter(maxperhost)
+        if getattr(self, 'pool', None) is not None:
+            self.pool.clear()
+        if poolsize > 0:
+            self.pool = ConnectionPool(poolsize, idletimeout)
+        else:
+            self.pool = None
+        self.opener = build_opener(self.pool)
+
+    def setCache(self, cache = None):
+        """Set the cache for the responses of GET requests.
+        
+        Responses are cached by url, which is the selfUrl for resources
+        retrieved via `getObject()`, `getFolder()` or `getBySelfUrl()`. PUT,
+        POST and DELETE requests invalidate the entries of the resources they
+        address or reference in their payload.
+        
+        Parameters
+        ----------
+        cache : ResponseCache or None
+            The cache to use. None disables caching.
+            
+        Returns
+        -------
+        cache : ResponseCache or None
+            The cache, e.g. to query its `stats()`.
+        """
+        self.cache = cache
+        return cache
+
+    def setDiskCache(self, diskcache = None):
+        """Set the persistent cache for the responses of GET requests.
+        
+        Stored responses are revalidated with the server using their ETag and
+        Last-Modified headers, hence an unchanged resource is not transferred
+        again, even across program runs. The disk cache is consulted after the
+        in-memory cache set with `setCache()`. Like the latter, PUT, POST and
+        DELETE requests invalidate the stored responses of the resources they
+        address or reference in their payload.
+        
+        Parameters
+        ----------
+        diskcache : DiskCache or None
+            The cache to use. None disables it.
+            
+        Returns
+        -------
+        diskcache : DiskCache or None
+            The cache, e.g. to query its `stats()`.
+        """
+        self.diskcache = diskcache
+        return diskcache
+
+    def setTimeouts(self, connect = 10., read = 120.):
+        """Set the timeouts of all requests.
+        
+        Parameters
+        ----------
+        connect : float or None
+            Seconds to wait for a connection to the server. None waits
+            forever.
+        read : float or None
+            Seconds to wait for each read or write on an established
+            connection. None waits forever. Without connection pooling, it
+            applies to connecting as well.
+        """
+        self.connecttimeout = connect
+        self.readtimeout = read
+
+    def setRetries(self, retries = 3, backoff = 0.5, maxbackoff = 30., maxretryafter = 300.):
+        """Configure the repetition of failed requests.
+        
+        Idempotent requests, i.e. all but POST, that fail with a connection
+        error, a timeout or a transient server error such as 503 are
+        repeated after a randomized, exponentially growing delay or after
+        the delay requested by the server with Retry-After. See `RetryPolicy`.
+        
+        Parameters
+        ----------
+        retries : int
+            Maximum number of repetitions per request. 0 disables retries.
+        backoff : float
+            Upper bound of the delay before the first repetition in seconds,
+            doubled for each further repetition.
+        maxbackoff : float
+            Upper bound of the delay in seconds.
+        maxretryafter : float
+            Longest Retry-After delay in seconds that is waited for.
+        """
+        self.retrypolicy = RetryPolicy(retries, backoff, maxbackoff, maxretryafter)
+
+    def setCircuitBreaker(self, threshold = 5, cooldown = 30.):
+        """Configure the per-host circuit breaker.
+        
+        After `threshold` consecutive transient failures against a host,
+        requests to it fail immediately with a RequestException during
+        `cooldown` seconds, instead of adding load to a struggling server.
+        Afterwards a single trial request decides whether normal operation
+        resumes. See `CircuitBreaker`.
+        
+        Parameters
+        ----------
+        threshold : int
+            Number of consecutive failures that open the circuit. None or 0
+            disables the breaker.
+        cooldown : float
+            Seconds requests are rejected.
+        """
+        self.breaker = CircuitBreaker(threshold, cooldown)
+
+    def setRateLimits(self, metadata = None, transfer = None, bursts = None):
+        """Limit the rate of requests sent to the server.
+        
+        The limits are shared by all requests of the connecter, including
+        those of concurrent threads, and apply separately to file transfers,
+        i.e. uploads and downloads, and to all other, metadata requests.
+        
+        Parameters
+        ----------
+        metadata : float or None
+            Maximum average number of metadata requests per second. None
+            disables the limit.
+        transfer : float or None
+            Maximum average number of file transfer requests per second. None
+            disables the limit.
+        bursts : dict
+            Number of requests per endpoint class, 'metadata' or 'transfer',
+            that may be sent at once after a pause. Defaults to the rate.
+        """
+        self.ratelimiter = RateLimiter({'metadata': metadata, 'transfer': transfer}, bursts)
+
+    def setConcurrencyController(self, controller = None):
+        """Set the controller adapting the number of concurrent metadata
+        requests to the server load.
+        
+        The controller caps the requests in flight across all threads using
+        the connecter. It raises the cap while responses arrive quickly and
+        lowers it on slow responses and on 429 or 503 responses.
+        
+        Parameters
+        ----------
+        controller : AIMDController or None
+            The controller to use. None disables it.
+            
+        Returns
+        -------
+        controller : AIMDController or None
+            The controller, e.g. to query its current `limit`.
+        """
+        self.concurrency = controller
+        return controller
+
+    def setMetrics(self, metrics = None, summary = False):
+        """Set the collector of request and helper method metrics.
+        
+        For each request, its method and endpoint, e.g. 'GET
+        /api/objects/{id}', latency, status, response and request size are
+        recorded, as well as retries and cache hits. The durations of the
+        high level helpers such as `generateBaseFilenameFromOntology()` or
+        `downloadFile()` are recorded by name. Without collector, the
+        instrumentation is skipped.
+        
+        Parameters
+        ----------
+        metrics : Metrics or None
+            The collector to use. None disables the collection.
+        summary : bool
+            Print a summary of the metrics installed last to stderr when the
+            program exits.
+            
+        Returns
+        -------
+        metrics : Metrics or None
+            The collector, e.g. to take a `snapshot()`.
+        """
+        self.metrics = metrics
+        self.summary = metrics is not None and summary
+        if self.summary and not self.__reporting:
+            self.__reporting = True
+            atexit.register(self.__report)
+        return metrics
+
+    def __report(self):
+        """Print the summary of the metrics at exit, see `setMetrics()`."""
+        if self.summary and self.metrics is not None:
+            self.metrics.report()
+
+    def setDecoder(self, decoder = None):
+        """Set the decoder of the JSON responses.
+        
+        Parameters
+        ----------
+        decoder : Decoder or None
+            The decoder to use. None uses the fastest installed JSON module,
+            see `Decoder`.
+            
+        Returns
+        -------
+        decoder : Decoder
+            The decoder, e.g. to query its `backend`.
+        """
+        self.decoder = Decoder() if decoder is None else decoder
+        return self.decoder
+
+    def setDownloadRetries(self, retries = 3, backoff = 1., maxbackoff = 60.):
+        """Configure the resumption of interrupted file downloads.
+        
+        A download that fails with a connection error, a premature end of the
+        data or a 5xx server error is resumed from the number of bytes already
+        received with a HTTP Range request. Until completed, the data is kept
+        in a file with the `.part` suffix.
+        
+        Parameters
+        ----------
+        retries : int
+            Maximum number of resumption attempts per file.
+        backoff : float
+            Delay in seconds before the first attempt, doubled for each
+            further attempt.
+        maxbackoff : float
+            Upper bound for the delay in seconds.
+        """
+        self.downloadretries = retries
+        self.downloadbackoff = backoff
+        self.downloadmaxbackoff = maxbackoff
+
+    def setChecksums(self, algorithm = 'sha1', verify = True):
+        """Configure the checksums of transferred files.
+        
+        Files are hashed while they are downloaded or uploaded, so they are
+        never read again for verification. The checksums are reported and
+        recorded in manifests, see `downloadFile()` and `uploadFile()`.
+        
+        Parameters
+        ----------
+        algorithm : string or None
+            The hashlib algorithm of the recorded checksums. The default
+            matches hash codes of 40 hex digits, such that a verified
+            transfer is hashed only once. None disables the checksums.
+        verify : bool
+            Whether to check each transfer against the size and the hash
+            codes of the file description provided by the server. The hash
+            codes are recognized by their length, e.g. 40 hex digits are
+            taken as sha1. After an upload, a hash code can only be compared
+            if it was computed, i.e. if it uses `algorithm`.
+        """
+        self.checksumalgorithm = algorithm
+        self.verifychecksums = verify
+
     def addAuth(self, req):
         """Add the authorization header to a request.
         
@@ -96,13 +440,16 @@ class VSDConnecter:
     
     ################################## REST-METHODS ##################################
 
-    def getBySelfUrl(self, selfurl):
+    def getBySelfUrl(self, selfurl, fields = None):
         """Get the JSON description of a single resource.
         
         Parameters
         ----------
         selfurl : string
             The selfUrl identifier.
+        fields : iterable or None
+            The members to keep in each dict of the response, see
+            `Decoder.loads()`. None keeps all members.
             
         Returns
         -------
@@ -111,7 +458,7 @@ class VSDConnecter:
             the servers JSON response.
         """
         req = urllib2.Request(selfurl)
-        return self.__execute_request(req)
+        return self.__execute_request(req, fields = fields)
 
     def getObject(self, oid):
         """Get the JSON description of a single object.
@@ -130,13 +477,82 @@ class VSDConnecter:
         #!TODO: What happens if the id is wrong? Will there still be some value returned.
         return self.getRequest('/objects/{}'.format(oid))
 
-    def uploadFile(self, filename):
+    @instrumented
+    def getBySelfUrls(self, selfurls, workers = 8):
+        """Get the JSON descriptions of many resources concurrently.
+        
+        Identical urls are requested only once, as are requests for the same
+        resource already in flight in other threads.
+        
+        Parameters
+        ----------
+        selfurls : sequence of strings
+            The selfUrl identifiers.
+        workers : int
+            Maximum number of concurrent requests.
+            
+        Returns
+        -------
+        objjsons : list
+            The resources in the order of `selfurls`. A resource that could
+            not be retrieved is represented by its RequestException instead.
+        """
+        selfurls = list(selfurls)
+        unique = list(set(canonical_url(selfurl) for selfurl in selfurls))
+        
+        def fetch(selfurl):
+            try:
+                return self.getBySelfUrl(selfurl)
+            except RequestException as err:
+                return err
+        
+        results = dict(zip(unique, run_parallel(fetch, unique, workers)))
+        objjsons = []
+        seen = set()
+        for selfurl in selfurls:
+            key = canonical_url(selfurl)
+            result = results[key]
+            if key in seen and not isinstance(result, RequestException):
+                result = copy.deepcopy(result)
+            seen.add(key)
+            objjsons.append(result)
+        return objjsons
+
+    def getObjects(self, oids, workers = 8):
+        """Get the JSON descriptions of many objects concurrently.
+        
+        Parameters
+        ----------
+        oids : sequence of ints
+            The objects ids.
+        workers : int
+            Maximum number of concurrent requests.
+            
+        Returns
+        -------
+        objjsons : list
+            The objects in the order of `oids`. An object that could not be
+            retrieved is represented by its RequestException instead.
+        """
+        return self.getBySelfUrls(['{}/objects/{}'.format(self.url, oid) for oid in oids], workers)
+
+    @instrumented
+    def uploadFile(self, filename, manifest = None):
         """Upload a file.
         
+        The file is streamed from disk while the request is sent, hence memory
+        use does not depend on the file size. Pooled connections send it from
+        a read-only memory map without copying it, see `setConnectionPool()`.
+        The file is hashed while it is sent and verified against the size and
+        hash code of the uploaded file if the server response contains them,
+        see `setChecksums()`.
+        
         Parameters
         ----------
         filename : string
             Path to the file to upload.
+        manifest : Manifest
+            If given, the uploaded file is recorded with its checksum.
             
         Returns
         -------
@@ -144,11 +560,111 @@ class VSDConnecter:
             The server response as JSON dict.
         """
         fields={}
-        files={'file':{ 'filename' : filename, 'content': open(filename, "rb").read()}}
-        data, headers = encode_multipart(fields, files)
+        files={'file':{ 'filename' : filename, 'path': filename}}
+        algorithm = self.checksumalgorithm
+        data, headers = encode_multipart_stream(fields, files, checksum = lambda: Checksum(algorithm))
         req = urllib2.Request('{}/upload'.format(self.url), data, headers)
-        return self.__execute_request(req)
+        upload = self.__execute_request(req)
+        checksum = data.checksums[0]
+        fileObj = upload.get('file') or {}
+        if self.verifychecksums:
+            checksum.expected = fileObj
+            try:
+                checksum.verify()
+            except ChecksumError as err:
+                raise RequestException('Error verifying upload of {}'.format(filename), err)
+        if manifest is not None and 'selfUrl' in fileObj:
+            related = upload.get('relatedObject')
+            oid = None if related is None else int(related['selfUrl'].rstrip('/').split('/')[-1])
+            manifest.record(filename, oid, fileObj['selfUrl'], checksum.size,
+                            file_stamp(fileObj), checksum.value())
+        return upload
     
+    @instrumented
+    def getUploadedObject(self, upload, objtype = None, tries = 5, backoff = 0.5):
+        """Get the object created for an uploaded file.
+        
+        The object is taken from the related object of the upload response
+        or, if missing, from the description of the uploaded file. It is
+        accepted once it contains the uploaded file, otherwise the object
+        referenced by the file description is polled with exponential
+        backoff, as the server may still be processing the file. Only the
+        resources referenced by the server are requested.
+        
+        Parameters
+        ----------
+        upload : dict
+            The server response of `uploadFile()`.
+        objtype : int
+            The expected object type, e.g. 2 for segmentations. If given, the
+            object is polled until it has this type.
+        tries : int
+            Maximum number of times the object is requested.
+        backoff : float
+            Seconds to wait before the second try, doubled for each further
+            try.
+            
+        Returns
+        -------
+        objjson : dict
+            The object described by a dict constructed from the servers JSON
+            response.
+            
+        Raises
+        ------
+        ConnectVSDException
+            If no matching object is found after `tries` requests, or if a
+            response lacks the expected members.
+        """
+        try:
+            fileUrl = canonical_url(upload['file']['selfUrl'])
+            related = upload.get('relatedObject')
+            objUrl = None if related is None else related['selfUrl']
+        except (KeyError, TypeError, AttributeError) as err:
+            raise ConnectVSDException('Malformed upload response {!r}: {!r}'.format(upload, err))
+        for i in range(tries):
+            if i > 0:
+                time.sleep(backoff * 2 ** (i - 1))
+            try:
+                if objUrl is None:
+                    self.__forget(fileUrl)
+                    objUrl = self.__relatedObjectUrl(self.getBySelfUrl(fileUrl))
+                    if objUrl is None:
+                        continue
+                self.__forget(objUrl)
+                obj = self.getBySelfUrl(objUrl)
+                files = obj.get('files') or ()
+                if (any(canonical_url(f['selfUrl']) == fileUrl for f in files)
+                        and (objtype is None or obj.get('type') == objtype)):
+                    return obj
+                # the reference may be wrong or outdated, resolve it again
+                objUrl = None
+            except (KeyError, TypeError, AttributeError) as err:
+                raise ConnectVSDException('Malformed response for uploaded file {}: {!r}'.format(fileUrl, err))
+        raise ConnectVSDException('No object found for uploaded file {} after {} tries'.format(fileUrl, tries))
+
+    def __relatedObjectUrl(self, fileObj):
+        """The selfUrl of the object referenced by a file description or
+        None."""
+        related = fileObj.get('relatedObject') or fileObj.get('object')
+        if related is not None:
+            return related['selfUrl']
+        objs = fileObj.get('objects')
+        if isinstance(objs, dict):
+            objs = objs.get('items')
+        if objs:
+            return objs[0]['selfUrl']
+        return None
+
+    def __forget(self, url):
+        """Drop a resource from the memory cache and require its response
+        stored on disk to be revalidated, such that polling sees the current
+        state."""
+        if self.cache is not None:
+            self.cache.invalidate(url)
+        if self.diskcache is not None:
+            self.diskcache.expire(url)
+
     def deleteObject(self, oid):
         """Delete an (unpublished) object.
         
@@ -159,6 +675,130 @@ class VSDConnecter:
         """
         return self.deleteRequest('/objects/{}'.format(oid))
     
+    def iterItems(self, resource, rpp = None, prefetch = True, fields = None):
+        """Iterate lazily over all items of a paginated list resource.
+        
+        The pages are retrieved one after another by following the
+        `nextPageUrl` of each page. Servers that only report the `totalCount`
+        are paged with the `page` query parameter instead. While the items of
+        one page are consumed, the next page is already retrieved.
+        
+        Parameters
+        ----------
+        resource : string
+            The list resource, e.g. 'objects' or 'folders'.
+        rpp : int
+            Requested number of results per page. None for the servers
+            default.
+        prefetch : bool
+            Whether to retrieve the next page in the background.
+        fields : iterable or None
+            The members to keep in each item, e.g. ('id', 'name'). The other
+            members are dropped while decoding, which saves time and memory
+            on large listings. None keeps all members.
+            
+        Returns
+        -------
+        items : generator
+            The items as dicts constructed from the servers JSON response.
+        """
+        url = '{}/{}'.format(self.url, resource)
+        if rpp is not None:
+            url += '{}rpp={}'.format('&' if '?' in url else '?', rpp)
+        pagenr = 1
+        count = 0
+        page = self.getBySelfUrl(url, fields)
+        while page is not None:
+            if isinstance(page, list):
+                items, nexturl = page, None
+            else:
+                items, nexturl = page.get('items') or [], page.get('nextPageUrl')
+                total = page.get('totalCount')
+                if nexturl is None and items and total is not None and count + len(items) < total:
+                    pagenr += 1
+                    nexturl = '{}{}page={}'.format(url, '&' if '?' in url else '?', pagenr)
+            pending = None
+            if nexturl is not None and prefetch:
+                pending = Prefetch(self.getBySelfUrl, nexturl, fields)
+            for item in items:
+                yield item
+            count += len(items)
+            if nexturl is None:
+                page = None
+            elif pending is not None:
+                page = pending.result()
+            else:
+                page = self.getBySelfUrl(nexturl, fields)
+
+    def iterObjects(self, rpp = None, fields = None):
+        """Iterate lazily over all objects, see `iterItems()`."""
+        return self.iterItems('objects', rpp, fields = fields)
+
+    def iterFolders(self, rpp = None, fields = None):
+        """Iterate lazily over all folders, see `iterItems()`."""
+        return self.iterItems('folders', rpp, fields = fields)
+
+    @instrumented
+    def getFolderList(self, rpp = None, fields = None):
+        """Get the JSON descriptions of all folders from all pages.
+        
+        Parameters
+        ----------
+        rpp : int
+            Requested number of results per page.
+        fields : iterable or None
+            The members to keep in each folder, e.g. `FOLDER_FIELDS` for
+            `readFolders()`, see `iterItems()`. None keeps all members.
+        
+        Returns
+        -------
+        folderlist : dict
+            A dict with the folders under 'items', as expected by
+            `readFolders()`.
+        """
+        return {'items': list(self.iterFolders(rpp, fields))}
+
+    @instrumented
+    def getFolderIndex(self, rpp = None):
+        """Get all folders as indexed folder tree.
+        
+        The folder pages are consumed as they arrive, see `iterFolders()`.
+        
+        Returns
+        -------
+        index : FolderIndex
+        """
+        return FolderIndex(self.iterFolders(rpp, FOLDER_FIELDS))
+
+    @instrumented
+    def refreshFolderIndex(self, index, fids):
+        """Update a folder index with the current state of some folders.
+        
+        The folders are retrieved again, bypassing the in-memory cache and
+        revalidating responses stored on disk, and applied with `FolderIndex.update()`. Folders that no longer exist on
+        the server are removed from the index together with their subfolders.
+        
+        Parameters
+        ----------
+        index : FolderIndex
+        fids : sequence of ints
+            The ids of changed, added or deleted folders.
+        """
+        fids = list(fids)
+        urls = ['{}/folders/{}'.format(self.url, fid) for fid in fids]
+        for url in urls:
+            self.__forget(url)
+        changed = []
+        removed = []
+        for fid, folder in zip(fids, self.getBySelfUrls(urls)):
+            if not isinstance(folder, RequestException):
+                changed.append(folder)
+            elif getattr(folder.errors, 'code', None) == 404:
+                removed.append(fid)
+            else:
+                raise folder
+        index.update(changed, removed)
+
     def getFolder(self, fid):
         """Get the JSON description of a single object.
         
@@ -192,13 +832,90 @@ class VSDConnecter:
         objjson : dict
             The server response as JSON dict.
         """
-        folder = self.getFolder(fid)
-        entry = {'selfUrl': '{}/objects/{}'.format(fid, oid)}
-        if folder['containedObjects'] is not None:
-            folder['containedObjects'].append(entry)
-        else:
-            folder['containedObjects'] = [entry]
-        return self.putRequest('/folders', json.dumps(folder))    
+        return self.addObjectsToFolder([oid], fid)
+
+    @instrumented
+    def addObjectsToFolder(self, oids, fid, retries = 3):
+        """Add many objects to a folder with a single update of the folder.
+        
+        Objects already contained in the folder are skipped. The update is
+        conditional on the ETag of the folder as read, such that a
+        concurrent modification is signaled by the server instead of being
+        overwritten. Servers without ETags are checked by reading the folder
+        again, which has to contain all entries of the update, i.e. the
+        previously contained and the added objects. If the updated folder
+        lacks some of them or the server signals a conflict, the folder is
+        read again and the missing objects are added in another update.
+        
+        Parameters
+        ----------
+        oids : iterable
+            The objects ids.
+        fid : int
+            The folders id.
+        retries : int
+            Maximum number of repeated updates.
+            
+        Returns
+        -------
+        objjson : dict
+            The server response to the last update as JSON dict or the folder,
+            if all objects were already contained.
+        """
+        oids = [int(oid) for oid in oids]
+        url = '{}/folders/{}'.format(self.url, fid)
+        for attempt in range(retries + 1):
+            folder, etag = self.__getVersioned(url)
+            entries = folder['containedObjects'] or []
+            present = set(self.__entryIDs(entries))
+            missing = []
+            for oid in oids:
+                if oid not in present:
+                    present.add(oid)
+                    missing.append(oid)
+            if not missing:
+                return folder
+            folder['containedObjects'] = entries + [{'selfUrl': '{}/objects/{}'.format(self.url, oid)}
+                                                    for oid in missing]
+            req = urllib2.Request('{}/folders'.format(self.url), json.dumps(folder),
+                                  headers = {'Content-Type': 'application/json'})
+            if etag is not None:
+                req.add_header('If-Match', etag)
+            req.get_method = lambda: 'PUT'
+            try:
+                result = self.__execute_request(req)
+            except RequestException as err:
+                if attempt == retries or getattr(err.errors, 'code', None) not in (409, 412):
+                    raise
+                logging.info('Folder {} was modified concurrently, updating again'.format(fid))
+                continue
+            if etag is None:
+                # the server could not reject a concurrent modification
+                stored = set(self.__entryIDs(self.__getVersioned(url)[0]['containedObjects'] or ()))
+                if present <= stored:
+                    return result
+                logging.info('Folder {} lacks {} entries after the update, updating again'.format(fid, len(present - stored)))
+                continue
+            if not isinstance(result, dict) or 'containedObjects' not in result:
+                return result
+            stored = set(self.__entryIDs(result['containedObjects'] or ()))
+            if all(oid in stored for oid in missing):
+                return result
+        raise RequestException('Error adding objects to folder {}'.format(fid),
+                               'objects missing after {} updates'.format(retries + 1))
+
+    def __getVersioned(self, url):
+        """Get a resource from the server, bypassing the caches, and return
+        it along with its ETag, which may be None."""
+        req = urllib2.Request(url)
+        self.addAuth(req)
+        result, body = self.__attempt(req, lambda: self.__read(req))
+        return self.__decode(req, body), result.info().getheader('ETag')
+
+    @staticmethod
+    def __entryIDs(entries):
+        """The object ids of the containedObjects of a folder."""
+        return [int(entry['selfUrl'].rstrip('/').rsplit('/', 1)[-1]) for entry in entries]
 
     def addOntology(self, oid, ontotype, ontoid):
         """Add an ontoloy to an object.
@@ -228,6 +945,22 @@ class VSDConnecter:
                          'ontologyItem': {'selfUrl': '{}/ontologies/{}/{}'.format(self.url, ontotype, ontoid)}}
         return self.postRequest('/object-ontologies/{}'.format(ontotype), json.dumps(onto_relation))
 
+    def addOntologyRelation(self, relation):
+        """Add an ontology relation to an object.
+        
+        Parameters
+        ----------
+        relation : dict
+            The relation with the members 'object', 'type', 'position' and
+            'ontologyItem', as returned by the server for existing relations.
+            
+        Returns
+        -------
+        objjson : dict
+            The server response as JSON dict.
+        """
+        return self.postRequest('/object-ontologies/{}'.format(relation['type']), json.dumps(relation))
+
     def addLink(self, oid1, oid2, description = ""): # !TODO: description is accepted, but does not seem to be settable
         """Create a link between two objects.
         
@@ -252,12 +985,30 @@ class VSDConnecter:
                 'description': description}
         return self.postRequest('/object-links', json.dumps(link))
 
-    def generateBaseFilenameFromOntology(self,ID,prefix=""):
-        fileObject=self.getObject(ID)
+    @instrumented
+    def generateBaseFilenameFromOntology(self,ID,prefix="",fileObject=None):
+        """Generate a filename from the ontology terms of an object.
+        
+        Parameters
+        ----------
+        ID : int
+            The objects id.
+        prefix : string
+            Prepended to the filename.
+        fileObject : dict
+            The objects JSON description, if already retrieved.
+            
+        Returns
+        -------
+        filename : string
+            `<prefix><term>...-<ID>`
+        """
+        if fileObject is None:
+            fileObject=self.getObject(ID)
         filename=prefix
-        for ont in fileObject['ontologyItems']:
-            ontology=self.getObjectByUrl(ont['selfUrl'])
-            print ontology['term']
+        ontologies=self.getBySelfUrls([ont['selfUrl'] for ont in fileObject['ontologyItems']])
+        for ontology in self.__succeeded(ontologies):
+            logging.debug(ontology['term'])
             filename+=ontology['term'].replace(" ","_")
         if filename!="":
             filename+="-"
@@ -265,13 +1016,55 @@ class VSDConnecter:
         return filename
 
     
-    def downloadFile(self,ID,filename,dryRun=False):
+    @instrumented
+    def downloadFile(self, ID, filename, dryRun = False, bufsize = 1048576, workers = 1, fileObject = None, manifest = None):
+        """Download the file(s) of an object.
+        
+        Single file objects are saved as `filename.<ext>`, multi-file objects
+        (e.g. DICOM series) as `filename/<basename>_<count>.<ext>`. Existing
+        files are skipped. Each file is streamed to a `.part` file in chunks
+        and renamed once complete, so memory use is bounded by `bufsize`.
+        Interrupted transfers are resumed, see `setDownloadRetries()`. Each
+        file is verified against the size and hash code reported by the
+        server while it is written, see `setChecksums()`.
+        
+        Parameters
+        ----------
+        ID : int
+            The objects id.
+        filename : string
+            The base filename, without extension.
+        dryRun : bool
+            Only log what would be downloaded.
+        bufsize : int
+            Size in bytes of the chunks read from the server.
+        workers : int
+            Number of files of a multi-file object downloaded concurrently.
+            Requests per host are additionally bounded by the `maxperhost`
+            setting of `setConnectionPool()`.
+        fileObject : dict
+            The objects JSON description, if already retrieved.
+        manifest : Manifest
+            If given, a file is skipped only if the manifest records it as
+            complete copy of the current server file, otherwise it is
+            downloaded again. Downloaded files are recorded with their
+            checksum.
+            
+        Returns
+        -------
+        report : TransferReport
+            The completed, skipped and failed transfers and the checksums of
+            the completed ones. A failed file, including local errors such as
+            a full disk, does not abort the download of the remaining ones.
+            Progress is logged at INFO level.
+        """
         d = os.path.dirname(filename)
         if not os.path.exists(d):
             os.makedirs(d)
 
-        fileObject=self.getObject(ID)
-       
+        if fileObject is None:
+            fileObject=self.getObject(ID)
+        jobs=[]
 
         #return filename
         #if (fileObject['type']==1):
@@ -288,63 +1081,292 @@ class VSDConnecter:
                 extension=fileObject['name'].split(".")[-1]
             else:
                 extension="dcm"
-            for ffile in fileObject['files']:
-                req=urllib2.Request(ffile['selfUrl']+"/download")
-                self.addAuth(req)
-                sfilename=filename+"_"+str(count)+"."+extension
-                if not os.path.exists(sfilename):
-                    print "Downloading",ffile['selfUrl']+"/download","to",sfilename
-                    if not dryRun:
-                        response=""
-                        try:
-                            response=urllib2.urlopen(req)
-                        except urllib2.URLError as err:
-                            print "Error downloading file",ffile['selfUrl'],err
-                            sys.exit()
-                        
-                        local_file = open(sfilename, "wb")
-                        local_file.write(response.read())
-                        local_file.close()
-                else:
-                    print "File",sfilename,"already exists, skipping"
+            ffiles=fileObject['files']
+            if manifest is not None:
+                # the modification stamps are part of the file descriptions
+                ffiles=run_parallel(lambda ffile: self.getBySelfUrl(ffile['selfUrl']), ffiles, workers)
+            for ffile in ffiles:
+                jobs.append((ffile['selfUrl']+"/download", filename+"_"+str(count)+"."+extension, ffile))
                 count+=1
         else:
             #SINGLE FILE
             #get actual file object
             
-            fileObj=self.getObjectByUrl( fileObject['files'][0]['selfUrl'])
-            #print fileObject['id']
-            #print fileObj['id']
+            fileObj=self.getBySelfUrl( fileObject['files'][0]['selfUrl'])
             if fileObject['name']!=None:
                 extension=fileObject['name'].split(".")[-1]
             else:
                 extension="nii"
-            sfilename=filename+"."+extension
-            if not os.path.exists(sfilename):
-                req=urllib2.Request(fileObj['downloadUrl']) #self.url+"/files/"+str(ID)+"/download")
-                print "Downloading",fileObj['downloadUrl'],"to",sfilename
-                self.addAuth(req)
-                response=""
-                if not dryRun:
-                    try:
-                        response=urllib2.urlopen(req)
-                    except urllib2.URLError as err:
-                        print "Error downloading file",ffile['selfUrl'],err
-                        sys.exit()
-           
-                    local_file = open(sfilename, "wb")
-                    local_file.write(response.read())
-                    local_file.close()
-            
+            jobs.append((fileObj['downloadUrl'], filename+"."+extension, fileObj))
+
+        report=TransferReport()
+        pending=[]
+        for url, sfilename, ffile in jobs:
+            if manifest is not None:
+                if manifest.isCurrent(sfilename, ffile['selfUrl'], file_stamp(ffile)):
+                    logging.info('File {} is up to date, skipping'.format(sfilename))
+                    report.addSkipped(sfilename)
+                    continue
+            elif os.path.exists(sfilename):
+                logging.info('File {} already exists, skipping'.format(sfilename))
+                report.addSkipped(sfilename)
+                continue
+            pending.append((url, sfilename, ffile))
 
+        def fetch(job):
+            url, sfilename, ffile = job
+            logging.info('Downloading {} to {}'.format(url, sfilename))
+            if dryRun:
+                return
+            try:
+                size, nbytes, checksum = self.__download(url, sfilename, bufsize, ffile)
+                if manifest is not None:
+                    manifest.record(sfilename, fileObject['id'], ffile['selfUrl'], size, file_stamp(ffile),
+                                    checksum.value())
+                report.addCompleted(sfilename, nbytes, checksum.value())
+            except (RequestException, EnvironmentError) as err:
+                logging.error('Error downloading file {}: {}'.format(url, err))
+                report.addFailed(url, sfilename, err)
 
+        run_parallel(fetch, pending, workers)
+        return report
+
+    @instrumented
+    def downloadFolder(self, folder, target, workers = 4, recursive = True, dryRun = False, bufsize = 1048576, manifest = None):
+        """Download all objects contained in a folder.
+        
+        The folder tree is mirrored below `target`, each object is saved under
+        the name created by `generateBaseFilenameFromOntology()`. Objects
+        contained in several folders are downloaded only once, into the first
+        folder encountered. Each worker fetches the metadata of an object and
+        then its file(s), so metadata requests of some objects overlap with
+        the file transfers of others.
         
+        Parameters
+        ----------
+        folder : Folder or FolderNode
+            The folder to download, as created by `readFolders()` or taken
+            from a `FolderIndex`.
+        target : string
+            The local directory to download to.
+        workers : int
+            Number of objects processed concurrently.
+        recursive : bool
+            Whether to descend into the child folders.
+        dryRun : bool
+            Only log what would be downloaded.
+        bufsize : int
+            Size in bytes of the chunks read from the server.
+        manifest : Manifest
+            Mirror incrementally: only files that are new, changed on the
+            server or incomplete locally according to the manifest are
+            transferred. See `downloadFile()`.
+            
+        Returns
+        -------
+        report : TransferReport
+            The completed, skipped and failed transfers of all objects. A
+            failed object, including local errors, does not abort the
+            download of the remaining ones.
+        """
+        jobs = []
+        seen = set()
+        visited = set()
+        stack = [(folder, target)]
+        while stack:
+            current, path = stack.pop()
+            if current.ID in visited:
+                continue
+            visited.add(current.ID)
+            oids = current.getObjectIDs()
+            if oids:
+                if not os.path.exists(path):
+                    os.makedirs(path)
+                for oid in oids:
+                    if oid not in seen:
+                        seen.add(oid)
+                        jobs.append((oid, path))
+            if recursive and current.childFolders:
+                for child in reversed(current.childFolders):
+                    stack.append((child, os.path.join(path, child.name)))
+        
+        report = TransferReport()
+        
+        def fetch(job):
+            oid, path = job
+            try:
+                fileObject = self.getObject(oid)
+                filename = os.path.join(path, self.generateBaseFilenameFromOntology(oid, fileObject = fileObject))
+                report.merge(self.downloadFile(oid, filename, dryRun = dryRun, bufsize = bufsize,
+                                               fileObject = fileObject, manifest = manifest))
+            except (RequestException, EnvironmentError) as err:
+                logging.error('Error downloading object {}: {}'.format(oid, err))
+                report.addFailed('{}/objects/{}'.format(self.url, oid), path, err)
+        
+        logging.info('Downloading {} objects of folder {} to {}'.format(len(jobs), folder.getFullName(), target))
+        run_parallel(fetch, jobs, workers)
+        logging.info(report)
+        return report
+
+    def __download(self, url, filename, bufsize, fileObj = None):
+        """Stream a file from the server to disk.
+        
+        The data is written to `filename.part` in chunks of `bufsize` bytes,
+        which is renamed to `filename` once the transfer has completed. An
+        interrupted transfer is resumed from the size of the `.part` file with
+        a Range request, see `setDownloadRetries()`. The range is conditional
+        on the ETag or Last-Modified date of the interrupted response, such
+        that a file changed in between is transferred anew. This includes
+        `.part` files left by previous runs, whose file description is
+        retrieved if `fileObj` lacks the size, such that the resumed file
+        can be verified. A `.part` file that already has the size
+        of the file description `fileObj`, or the size the server reports
+        when it rejects the range with 416, is verified and completed without
+        transferring it again. The chunks are hashed as they are written,
+        only the data of a previous run is read again. Unless it matches the
+        size and hash codes of `fileObj`, the file is discarded and
+        downloaded again, see `setChecksums()`.
+        Returns the final file size, the number of bytes transferred and the
+        Checksum.
+        """
+        partname = filename + '.part'
+        if fileObj is not None and fileObj.get('size') is None and 'selfUrl' in fileObj and os.path.exists(partname):
+            # data of a previous run, which can only be checked against the
+            # description of the file
+            fileObj = self.getBySelfUrl(fileObj['selfUrl'])
+        nbytes = 0
+        attempt = 0
+        checksum = None
+        validator = None
+        size = fileObj.get('size') if fileObj else None
+        while True:
+            offset = os.path.getsize(partname) if os.path.exists(partname) else 0
+            if offset and size is not None and offset >= int(size):
+                # left complete by a previous run, e.g. before the rename
+                checksum = self.__completePart(partname, int(size), fileObj, bufsize)
+                if checksum is not None:
+                    break
+                offset = 0
+            req = urllib2.Request(url)
+            self.addAuth(req)
+            if offset > 0:
+                req.add_header('Range', 'bytes={}-'.format(offset))
+                if validator is not None:
+                    req.add_header('If-Range', validator)
+            self.ratelimiter.acquire(url)
+            received = 0
+            start = time.time()
+            try:
+                with self.hostlimiter.slot(url):
+                    response = self.__open(req)
+                    try:
+                        validator = _rangeValidator(response.info())
+                        if response.code != 206:
+                            # full content, the server ignored the range or
+                            # the file changed
+                            offset = 0
+                        if checksum is None or checksum.size != offset:
+                            checksum = Checksum(self.checksumalgorithm, fileObj if self.verifychecksums else None)
+                            if offset:
+                                checksum.updateFile(partname, offset, bufsize)
+                        length = response.info().getheader('Content-Length')
+                        with open(partname, 'ab' if offset else 'wb') as local_file:
+                            while True:
+                                chunk = response.read(bufsize)
+                                if not chunk:
+                                    break
+                                local_file.write(chunk)
+                                checksum.update(chunk)
+                                received += len(chunk)
+                        nbytes += received
+                        if length is not None and received < int(length):
+                            raise httplib.IncompleteRead('', int(length) - received)
+                    finally:
+                        response.close()
+                if self.metrics is not None:
+                    self.metrics.request('GET', url, time.time() - start, response.code, bytesIn = received)
+                checksum.verify()
+                break
+            except ChecksumError as err:
+                # corrupted on the way or on disk, start over
+                os.remove(partname)
+                checksum = None
+                if attempt >= self.downloadretries:
+                    raise RequestException('Error verifying GET request {}'.format(url), err)
+                logging.warning('Download of {} failed verification ({}), retrying'.format(url, err))
+                if self.metrics is not None:
+                    self.metrics.retry('GET', url)
+                attempt += 1
+            except (urllib2.URLError, httplib.HTTPException, socket.error) as err:
+                if self.metrics is not None:
+                    self.metrics.request('GET', url, time.time() - start, getattr(err, 'code', None),
+                                         bytesIn = received, error = True)
+                total = None
+                if isinstance(err, urllib2.HTTPError):
+                    total = _rangeTotal(err.info().getheader('Content-Range'))
+                    err.close()
+                if isinstance(err, urllib2.HTTPError) and err.code == 416 and offset:
+                    # nothing left to transfer if the .part file is complete,
+                    # otherwise it does not match the server file, start over
+                    checksum = self.__completePart(partname, size if total is None else total, fileObj, bufsize)
+                    if checksum is not None:
+                        break
+                    continue
+                if attempt >= self.downloadretries or not self.__retryable(err):
+                    raise RequestException('Error executing GET request {}'.format(url), err)
+                delay = min(self.downloadbackoff * 2 ** attempt, self.downloadmaxbackoff)
+                logging.warning('Download of {} interrupted ({}), resuming in {:.1f}s'.format(url, err, delay))
+                if self.metrics is not None:
+                    self.metrics.retry('GET', url)
+                time.sleep(delay)
+                attempt += 1
+        os.rename(partname, filename)
+        return os.path.getsize(filename), nbytes, checksum
+
+    def __completePart(self, partname, size, fileObj, bufsize):
+        """Verify a `.part` file that is supposed to hold the complete file of
+        `size` bytes. Returns its Checksum, or None after removing the file
+        if it does not match."""
+        if size is not None and os.path.getsize(partname) == int(size):
+            checksum = Checksum(self.checksumalgorithm, fileObj if self.verifychecksums else None)
+            checksum.updateFile(partname, bufsize = bufsize)
+            try:
+                checksum.verify()
+                return checksum
+            except ChecksumError as err:
+                logging.warning('Discarding partial download {} ({})'.format(partname, err))
+        os.remove(partname)
+        return None
+
+    def __retryable(self, err):
+        """Whether a failed download may succeed when resumed."""
+        if isinstance(err, urllib2.HTTPError):
+            return err.code >= 500 or err.code in (408, 416, 429)
+        return True
 
     ##read folder list into linked Folder datastructure
     def readFolders(self,folderList):
+        """Read a folder list into a linked Folder datastructure.
+        
+        Parameters
+        ----------
+        folderList : dict or iterable
+            A dict with the folders under 'items', e.g. from
+            `getFolderList()`, or an iterable of folders, e.g. from
+            `iterFolders()`.
+            
+        Returns
+        -------
+        folderHash : dict
+            The Folder objects by folder id.
+        """
+        if isinstance(folderList, dict):
+            items=folderList['items']
+        else:
+            items=list(folderList)
     #first pass: create one entry for each folder:
         folderHash={}
-        for folder in folderList['items']:
+        for folder in items:
             ID=folder['id']
             folderHash[ID]=Folder()
             folderHash[ID].ID=ID
@@ -352,7 +1374,7 @@ class VSDConnecter:
             folderHash[ID].childFolders=[]
        
     #second pass: create references to parent and child folders
-        for folder in folderList['items']:
+        for folder in items:
             ID=folder['id']
             if (folder['childFolders']!=None):
             #print folder['childFolders'],ID
@@ -385,110 +1407,314 @@ class VSDConnecter:
             
 
 
+    @instrumented
     def getLinkedSegmentation(self,objectID):
         result=None
         obj=self.getObject(objectID)
-        for link in obj['linkedObjects']:
-            linkedObject=self.getObjectByUrl(link['selfUrl'])
+        linkedObjects=self.getBySelfUrls([link['selfUrl'] for link in obj['linkedObjects']])
+        for linkedObject in self.__succeeded(linkedObjects):
             if linkedObject['type']==2:
                 result=linkedObject['id']
         return result
 
 
-    def uploadSegmentation(self,segmentationFilename):
-       
-        #upload Segmentation and get ID
-        segFile=self.uploadFile(segmentationFilename)
-        print segFile
-        print 
-        print
-        segObjID=int(segFile["relatedObject"]["selfUrl"].split("/")[-1])
-        segObj=self.getObject(segObjID)
-        print segObj
-        print 
-        print
-        #check if object is segmentation
-        maxTries=3
-        found=0
-        for i in range(maxTries):
-            if segObj['type']==2 and segObj['files'][0]['selfUrl']==segFile['file']['selfUrl']:
-                print "Found segmentation object with ID",segObj["id"]
-                found=1
-                break
-            else:
-                segObjID+=1
-                segObj=self.getObject(segObjID)
+    @instrumented
+    def uploadSegmentation(self, segmentationFilename):
+        """Upload a segmentation file and return the id of the created
+        segmentation object.
+        
+        Parameters
+        ----------
+        segmentationFilename : string
+            Path to the file to upload.
+            
+        Returns
+        -------
+        oid : int
+            The id of the segmentation object.
+        """
+        segFile = self.uploadFile(segmentationFilename)
+        segObj = self.getUploadedObject(segFile, objtype = 2)
+        return segObj['id']
 
-        if found==0:
-            print "Error retrieving segmentation object after upload, aborting"
-            sys.exit(0)
-        return segObjID
+    @instrumented
+    def uploadSegmentations(self, jobs, workers = 4, postworkers = 4):
+        """Upload segmentations concurrently and link, annotate and file them.
+        
+        The uploads run on one pool of threads. As soon as a file is uploaded,
+        its follow-up steps run on a second pool, while further files are
+        still being uploaded: the new object is linked to its source object,
+        gets the ontology of its reference object, which is retrieved only
+        once per reference object. Finally, the objects are
+        added to their target folders with a single update per folder. A
+        failing file does not abort the batch, its failure is reported
+        instead, whether it is a request error, a local error or a
+        malformed server response.
+        
+        Parameters
+        ----------
+        jobs : iterable
+            (filename, sourceID, referenceID, folderID) tuples. Any of the
+            ids may be None to skip the respective step.
+        workers : int
+            Number of concurrent uploads.
+        postworkers : int
+            Number of concurrently post-processed uploads.
+            
+        Returns
+        -------
+        report : UploadReport
+            The outcome of each file in the order of jobs.
+        """
+        start = time.time()
+        results = [UploadResult(*job) for job in jobs]
+        templates = {}
+        templatelock = threading.Lock()
+        
+        def ontologyOf(referenceID):
+            with templatelock:
+                if referenceID in templates:
+                    return templates[referenceID]
+            template = self.getOntologyTemplate(referenceID)
+            with templatelock:
+                return templates.setdefault(referenceID, template)
+        
+        def upload(result):
+            try:
+                result.oid = self.uploadSegmentation(result.filename)
+                result.steps.append('upload')
+            except Exception as err:
+                result.fail('upload', err)
+        
+        def postprocess(result, _):
+            if not result.ok:
+                return
+            stage = 'link'
+            try:
+                if result.source is not None:
+                    self.addLink(result.oid, result.source)
+                    result.steps.append(stage)
+                stage = 'ontology'
+                if result.reference is not None:
+                    self.__copyOntology(result.oid, ontologyOf(result.reference))
+                    result.steps.append(stage)
+            except Exception as err:
+                result.fail(stage, err)
+        
+        run_pipeline(upload, postprocess, results, workers, postworkers)
+        
+        byfolder = collections.OrderedDict()
+        for result in results:
+            if result.ok and result.folder is not None:
+                byfolder.setdefault(result.folder, []).append(result)
+        for fid, filed in byfolder.items():
+            try:
+                self.addObjectsToFolder([result.oid for result in filed], fid)
+            except Exception as err:
+                for result in filed:
+                    result.fail('folder', err)
+            else:
+                for result in filed:
+                    result.steps.append('folder')
+        return UploadReport(results, start)
 
     def setOntologyBasedOnReferenceObject(self,targetObjectID, origObjectID):
-        origObject=self.getObject(origObjectID)
-
-        #add Ontology relations
-        for ontRel in origObject['ontologyItemRelations']:
-            #print "retrieving ontolgy for relation ",ontRel
-            #print
-            ont=self.getObjectByUrl(ontRel['selfUrl'])
-            #print "found ontology relation:",ont
-            #print
-            newOntRel={}
-            newOntRel["object"]={"selfUrl":self.url+'/objects/'+str(targetObjectID)}
-            newOntRel["type"]=ont["type"]
-            newOntRel["position"]=ont["position"]
-            newOntRel["ontologyItem"]=ont["ontologyItem"]
-            #print "Updated ontology to reflect segmentation object:",newOntRel
-            #print
-            #print "Uploading Ontology"
-            result=self.addOntologyRelation(newOntRel)
-            #print "done, result:",result
-            #print
-            #print
-            #print
-       
+        """Copy the ontology relations of a reference object to an object,
+        skipping relations the object already has.
+        
+        Parameters
+        ----------
+        targetObjectID : int
+            The id of the object to annotate.
+        origObjectID : int
+            The id of the reference object.
+            
+        Returns
+        -------
+        objjsons : list
+            The server responses to the created relations.
+        """
+        return self.__succeeded(self.setOntologyBasedOnReferenceObjects([targetObjectID], origObjectID, workers = 1))[0]
+
+    @instrumented
+    def setOntologyBasedOnReferenceObjects(self, targetObjectIDs, origObjectID, workers = 8):
+        """Copy the ontology relations of a reference object to many objects.
+        
+        The relations of the reference object are retrieved once and then
+        copied to the target objects concurrently. Relations a target object
+        already has, i.e. with the same type and ontology item, are skipped.
+        Repeated target ids are processed once.
+        
+        Parameters
+        ----------
+        targetObjectIDs : iterable
+            The ids of the objects to annotate.
+        origObjectID : int
+            The id of the reference object.
+        workers : int
+            Maximum number of target objects processed concurrently.
+            
+        Returns
+        -------
+        results : list
+            For each target object, in the given order, the list of server
+            responses to the created relations or the RequestException that
+            made copying fail.
+        """
+        template = self.getOntologyTemplate(origObjectID)
+        return self.__propagateAll(self.__copyOntology, targetObjectIDs, template, workers)
 
     def setRightsBasedOnReferenceObject(self,objectID,referenceObjectID):
-        #get reference object
-        referenceObject=self.getObject(referenceObjectID)
-        
-        #set group rights
-        print "Setting group rights"
-        if referenceObject['objectGroupRights'] is not None:
-            for right in referenceObject['objectGroupRights']:
-            #get object
-                rightObject=self.getObjectByUrl(right["selfUrl"])
-               #create new right with the correct objectID
-                newRight={}
-                newRight["relatedRights"]=rightObject["relatedRights"]
-                newRight["relatedGroup"]=rightObject["relatedGroup"]
-                newRight["relatedObject"]={"selfUrl":self.url+"/objects/"+str(objectID)}
-                self.postRequest("/object-group-rights",json.dumps(newRight))
-            
-        #set user rights
-        print "Setting user rights"
-        if referenceObject['objectUserRights'] is not None:
-            
-            for right in referenceObject['objectUserRights']:
-            #get object
-                rightObject=self.getObjectByUrl(right["selfUrl"])
-            #create new right with the correct objectID
-                newRight={}
-                newRight["relatedRights"]=rightObject["relatedRights"]
-                newRight["relatedUser"]=rightObject["relatedUser"]
-                newRight["relatedObject"]={"selfUrl":self.url+"/objects"+str(objectID)}
-                self.postRequest("/object-user-rights",json.dumps(newRight))
-                                       
+        """Copy the group and user rights of a reference object to an object,
+        skipping rights the object already has.
         
+        Parameters
+        ----------
+        objectID : int
+            The id of the object to grant rights on.
+        referenceObjectID : int
+            The id of the reference object.
+            
+        Returns
+        -------
+        objjsons : list
+            The server responses to the created rights.
+        """
+        return self.__succeeded(self.setRightsBasedOnReferenceObjects([objectID], referenceObjectID, workers = 1))[0]
+
+    @instrumented
+    def setRightsBasedOnReferenceObjects(self, objectIDs, referenceObjectID, workers = 8):
+        """Copy the group and user rights of a reference object to many
+        objects.
+        
+        The rights of the reference object are retrieved once and then copied
+        to the objects concurrently. Rights an object already has, i.e. with
+        the same group or user and the same rights, are skipped. Repeated
+        object ids are processed once.
+        
+        Parameters
+        ----------
+        objectIDs : iterable
+            The ids of the objects to grant rights on.
+        referenceObjectID : int
+            The id of the reference object.
+        workers : int
+            Maximum number of objects processed concurrently.
+            
+        Returns
+        -------
+        results : list
+            For each object, in the given order, the list of server responses
+            to the created rights or the RequestException that made copying
+            fail.
+        """
+        template = self.getRightsTemplate(referenceObjectID)
+        return self.__propagateAll(self.__copyRights, objectIDs, template, workers)
+
+    def getOntologyTemplate(self, oid):
+        """Get the ontology relations of an object in the form accepted by
+        `addOntologyRelation()`, without the target object.
+        
+        Parameters
+        ----------
+        oid : int
+            The objects id.
+            
+        Returns
+        -------
+        relations : list of dict
+            The 'type', 'position' and 'ontologyItem' of each relation.
+        """
+        obj = self.getObject(oid)
+        rels = self.getBySelfUrls([rel['selfUrl'] for rel in obj['ontologyItemRelations'] or ()])
+        return [{'type': rel['type'],
+                 'position': rel['position'],
+                 'ontologyItem': rel['ontologyItem']} for rel in self.__succeeded(rels)]
+
+    def getRightsTemplate(self, oid):
+        """Get the group and user rights of an object in the form accepted by
+        the server, without the related object.
+        
+        Parameters
+        ----------
+        oid : int
+            The objects id.
+            
+        Returns
+        -------
+        rights : list
+            (resource, right) tuples, where resource is the collection to
+            post the right to and right holds the 'relatedRights' and the
+            'relatedGroup' or 'relatedUser'.
+        """
+        obj = self.getObject(oid)
+        template = []
+        for resource, member, principal in _RIGHTS:
+            rights = self.getBySelfUrls([right['selfUrl'] for right in obj[member] or ()])
+            for right in self.__succeeded(rights):
+                template.append((resource, {'relatedRights': right['relatedRights'],
+                                            principal: right[principal]}))
+        return template
+
+    def __propagateAll(self, copy, oids, template, workers):
+        """Apply a template to each distinct object concurrently and return
+        the results in the order of oids, repeated for repeated ids."""
+        oids = [int(oid) for oid in oids]
+        distinct = list(collections.OrderedDict.fromkeys(oids))
+        results = run_parallel(lambda oid: self.__propagate(copy, oid, template), distinct, workers)
+        byid = dict(zip(distinct, results))
+        return [byid[oid] for oid in oids]
+
+    def __propagate(self, copy, oid, template):
+        """Apply a template to an object, returning the error instead of
+        raising it."""
+        try:
+            return copy(oid, template)
+        except RequestException as err:
+            return err
+
+    def __copyOntology(self, oid, template):
+        obj = self.getObject(oid)
+        rels = self.getBySelfUrls([rel['selfUrl'] for rel in obj['ontologyItemRelations'] or ()])
+        existing = set(_ontologyKey(rel) for rel in self.__succeeded(rels))
+        created = []
+        for rel in template:
+            if _ontologyKey(rel) not in existing:
+                newRel = dict(rel, object = {'selfUrl': '{}/objects/{}'.format(self.url, oid)})
+                created.append(self.addOntologyRelation(newRel))
+        return created
+
+    def __copyRights(self, oid, template):
+        obj = self.getObject(oid)
+        existing = set()
+        for resource, member, principal in _RIGHTS:
+            rights = self.getBySelfUrls([right['selfUrl'] for right in obj[member] or ()])
+            existing.update(_rightKey(resource, right) for right in self.__succeeded(rights))
+        created = []
+        for resource, right in template:
+            if _rightKey(resource, right) not in existing:
+                newRight = dict(right, relatedObject = {'selfUrl': '{}/objects/{}'.format(self.url, oid)})
+                created.append(self.postRequest(resource, json.dumps(newRight)))
+        return created
+
+    def __succeeded(self, objjsons):
+        """Raise the first error of a batched request, else return the results."""
+        for objjson in objjsons:
+            if isinstance(objjson, RequestException):
+                raise objjson
+        return objjsons
+
     ################################## REQUESTS ##################################
         
-    def getRequest(self, request):
+    def getRequest(self, request, fields = None):
         """Execute a single GET request on the server.
         
         Parameters
         ----------
         request : string
+        fields : iterable or None
+            The members to keep in each dict of the response, see
+            `Decoder.loads()`. None keeps all members.
         
         Returns
         -------
@@ -496,7 +1722,7 @@ class VSDConnecter:
             The server response interpreted as JSON object.
         """
         req = urllib2.Request('{}/{}'.format(self.url, request))
-        return self.__execute_request(req)
+        return self.__execute_request(req, fields = fields)
 
     def optionsRequest(self, request):
         """Execute a single OPTIONS request on the server.
@@ -566,17 +1792,190 @@ class VSDConnecter:
         req.get_method = lambda: 'DELETE' 
         self.__execute_request(req, return_json = False)    
         
-    def __execute_request(self, req, return_json = True):
+    def __open(self, req):
+        """Open a request over the connection pool."""
+        if self.pool is not None:
+            timeout = (self.connecttimeout, self.readtimeout)
+        else:
+            timeout = self.readtimeout
+        return self.opener.open(req, timeout = timeout)
+
+    def __read(self, req):
+        """Open a request and return the response and its whole body."""
+        result = self.__open(req)
+        # read the whole body to hand the connection back to the pool
+        body = result.read()
+        result.close()
+        return result, body
+
+    def __attempt(self, req, transfer):
+        """Execute a request with retries, guarded by the circuit breaker.
+        
+        Parameters
+        ----------
+        req : urllib2.Request
+        transfer : callable
+            Called without arguments to execute the request once. Returns
+            the response, or None if served from the disk cache, and the
+            body, which are returned.
+        """
+        url = req.get_full_url()
+        method = req.get_method()
+        controller = self.concurrency
+        if endpoint_class(url) != 'metadata':
+            # transfer durations do not reflect the server load
+            controller = None
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            if not self.breaker.allow(url):
+                raise RequestException('Error executing {} request {}'.format(method, url),
+                                       'circuit open after repeated failures')
+            self.ratelimiter.acquire(url)
+            start = time.time()
+            try:
+                with self.hostlimiter.slot(url):
+                    if controller is None:
+                        start = time.time()
+                        result = transfer()
+                    else:
+                        with controller.slot():
+                            start = time.time()
+                            result = transfer()
+                        controller.record(time.time() - start)
+            except (urllib2.URLError, httplib.HTTPException, socket.error) as err:
+                if controller is not None:
+                    controller.record(overloaded = getattr(err, 'code', None) in (429, 503))
+                if metrics is not None:
+                    metrics.request(method, url, time.time() - start, getattr(err, 'code', None),
+                                    bytesOut = self.__size(req), error = True)
+                if isinstance(err, urllib2.HTTPError):
+                    err.close()
+                if is_transient(err):
+                    self.breaker.failure(url)
+                else:
+                    self.breaker.success(url)
+                delay = self.retrypolicy.delay(method, attempt, err)
+                if delay is None or not self.__rewind(req):
+                    raise RequestException('Error executing {} request {}'.format(method, url), err)
+                logging.warning('{} request {} failed ({}), retrying in {:.1f}s'.format(method, url, err, delay))
+                if metrics is not None:
+                    metrics.retry(method, url)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.success(url)
+            if metrics is not None:
+                response, body = result
+                if response is None:
+                    metrics.request(method, url, time.time() - start, 304, bytesOut = self.__size(req))
+                else:
+                    metrics.request(method, url, time.time() - start, response.code,
+                                    bytesIn = len(body), bytesOut = self.__size(req))
+            return result
+
+    def __size(self, req):
+        """The size of the body of a request."""
+        data = req.get_data()
+        return 0 if data is None else len(data)
+
+    def __rewind(self, req):
+        """Prepare the body of a request for sending it again."""
+        data = req.get_data()
+        if not hasattr(data, 'read'):
+            return True
+        if not hasattr(data, 'seek'):
+            return False
+        data.seek(0)
+        return True
+
+    def __execute_request(self, req, return_json = True, fields = None):
         """Send a request to the server."""
         self.addAuth(req)
+        url = req.get_full_url()
+        method = req.get_method()
+        if return_json and method == 'GET':
+            if self.cache is not None:
+                body = self.cache.get(url)
+                if body is not None:
+                    if self.metrics is not None:
+                        self.metrics.cacheHit('memory', url)
+                    return self.__decode(req, body, fields)
+            # concurrent requests for the same resource share one transfer
+            body = self.inflight.do(canonical_url(url), lambda: self.__get(req))
+            result = self.__decode(req, body, fields)
+            if self.cache is not None:
+                self.cache.put(url, body)
+            return result
         try:
-            result = urllib2.urlopen(req)
-            if return_json:
-                return json.load(result)
-            else:
-                return
-        except urllib2.URLError as err:
-            raise RequestException('Error executing {} request {}'.format(req.get_method(), req.get_full_url()), err)
+            result, body = self.__attempt(req, lambda: self.__read(req))
+        finally:
+            if method in ('POST', 'PUT', 'DELETE'):
+                self.__invalidate(req)
+        if return_json:
+            return self.__decode(req, body)
+
+    def __decode(self, req, body, fields = None):
+        """Decode a response body, raising a RequestException if it is not
+        valid JSON."""
+        try:
+            return self.decoder.loads(body, fields)
+        except ValueError as err:
+            raise RequestException('Error decoding {} response {}'.format(req.get_method(), req.get_full_url()), err)
+
+    def __get(self, req):
+        """Execute a GET request, revalidating a response stored in the disk
+        cache, and return the response body."""
+        url = req.get_full_url()
+        stored = None
+        if self.diskcache is not None:
+            stored = self.diskcache.get(url)
+            if stored is not None:
+                if self.diskcache.isFresh(stored):
+                    self.diskcache.hit(stored)
+                    if self.metrics is not None:
+                        self.metrics.cacheHit('disk', url)
+                    return stored['body']
+                if stored['etag'] is not None:
+                    req.add_header('If-None-Match', stored['etag'])
+                if stored['lastmodified'] is not None:
+                    req.add_header('If-Modified-Since', stored['lastmodified'])
+        
+        def transfer():
+            try:
+                return self.__read(req)
+            except urllib2.HTTPError as err:
+                if err.code != 304 or stored is None:
+                    raise
+                err.read()
+                err.close()
+                return None, stored['body']
+        
+        result, body = self.__attempt(req, transfer)
+        if result is None:
+            self.diskcache.revalidated(stored)
+            if self.metrics is not None:
+                self.metrics.cacheHit('revalidated', url)
+        elif self.diskcache is not None:
+            headers = result.info()
+            self.diskcache.put(url, body, headers.getheader('ETag'), headers.getheader('Last-Modified'))
+        return body
+
+    def __invalidate(self, req):
+        """Invalidate the cache entries affected by a write request, in
+        memory and on disk."""
+        caches = [cache for cache in (self.cache, self.diskcache) if cache is not None]
+        if not caches:
+            return
+        data = None
+        if isinstance(req.data, basestring):
+            try:
+                data = json.loads(req.data)
+            except ValueError:
+                pass
+        for cache in caches:
+            cache.invalidate(req.get_full_url())
+            cache.invalidateData(data)
 
 
  
@@ -0,0 +1,99 @@
+"""Pluggable JSON decoding of server responses with optional extraction of
+selected fields."""
+
+# code
+BACKENDS = ('ujson', 'simplejson', 'json')
+"""Supported JSON modules, in order of preference."""
+
+STRUCTURE_FIELDS = ('items', 'totalCount', 'nextPageUrl', 'selfUrl')
+"""Members kept in any partial decoding, such that pages can be followed and
+references resolved."""
+
+FOLDER_FIELDS = ('id', 'name', 'parentFolder', 'childFolders', 'containedObjects')
+"""Members of a folder needed to build the folder tree, including the
+contained objects by which `FolderIndex` and `readFolders()` locate
+objects."""
+
+def _import(name):
+    try:
+        return __import__(name)
+    except ImportError:
+        return None
+
+def prune(obj, fields):
+    """Remove the members that are not in fields from a decoded JSON document,
+    in place. Pruned are the members of the document and of each dict in its
+    `items` or, for a list, of each dict in it. Nested values are kept as
+    decoded.
+
+    >>> prune({'items': [{'id': 1, 'name': 'a'}], 'totalCount': 1}, frozenset(['items', 'id']))
+    {'items': [{'id': 1}]}
+    """
+    items = obj
+    if isinstance(obj, dict):
+        _prune(obj, fields)
+        items = obj.get('items')
+    if isinstance(items, list):
+        for item in items:
+            if isinstance(item, dict):
+                _prune(item, fields)
+    return obj
+
+def _prune(members, fields):
+    for key in [key for key in members if key not in fields]:
+        del members[key]
+
+class Decoder(object):
+    """Decodes response bodies with the fastest available JSON module.
+
+    In partial mode, only the requested members of the items of a listing or
+    of a single resource are kept. The body is decoded in full with the C
+    accelerated parser and pruned afterwards, which is faster than dropping
+    members while parsing through parser hooks, as those disable the fast
+    path for every dict. The decoding time is not reduced, but the results
+    held on to, e.g. the pages of a folder listing, are smaller.
+
+    Parameters
+    ----------
+    backend : string or None
+        Name of the JSON module, one of `BACKENDS`. None selects the first
+        one installed.
+    """
+
+    def __init__(self, backend = None):
+        if backend is None:
+            for name in BACKENDS:
+                module = _import(name)
+                if module is not None:
+                    break
+        else:
+            if backend not in BACKENDS:
+                raise ValueError('Unsupported JSON backend {}'.format(backend))
+            module = _import(backend)
+            if module is None:
+                raise ImportError('JSON backend {} is not installed'.format(backend))
+        self.backend = module.__name__
+        self.__module = module
+
+    def loads(self, body, fields = None):
+        """Decode a JSON document.
+
+        Parameters
+        ----------
+        body : string
+        fields : iterable or None
+            The members to keep in each item, in addition to
+            `STRUCTURE_FIELDS`, see `prune()`. None keeps all members.
+
+        Returns
+        -------
+        obj : dict or list
+            The decoded document.
+
+        >>> Decoder('json').loads('{"items": [{"id": 1, "name": "a"}], "totalCount": 1}', ['id'])
+        {u'items': [{u'id': 1}], u'totalCount': 1}
+        """
+        obj = self.__module.loads(body)
+        if fields is None:
+            return obj
+        return prune(obj, frozenset(STRUCTURE_FIELDS).union(fields))
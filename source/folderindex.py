@@ -0,0 +1,347 @@
+"""Compact, indexed representation of the VSD folder tree."""
+
+# system imports
+import bisect
+from array import array
+
+# code
+def _id(selfurl):
+    return int(selfurl.rsplit('/', 1)[-1])
+
+class FolderNode(object):
+    """A folder in a FolderIndex.
+
+    Attributes
+    ----------
+    ID : int
+    name : string
+    fullName : string
+        The path of the folder, i.e. the names from the root down to it
+        separated by slashes.
+    parentFolder : FolderNode or None
+    childFolders : list of FolderNode
+    objectIDs : tuple of ints
+        The ids of the objects contained in the folder.
+    """
+
+    __slots__ = ('ID', 'name', 'fullName', 'parentFolder', 'childFolders', 'objectIDs')
+
+    def __init__(self, ID, name, objectIDs):
+        self.ID = ID
+        self.name = name
+        self.fullName = None
+        self.parentFolder = None
+        self.childFolders = []
+        self.objectIDs = objectIDs
+
+    def __repr__(self):
+        return 'FolderNode({}, {!r})'.format(self.ID, self.fullName)
+
+    def getFullName(self):
+        return self.fullName
+
+    def getObjectIDs(self):
+        return self.objectIDs
+
+class FolderIndex(object):
+    """The folder tree with constant time lookups by id, path and contained
+    object and fast prefix and substring search over the folder paths.
+
+    The index is built in a single pass over the folder list, which may also
+    be a lazy iterator such as `VSDConnecter.iterFolders()`, hence the JSON
+    descriptions of the folders need not be kept in memory. Later changes
+    are applied with `update()`, which only touches the affected subtrees.
+
+    Parameters
+    ----------
+    folderList : dict or iterable
+        A dict with the folders under 'items' or an iterable of folders, each
+        described by a dict constructed from the servers JSON response.
+    """
+
+    def __init__(self, folderList):
+        if isinstance(folderList, dict):
+            folderList = folderList['items']
+        self.__nodes = {}
+        self.__orphans = {}
+        parents = []
+        for folder in folderList:
+            self.__add(folder, parents)
+        for node, parentID in parents:
+            self.__link(node, parentID)
+        for node in self.__nodes.itervalues():
+            self.__resolve(node)
+        self.__reindex()
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def __contains__(self, ID):
+        return ID in self.__nodes
+
+    def __getitem__(self, ID):
+        return self.__nodes[ID]
+
+    def __iter__(self):
+        return self.__nodes.itervalues()
+
+    def get(self, ID, default = None):
+        """Return the folder with an id or default."""
+        return self.__nodes.get(ID, default)
+
+    def roots(self):
+        """Return the folders without parent."""
+        return [node for node in self.__nodes.itervalues() if node.parentFolder is None]
+
+    def byPath(self, path):
+        """Return the folder with a full path, e.g. 'MyProjects/Study/01_Original'.
+
+        If several folders share a path, the one with the lowest id is
+        returned.
+
+        Parameters
+        ----------
+        path : string
+
+        Returns
+        -------
+        folder : FolderNode or None
+        """
+        ID = self.__bypath.get(path)
+        return None if ID is None else self.__nodes[ID]
+
+    def findPrefix(self, prefix):
+        """Return the folders whose full path starts with prefix, ordered by
+        path."""
+        i = bisect.bisect_left(self.__paths, prefix)
+        result = []
+        while i < len(self.__paths) and self.__paths[i].startswith(prefix):
+            result.append(self.__nodes[self.__pathIDs[i]])
+            i += 1
+        return result
+
+    def find(self, substring):
+        """Return the folders whose full path contains substring, ordered by
+        path."""
+        if self.__blob is None:
+            self.__rebuildBlob()
+        blob = self.__blob
+        result = []
+        start = 0
+        while True:
+            pos = blob.find(substring, start)
+            if pos < 0:
+                break
+            i = bisect.bisect_right(self.__offsets, pos) - 1
+            if pos + len(substring) <= self.__offsets[i] + len(self.__paths[i]):
+                result.append(self.__nodes[self.__pathIDs[i]])
+            # continue behind this path
+            start = self.__offsets[i] + len(self.__paths[i]) + 1
+        return result
+
+    def foldersOf(self, oid):
+        """Return the folders containing an object.
+
+        Parameters
+        ----------
+        oid : int
+            The objects id.
+
+        Returns
+        -------
+        folders : list of FolderNode
+        """
+        return [self.__nodes[ID] for ID in self.__byobject.get(int(oid), ())]
+
+    def update(self, folders = (), removed = ()):
+        """Apply changed, added and removed folders.
+
+        Only the full paths of the subtrees below renamed or moved folders
+        are recomputed and only the object lookups of changed folders are
+        updated.
+
+        Parameters
+        ----------
+        folders : iterable
+            The current descriptions of changed or added folders, as dicts
+            constructed from the servers JSON response.
+        removed : iterable
+            The ids of deleted folders. Their subfolders are removed as well.
+        """
+        for ID in removed:
+            if ID in self.__nodes:
+                self.__remove(self.__nodes[ID])
+
+        moved = []
+        dirty = []
+        for folder in folders:
+            node = self.__nodes.get(folder['id'])
+            if node is None:
+                node = self.__add(folder, moved)
+                self.__indexObjects(node)
+                # adopt folders that referenced the new one as parent
+                for child, _ in self.__orphans.pop(node.ID, ()):
+                    moved.append((child, node.ID))
+                dirty.append(node)
+                continue
+            objs = folder.get('containedObjects') or ()
+            objectIDs = tuple(_id(obj['selfUrl']) for obj in objs)
+            if objectIDs != node.objectIDs:
+                self.__unindexObjects(node)
+                node.objectIDs = objectIDs
+                self.__indexObjects(node)
+            parent = folder.get('parentFolder')
+            parentID = None if parent is None else _id(parent['selfUrl'])
+            oldParentID = None if node.parentFolder is None else node.parentFolder.ID
+            if parentID != oldParentID:
+                moved.append((node, parentID))
+                dirty.append(node)
+            if folder['name'] != node.name:
+                node.name = folder['name']
+                dirty.append(node)
+
+        for node, parentID in moved:
+            self.__unlink(node)
+            self.__link(node, parentID)
+        repathed = set()
+        for node in dirty:
+            if node.ID not in repathed:
+                repathed.update(n.ID for n in self.__repath(node))
+
+    def walk(self, ID):
+        """Iterate over a folder and all its descendants, depth first."""
+        stack = [self.__nodes[ID]]
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if node.ID in seen:
+                continue
+            seen.add(node.ID)
+            yield node
+            stack.extend(reversed(node.childFolders))
+
+    def __add(self, folder, parents):
+        objs = folder.get('containedObjects') or ()
+        node = FolderNode(folder['id'], folder['name'], tuple(_id(obj['selfUrl']) for obj in objs))
+        self.__nodes[node.ID] = node
+        parent = folder.get('parentFolder')
+        parents.append((node, None if parent is None else _id(parent['selfUrl'])))
+        return node
+
+    def __link(self, node, parentID):
+        parent = self.__nodes.get(parentID)
+        if parent is not None:
+            node.parentFolder = parent
+            parent.childFolders.append(node)
+        elif parentID is not None:
+            # the parent is not (yet) known, treat the folder as root
+            self.__orphans.setdefault(parentID, []).append((node, parentID))
+
+    def __unlink(self, node):
+        if node.parentFolder is not None:
+            node.parentFolder.childFolders.remove(node)
+            node.parentFolder = None
+        for parentID, orphans in self.__orphans.items():
+            remaining = [entry for entry in orphans if entry[0] is not node]
+            if len(remaining) != len(orphans):
+                if remaining:
+                    self.__orphans[parentID] = remaining
+                else:
+                    del self.__orphans[parentID]
+
+    def __remove(self, root):
+        """Remove a folder and its descendants."""
+        nodes = list(self.walk(root.ID))
+        self.__unlink(root)
+        for node in nodes:
+            self.__unindexPath(node)
+            self.__unindexObjects(node)
+            self.__orphans.pop(node.ID, None)
+            del self.__nodes[node.ID]
+
+    def __repath(self, root):
+        """Recompute the full paths of a folder and its descendants and return
+        the affected folders."""
+        nodes = list(self.walk(root.ID))
+        for node in nodes:
+            if node.fullName is not None:
+                self.__unindexPath(node)
+            parent = node.parentFolder
+            if parent is None or parent.fullName is None:
+                node.fullName = node.name
+            else:
+                node.fullName = u'{}/{}'.format(parent.fullName, node.name)
+            self.__indexPath(node)
+        return nodes
+
+    def __indexPath(self, node):
+        i = bisect.bisect_right(self.__paths, node.fullName)
+        self.__paths.insert(i, node.fullName)
+        self.__pathIDs.insert(i, node.ID)
+        if node.ID < self.__bypath.get(node.fullName, node.ID + 1):
+            self.__bypath[node.fullName] = node.ID
+        self.__blob = None
+
+    def __unindexPath(self, node):
+        path = node.fullName
+        lo = bisect.bisect_left(self.__paths, path)
+        hi = bisect.bisect_right(self.__paths, path)
+        for i in range(lo, hi):
+            if self.__pathIDs[i] == node.ID:
+                del self.__paths[i]
+                self.__pathIDs.pop(i)
+                hi -= 1
+                break
+        if self.__bypath.get(path) == node.ID:
+            if lo < hi:
+                self.__bypath[path] = min(self.__pathIDs[i] for i in range(lo, hi))
+            else:
+                del self.__bypath[path]
+        self.__blob = None
+
+    def __indexObjects(self, node):
+        for oid in node.objectIDs:
+            self.__byobject.setdefault(oid, []).append(node.ID)
+
+    def __unindexObjects(self, node):
+        for oid in node.objectIDs:
+            IDs = self.__byobject.get(oid)
+            if IDs is not None and node.ID in IDs:
+                IDs.remove(node.ID)
+                if not IDs:
+                    del self.__byobject[oid]
+
+    def __resolve(self, node):
+        """Compute the full path of a folder and its ancestors."""
+        chain = []
+        current = node
+        while current is not None and current.fullName is None and current not in chain:
+            chain.append(current)
+            current = current.parentFolder
+        prefix = None if current is None else current.fullName
+        for node in reversed(chain):
+            node.fullName = node.name if prefix is None else u'{}/{}'.format(prefix, node.name)
+            prefix = node.fullName
+
+    def __reindex(self):
+        """Rebuild the path and object lookup structures."""
+        entries = sorted((node.fullName, node.ID) for node in self.__nodes.itervalues())
+        self.__paths = [path for path, _ in entries]
+        self.__pathIDs = array('l', (ID for _, ID in entries))
+        self.__rebuildBlob()
+        self.__bypath = {}
+        for path, ID in entries:
+            self.__bypath.setdefault(path, ID)
+        self.__byobject = {}
+        for node in self.__nodes.itervalues():
+            for oid in node.objectIDs:
+                self.__byobject.setdefault(oid, []).append(node.ID)
+
+    def __rebuildBlob(self):
+        """Join the sorted paths into one string for the substring search."""
+        self.__offsets = array('l')
+        offset = 0
+        for path in self.__paths:
+            self.__offsets.append(offset)
+            offset += len(path) + 1
+        self.__blob = u'\0'.join(self.__paths)
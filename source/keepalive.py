@@ -0,0 +1,331 @@
+"""Persistent HTTP/1.1 connections for urllib2."""
+
+# system imports
+import time
+import errno
+import socket
+import httplib
+import urllib2
+import threading
+import collections
+
+# own imports
+from retry import IDEMPOTENT_METHODS
+
+# code
+class ConnectionPool(object):
+    """Per-host pool of idle, persistent HTTP connections.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of idle connections kept per host.
+    idletimeout : float
+        Seconds after which an idle connection is considered stale and closed
+        instead of being reused.
+    """
+
+    def __init__(self, maxsize = 4, idletimeout = 60):
+        self.maxsize = maxsize
+        self.idletimeout = idletimeout
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """Take an idle connection for a host from the pool.
+
+        Parameters
+        ----------
+        key : tuple
+            The (scheme, host) pair identifying the server.
+
+        Returns
+        -------
+        conn : httplib.HTTPConnection or None
+            A connection that was idle for at most `idletimeout` seconds or None,
+            if no such connection is available.
+        """
+        now = time.time()
+        stale = []
+        conn = None
+        with self.__lock:
+            conns = self.__idle.get(key)
+            while conns:
+                candidate, stamp = conns.pop()
+                if now - stamp <= self.idletimeout:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        return conn
+
+    def put(self, key, conn):
+        """Return a connection to the pool or close it if the pool is full.
+
+        Parameters
+        ----------
+        key : tuple
+            The (scheme, host) pair identifying the server.
+        conn : httplib.HTTPConnection
+        """
+        with self.__lock:
+            conns = self.__idle.setdefault(key, collections.deque())
+            if len(conns) < self.maxsize:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+class PooledResponse(object):
+    """File-like response that hands its connection back to the pool once the
+    body has been consumed completely."""
+
+    def __init__(self, pool, key, conn, response, url):
+        self.__pool = pool
+        self.__key = key
+        self.__conn = conn
+        self.__response = response
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def read(self, amt = None):
+        if amt is None:
+            data = self.__response.read()
+        else:
+            data = self.__response.read(amt)
+        if self.__response.isclosed():
+            self.__release()
+        return data
+
+    def readline(self, limit = -1):
+        # httplib responses do not implement a length aware readline
+        line = []
+        while limit < 0 or len(line) < limit:
+            char = self.read(1)
+            if not char:
+                break
+            line.append(char)
+            if char == '\n':
+                break
+        return ''.join(line)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        if not self.__response.isclosed():
+            # unread body: the connection can not be reused
+            conn, self.__conn = self.__conn, None
+            if conn is not None:
+                conn.close()
+        self.__release()
+
+    def __release(self):
+        conn, self.__conn = self.__conn, None
+        if conn is None:
+            return
+        if self.__response.will_close or self.__response.length:
+            # the server closes the connection or it dropped it prematurely
+            conn.close()
+        else:
+            self.__pool.put(self.__key, conn)
+
+def _connection_dead(err):
+    """Whether a request failed because the server had closed the connection
+    before any byte of the response arrived, e.g. an idle persistent
+    connection, such that the server can not have processed the request."""
+    if isinstance(err, socket.timeout):
+        return False
+    if isinstance(err, httplib.BadStatusLine):
+        line = err.line
+        return not line or line == "''" or line.startswith('No status line received')
+    if isinstance(err, socket.error):
+        return err.errno in (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+    return False
+
+def _timeouts(timeout):
+    """Split a request timeout into connect and read timeout."""
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+class _NoDelayMixin(object):
+    """Disable Nagle's algorithm, which otherwise delays small requests on a
+    reused connection until the server acknowledges the previous segment,
+    and apply a separate timeout to the socket operations after connecting."""
+
+    readtimeout = socket._GLOBAL_DEFAULT_TIMEOUT
+
+    def connect(self):
+        super(_NoDelayMixin, self).connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.setReadTimeout(self.readtimeout)
+
+    def setReadTimeout(self, timeout):
+        """Set the timeout of socket operations on the connection."""
+        self.readtimeout = timeout
+        if self.sock is not None and timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            self.sock.settimeout(timeout)
+
+class _ZeroCopyMixin(object):
+    """Send request bodies that provide their contents as buffers, such as
+    `poster.MultipartBody`, without copying them. httplib instead reads
+    file-like bodies in blocks of 8 KiB, each read into a new string."""
+
+    def send(self, data):
+        buffers = getattr(data, 'buffers', None)
+        if buffers is None:
+            return super(_ZeroCopyMixin, self).send(data)
+        if self.sock is None:
+            if not self.auto_open:
+                raise httplib.NotConnected()
+            self.connect()
+        for buf in buffers():
+            # not sendall(), which slices, i.e. copies, the remaining data
+            while len(buf):
+                buf = buffer(buf, self.sock.send(buf))
+
+class HTTPConnection(_ZeroCopyMixin, _NoDelayMixin, httplib.HTTPConnection, object):
+    pass
+
+class HTTPSConnection(_ZeroCopyMixin, _NoDelayMixin, httplib.HTTPSConnection, object):
+    pass
+
+class _KeepAliveMixin(object):
+    """Shared request execution of the keep-alive handlers."""
+
+    def _pooled_open(self, scheme, connect, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        headers['Connection'] = 'keep-alive'
+
+        key = (scheme, host)
+        connecttimeout, readtimeout = _timeouts(req.timeout)
+        conn = self.pool.get(key)
+        reused = conn is not None
+        if not reused:
+            conn = connect(host, connecttimeout)
+        conn.setReadTimeout(readtimeout)
+        try:
+            response = self.__send(conn, req, headers)
+        except (socket.error, httplib.HTTPException) as err:
+            conn.close()
+            if not reused or not self.__resendable(req, err) or not self.__rewind(req.data):
+                raise urllib2.URLError(err)
+            # the server dropped the idle connection, try once on a fresh one
+            conn = connect(host, connecttimeout)
+            conn.setReadTimeout(readtimeout)
+            try:
+                response = self.__send(conn, req, headers)
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                raise urllib2.URLError(err)
+        return PooledResponse(self.pool, key, conn, response, req.get_full_url())
+
+    def __resendable(self, req, err):
+        """Whether a request that failed on a reused connection may be sent
+        again. A timeout is never resent, as the server may still be
+        processing the request. Other failures are resent for idempotent
+        methods, and for all methods only if the connection was dead."""
+        if isinstance(err, socket.timeout):
+            return False
+        return req.get_method() in IDEMPOTENT_METHODS or _connection_dead(err)
+
+    def __rewind(self, data):
+        """Prepare a request body for sending it again."""
+        if not hasattr(data, 'read'):
+            return True
+        if not hasattr(data, 'seek'):
+            return False
+        data.seek(0)
+        return True
+
+    def __send(self, conn, req, headers):
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        return conn.getresponse(buffering = True)
+
+class KeepAliveHandler(_KeepAliveMixin, urllib2.HTTPHandler):
+    """urllib2 handler that reuses persistent connections for http:// urls.
+
+    Parameters
+    ----------
+    pool : ConnectionPool
+        The pool to take connections from and return them to.
+    """
+
+    def __init__(self, pool, debuglevel = 0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        if req._tunnel_host:
+            return urllib2.HTTPHandler.http_open(self, req)
+        return self._pooled_open('http', self.__connect, req)
+
+    def __connect(self, host, timeout):
+        return HTTPConnection(host, timeout = timeout)
+
+class HTTPSKeepAliveHandler(_KeepAliveMixin, urllib2.HTTPSHandler):
+    """urllib2 handler that reuses persistent connections for https:// urls.
+
+    Parameters
+    ----------
+    pool : ConnectionPool
+        The pool to take connections from and return them to.
+    """
+
+    def __init__(self, pool, debuglevel = 0, context = None):
+        urllib2.HTTPSHandler.__init__(self, debuglevel, context)
+        self.pool = pool
+
+    def https_open(self, req):
+        if req._tunnel_host:
+            return urllib2.HTTPSHandler.https_open(self, req)
+        return self._pooled_open('https', self.__connect, req)
+
+    def __connect(self, host, timeout):
+        return HTTPSConnection(host, timeout = timeout, context = self._context)
+
+def build_opener(pool):
+    """Create an urllib2 opener that routes http(s) requests through a pool.
+
+    Requests opened with a (connect, read) tuple as timeout wait at most the
+    first for a new connection and the second for each socket operation.
+
+    Parameters
+    ----------
+    pool : ConnectionPool or None
+        The connection pool. If None, a plain urllib2 opener is returned.
+
+    Returns
+    -------
+    opener : urllib2.OpenerDirector
+    """
+    if pool is None:
+        return urllib2.build_opener()
+    return urllib2.build_opener(KeepAliveHandler(pool), HTTPSKeepAliveHandler(pool))
@@ -0,0 +1,211 @@
+"""Local manifest of downloaded files for incremental mirroring."""
+
+# system imports
+import os
+import json
+import threading
+
+# own imports
+from checksum import Checksum
+
+# code
+STAMP_KEYS = ('size', 'fileHashCode', 'anonymizedFileHashCode', 'createdDate')
+"""Members of a file description that change when the file changes."""
+
+def file_stamp(fileObj):
+    """Extract the modification stamp from a file description.
+
+    Parameters
+    ----------
+    fileObj : dict
+        The file described by a dict constructed from the servers JSON
+        response.
+
+    Returns
+    -------
+    stamp : dict or None
+        The members of `STAMP_KEYS` present in the description or None, if
+        there are none.
+
+    >>> sorted(file_stamp({'selfUrl': 'x', 'size': 10, 'createdDate': 'y'}).items())
+    [('createdDate', 'y'), ('size', 10)]
+    >>> file_stamp({'selfUrl': 'x'}) is None
+    True
+    """
+    stamp = dict((key, fileObj[key]) for key in STAMP_KEYS if fileObj.get(key) is not None)
+    return stamp or None
+
+class Manifest(object):
+    """Record of the files downloaded into a local mirror.
+
+    For each local file, the manifest stores the object id, the selfUrl of the
+    file on the server, its size, modification time and checksum and the
+    server side modification stamp. It
+    is kept as journal of JSON lines next to the mirror, such that recording
+    a file is a cheap append and survives crashes; later lines supersede
+    earlier ones. Filenames are stored relative to the manifest's directory.
+
+    Parameters
+    ----------
+    path : string
+        The manifest file. Loaded if existing, created on first record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.entries = {}
+        self.__lock = threading.Lock()
+        if os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, filename):
+        return self.__key(filename) in self.entries
+
+    def load(self):
+        """(Re-)load the manifest from disk, ignoring a truncated last line."""
+        entries = {}
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('deleted'):
+                    entries.pop(entry['file'], None)
+                else:
+                    entries[entry['file']] = entry
+        self.entries = entries
+
+    def get(self, filename):
+        """Return the entry of a local file or None."""
+        return self.entries.get(self.__key(filename))
+
+    def isCurrent(self, filename, url, stamp = None):
+        """Whether a local file is a complete copy of the current server file.
+
+        Parameters
+        ----------
+        filename : string
+            The local file.
+        url : string
+            The selfUrl of the file on the server.
+        stamp : dict
+            The current modification stamp of the server file, see
+            `file_stamp()`. If None, only the url is compared.
+
+        Returns
+        -------
+        current : bool
+            False if the file is not recorded, was recorded for another url
+            or stamp or if its size differs from the recorded one, e.g.
+            because it was truncated. If its modification time differs, the
+            file is hashed and compared to the recorded checksum; without
+            checksum it is not current.
+        """
+        entry = self.get(filename)
+        if entry is None or entry['url'] != url:
+            return False
+        if stamp is not None and entry['stamp'] != stamp:
+            return False
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return False
+        if st.st_size != entry['size']:
+            return False
+        if entry.get('mtime') is None or st.st_mtime == entry['mtime']:
+            return True
+        if entry.get('checksum') is None:
+            return False
+        algorithm = entry['checksum'].split(':', 1)[0]
+        checksum = Checksum(algorithm)
+        checksum.updateFile(filename)
+        if checksum.value() != entry['checksum']:
+            return False
+        # unchanged content, remember the new time to skip hashing next time
+        entry = dict(entry, mtime = st.st_mtime)
+        self.__append(entry)
+        self.entries[entry['file']] = entry
+        return True
+
+    def checksum(self, filename):
+        """Return the recorded checksum of a local file, if the file was not
+        modified since it was recorded, such that it need not be hashed again.
+
+        Returns
+        -------
+        checksum : string or None
+            '<algorithm>:<hexdigest>' or None if the file is not recorded
+            with a checksum or its size or modification time differ from the
+            recorded ones.
+        """
+        entry = self.get(filename)
+        if entry is None or entry.get('checksum') is None:
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if st.st_size != entry['size'] or st.st_mtime != entry.get('mtime'):
+            return None
+        return entry['checksum']
+
+    def record(self, filename, oid, url, size, stamp = None, checksum = None, **extra):
+        """Record a completely downloaded or uploaded file.
+
+        Parameters
+        ----------
+        filename : string
+            The local file.
+        oid : int
+            The id of the object the file belongs to.
+        url : string
+            The selfUrl of the file on the server.
+        size : int
+            The file size in bytes.
+        stamp : dict
+            The modification stamp of the server file.
+        checksum : string
+            The checksum of the file as '<algorithm>:<hexdigest>', see
+            `checksum.Checksum.value()`.
+        extra
+            Additional members stored with the entry.
+        """
+        entry = dict(extra)
+        entry.update({'file': self.__key(filename),
+                      'oid': oid,
+                      'url': url,
+                      'size': size,
+                      'stamp': stamp,
+                      'checksum': checksum,
+                      'mtime': os.path.getmtime(filename) if os.path.exists(filename) else None})
+        self.__append(entry)
+        self.entries[entry['file']] = entry
+
+    def remove(self, filename):
+        """Remove the entry of a local file."""
+        key = self.__key(filename)
+        if key in self.entries:
+            self.__append({'file': key, 'deleted': True})
+            del self.entries[key]
+
+    def compact(self):
+        """Rewrite the journal with one line per current entry."""
+        with self.__lock:
+            tmpname = self.path + '.tmp'
+            with open(tmpname, 'wb') as f:
+                for key in sorted(self.entries):
+                    f.write(json.dumps(self.entries[key], sort_keys = True) + '\n')
+            os.rename(tmpname, self.path)
+
+    def __key(self, filename):
+        return os.path.relpath(os.path.abspath(filename), self.root)
+
+    def __append(self, entry):
+        with self.__lock:
+            with open(self.path, 'ab') as f:
+                f.write(json.dumps(entry, sort_keys = True) + '\n')
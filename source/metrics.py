@@ -0,0 +1,259 @@
+"""Instrumentation of requests and helper methods."""
+
+# system imports
+import re
+import sys
+import json
+import time
+import bisect
+import urlparse
+import functools
+import threading
+
+# code
+LATENCY_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1., 2.5, 5., 10., 25., 60., 150., 300.)
+"""Upper bounds of the latency histogram buckets in seconds."""
+
+def endpoint_template(url):
+    """Reduce a request url to its endpoint, replacing ids by placeholders.
+
+    >>> endpoint_template('https://demo.virtualskeleton.ch/api//objects/12?rpp=5')
+    '/api/objects/{id}'
+    >>> endpoint_template('https://demo.virtualskeleton.ch/api/ontologies/0/7')
+    '/api/ontologies/{id}/{id}'
+    """
+    path = re.sub('/{2,}', '/', urlparse.urlsplit(url).path).rstrip('/')
+    return re.sub('/[0-9]+(?=/|$)', '/{id}', path)
+
+class Histogram(object):
+    """Latency histogram with fixed buckets.
+
+    Parameters
+    ----------
+    bounds : tuple
+        The ascending upper bounds of the buckets in seconds. Larger values
+        are counted in an overflow bucket.
+    """
+
+    def __init__(self, bounds = LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket containing it,
+        limited to the observed maximum."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.max if i == len(self.bounds) else min(self.bounds[i], self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': [[bound, n] for bound, n in zip(self.bounds + (None, ), self.counts) if n]}
+
+class _Endpoint(object):
+    """Counters of a request endpoint."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.retries = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.statuses = {}
+        self.cacheHits = {}
+
+    def snapshot(self):
+        return {'count': self.latency.count,
+                'errors': self.errors,
+                'retries': self.retries,
+                'bytesIn': self.bytesIn,
+                'bytesOut': self.bytesOut,
+                'statuses': dict((str(status), n) for status, n in self.statuses.items()),
+                'cacheHits': dict(self.cacheHits),
+                'latency': self.latency.snapshot()}
+
+class Metrics(object):
+    """Collects per endpoint request metrics, cache hits and the durations of
+    helper methods.
+
+    An instance is installed with `VSDConnecter.setMetrics()`. Any object
+    implementing `request()`, `retry()`, `cacheHit()` and `call()` may be
+    installed instead, e.g. to forward the measurements to a monitoring
+    system.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.__endpoints = {}
+        self.__calls = {}
+        self.__cache = {}
+        self.__lock = threading.Lock()
+
+    def request(self, method, url, latency, status = None, bytesIn = 0, bytesOut = 0, error = False):
+        """Record an executed request.
+
+        Parameters
+        ----------
+        method : string
+        url : string
+        latency : float
+            Seconds until the response was read completely.
+        status : int
+            The HTTP status code, None if there was no response.
+        bytesIn : int
+            Size of the response body.
+        bytesOut : int
+            Size of the request body.
+        error : bool
+            Whether the request failed.
+        """
+        key = '{} {}'.format(method, endpoint_template(url))
+        with self.__lock:
+            endpoint = self.__endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.__endpoints[key] = _Endpoint()
+            endpoint.latency.add(latency)
+            endpoint.bytesIn += bytesIn
+            endpoint.bytesOut += bytesOut
+            if error:
+                endpoint.errors += 1
+            endpoint.statuses[status] = endpoint.statuses.get(status, 0) + 1
+
+    def retry(self, method, url):
+        """Record the repetition of a failed request."""
+        key = '{} {}'.format(method, endpoint_template(url))
+        with self.__lock:
+            endpoint = self.__endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.__endpoints[key] = _Endpoint()
+            endpoint.retries += 1
+
+    def cacheHit(self, kind, url, method = 'GET'):
+        """Record a request served by a cache.
+
+        Parameters
+        ----------
+        kind : string
+            'memory', 'disk' or 'revalidated' for responses confirmed by the
+            server to be unchanged.
+        url : string
+        method : string
+        """
+        key = '{} {}'.format(method, endpoint_template(url))
+        with self.__lock:
+            endpoint = self.__endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.__endpoints[key] = _Endpoint()
+            endpoint.cacheHits[kind] = endpoint.cacheHits.get(kind, 0) + 1
+            self.__cache[kind] = self.__cache.get(kind, 0) + 1
+
+    def call(self, name, duration):
+        """Record the duration of a helper method call in seconds."""
+        with self.__lock:
+            histogram = self.__calls.get(name)
+            if histogram is None:
+                histogram = self.__calls[name] = Histogram()
+            histogram.add(duration)
+
+    def snapshot(self):
+        """Return the collected metrics.
+
+        Returns
+        -------
+        snapshot : dict
+            'elapsed' seconds since the start of the collection, 'requests'
+            per method and endpoint template, including their 'cacheHits'
+            per kind, the total 'cache' hits per kind and 'calls' per helper
+            method.
+        """
+        with self.__lock:
+            return {'elapsed': time.time() - self.start,
+                    'requests': dict((key, endpoint.snapshot()) for key, endpoint in self.__endpoints.items()),
+                    'cache': dict(self.__cache),
+                    'calls': dict((name, histogram.snapshot()) for name, histogram in self.__calls.items())}
+
+    def export(self, f):
+        """Write a snapshot as JSON to a file object or a file name."""
+        if isinstance(f, basestring):
+            with open(f, 'wb') as out:
+                return self.export(out)
+        json.dump(self.snapshot(), f, indent = 2, sort_keys = True)
+
+    def reset(self):
+        """Discard the collected metrics."""
+        with self.__lock:
+            self.start = time.time()
+            self.__endpoints.clear()
+            self.__calls.clear()
+            self.__cache.clear()
+
+    def summary(self):
+        """Format the collected metrics as table, ordered by total time."""
+        snapshot = self.snapshot()
+        lines = ['{:<48} {:>7} {:>6} {:>6} {:>9} {:>8} {:>8} {:>8} {:>10}'.format(
+                 'endpoint / call', 'count', 'errors', 'retry', 'total s', 'mean ms', 'p90 ms', 'p99 ms', 'MiB in')]
+
+        def row(name, latency, errors = '', retries = '', bytesIn = None):
+            mib = '' if bytesIn is None else '{:.1f}'.format(bytesIn / 1048576.)
+            return '{:<48} {:>7} {:>6} {:>6} {:>9.2f} {:>8.1f} {:>8.1f} {:>8.1f} {:>10}'.format(
+                   name[:48], latency['count'], errors, retries, latency['sum'], 1000 * latency['mean'],
+                   1000 * latency['p90'], 1000 * latency['p99'], mib)
+
+        requests = sorted(snapshot['requests'].items(), key = lambda item: -item[1]['latency']['sum'])
+        for key, endpoint in requests:
+            if endpoint['count']:
+                lines.append(row(key, endpoint['latency'], endpoint['errors'], endpoint['retries'], endpoint['bytesIn']))
+        for name, latency in sorted(snapshot['calls'].items(), key = lambda item: -item[1]['sum']):
+            lines.append(row(name + '()', latency))
+        if snapshot['cache']:
+            lines.append('cache hits: ' + ', '.join('{} {}'.format(kind, n) for kind, n in sorted(snapshot['cache'].items())))
+        lines.append('elapsed: {:.1f}s'.format(snapshot['elapsed']))
+        return '\n'.join(lines)
+
+    def report(self, stream = None):
+        """Print the summary, by default to stderr."""
+        print >> (sys.stderr if stream is None else stream), self.summary()
+
+def instrumented(method):
+    """Decorator recording the duration of a connecter method with the
+    connecter's metrics, if set."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics.call(name, time.time() - start)
+    return wrapper
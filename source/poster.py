@@ -2,12 +2,54 @@
 
 from __future__ import print_function
 
+import os
+import mmap
 import mimetypes
 import random
 import string
 
 _BOUNDARY_CHARS = string.digits + string.ascii_letters
 
+def _escape_quote(s):
+    return s.replace('"', '\\"')
+
+def _encode_parts(fields, files, boundary):
+    """Return the multipart body as list of string segments, with the contents
+    of each file given either as string or as _FilePart."""
+    parts = []
+
+    for name, value in fields.items():
+        parts.append('\r\n'.join((
+            '--{0}'.format(boundary),
+            'Content-Disposition: form-data; name="{0}"'.format(_escape_quote(name)),
+            '',
+            str(value),
+            '',
+        )))
+
+    for name, value in files.items():
+        filename = value['filename']
+        if 'mimetype' in value:
+            mimetype = value['mimetype']
+        else:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        parts.append('\r\n'.join((
+            '--{0}'.format(boundary),
+            'Content-Disposition: form-data; name="{0}"; filename="{1}"'.format(
+                    _escape_quote(name), _escape_quote(filename)),
+            'Content-Type: {0}'.format(mimetype),
+            '',
+            '',
+        )))
+        if 'content' in value:
+            parts.append(value['content'])
+        else:
+            parts.append(_FilePart(value['path']))
+        parts.append('\r\n')
+
+    parts.append('--{0}--\r\n'.format(boundary))
+    return parts
+
 def encode_multipart(fields, files, boundary=None):
     r"""Encode dict of form fields and dict of files as multipart/form-data.
     Return tuple of (body_string, headers_dict). Each value in files is a dict
@@ -34,41 +76,47 @@ def encode_multipart(fields, files, boundary=None):
     >>> len(body)
     193
     """
-    def escape_quote(s):
-        return s.replace('"', '\\"')
-
     if boundary is None:
         boundary = ''.join(random.choice(_BOUNDARY_CHARS) for i in range(30))
-    lines = []
+    body = ''.join(_encode_parts(fields, files, boundary))
 
-    for name, value in fields.items():
-        lines.extend((
-            '--{0}'.format(boundary),
-            'Content-Disposition: form-data; name="{0}"'.format(escape_quote(name)),
-            '',
-            str(value),
-        ))
+    headers = {
+        'Content-Type': 'multipart/form-data; boundary={0}'.format(boundary),
+        'Content-Length': str(len(body)),
+    }
 
-    for name, value in files.items():
-        filename = value['filename']
-        if 'mimetype' in value:
-            mimetype = value['mimetype']
-        else:
-            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-        lines.extend((
-            '--{0}'.format(boundary),
-            'Content-Disposition: form-data; name="{0}"; filename="{1}"'.format(
-                    escape_quote(name), escape_quote(filename)),
-            'Content-Type: {0}'.format(mimetype),
-            '',
-            value['content'],
-        ))
+    return (body, headers)
 
-    lines.extend((
-        '--{0}--'.format(boundary),
-        '',
-    ))
-    body = '\r\n'.join(lines)
+def encode_multipart_stream(fields, files, boundary=None, bufsize=65536, checksum=None):
+    r"""Encode dict of form fields and dict of files as streaming
+    multipart/form-data. Return tuple of (body_file, headers_dict), where
+    body_file is a MultipartBody that reads the files from disk only while it
+    is consumed. Each value in files is a dict with the required key 'filename'
+    and either 'path' (file on disk) or 'content' (string), and optional
+    'mimetype'. The Content-Length is computed up front from the file sizes.
+    If checksum is given, the files are hashed while they are sent, see
+    MultipartBody.
+
+    >>> import tempfile
+    >>> f = tempfile.NamedTemporaryFile()
+    >>> f.write('CONTENT'); f.flush()
+    >>> body, headers = encode_multipart_stream({'FIELD': 'VALUE'},
+    ...                                         {'FILE': {'filename': 'F.TXT', 'path': f.name}},
+    ...                                         boundary='BOUNDARY', bufsize=10)
+    >>> print(sorted(headers.items()))
+    [('Content-Length', '193'), ('Content-Type', 'multipart/form-data; boundary=BOUNDARY')]
+    >>> data = body.read()
+    >>> data == encode_multipart({'FIELD': 'VALUE'},
+    ...                          {'FILE': {'filename': 'F.TXT', 'content': 'CONTENT'}},
+    ...                          boundary='BOUNDARY')[0]
+    True
+    >>> body.seek(0)
+    >>> len(''.join(iter(lambda: body.read(7), '')))
+    193
+    """
+    if boundary is None:
+        boundary = ''.join(random.choice(_BOUNDARY_CHARS) for i in range(30))
+    body = MultipartBody(_encode_parts(fields, files, boundary), bufsize, checksum)
 
     headers = {
         'Content-Type': 'multipart/form-data; boundary={0}'.format(boundary),
@@ -77,6 +125,141 @@ def encode_multipart(fields, files, boundary=None):
 
     return (body, headers)
 
+class _FilePart(object):
+    """A file on disk that is part of a multipart body."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __len__(self):
+        return self.size
+
+    def map(self):
+        """Map the file read-only into memory. Empty files, which can not be
+        mapped, are represented by an empty string."""
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size != self.size:
+                raise IOError('{0} changed size from {1} to {2} bytes'.format(self.path, self.size, size))
+            if not size:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MultipartBody(object):
+    """Read-only file-like multipart body that streams file contents from disk
+    in chunks of at most bufsize bytes. Accepted by httplib as request body.
+
+    Connections that support it send the body with buffers() instead, which
+    avoids copying the file contents in Python altogether.
+
+    checksum is an optional factory of objects with an update() method, e.g.
+    checksum.Checksum. One is created for each file whenever the body is
+    sent from the start, and fed with the file contents as they are sent,
+    hence the files need not be read again to verify the upload.
+
+    >>> import hashlib
+    >>> body, headers = encode_multipart_stream({}, {'FILE': {'filename': 'F.TXT', 'path': __file__}},
+    ...                                         checksum=hashlib.sha1)
+    >>> data = body.read()
+    >>> body.checksums[0].hexdigest() == hashlib.sha1(open(__file__, 'rb').read()).hexdigest()
+    True
+    """
+
+    def __init__(self, parts, bufsize=65536, checksum=None):
+        self.parts = parts
+        self.bufsize = bufsize
+        self.checksum = checksum
+        self.length = sum(len(part) for part in parts)
+        self.__file = None
+        self.seek(0)
+
+    @property
+    def checksums(self):
+        """The checksums of the files sent so far, in the order of the files."""
+        return [self.__checksums[index] for index in sorted(self.__checksums)]
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.bufsize), '')
+
+    def seek(self, offset, whence=0):
+        """Rewind the body. Only seeking to the start is supported."""
+        if offset != 0 or whence != 0:
+            raise IOError('MultipartBody can only be rewound to the start')
+        self.close()
+        self.__index = 0
+        self.__offset = 0
+        self.__restart()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        chunks = []
+        while size > 0 and self.__index < len(self.parts):
+            part = self.parts[self.__index]
+            if isinstance(part, _FilePart):
+                if self.__file is None:
+                    self.__file = open(part.path, 'rb')
+                chunk = self.__file.read(min(size, self.bufsize))
+            else:
+                chunk = part[self.__offset:self.__offset + size]
+            if chunk:
+                if self.__index in self.__checksums:
+                    self.__checksums[self.__index].update(chunk)
+                chunks.append(chunk)
+                size -= len(chunk)
+                self.__offset += len(chunk)
+            if not chunk or self.__offset >= len(part):
+                self.close()
+                self.__index += 1
+                self.__offset = 0
+        return ''.join(chunks)
+
+    def buffers(self, chunksize=1048576):
+        r"""Iterate over the body as buffers to pass to socket.sendall(): the
+        string segments as they are and the files as read-only views of at
+        most chunksize bytes into their memory maps. A file is unmapped when
+        the iteration moves past it, hence the buffers must be sent before
+        the next one is requested. Independent of read().
+
+        >>> import tempfile
+        >>> f = tempfile.NamedTemporaryFile()
+        >>> f.write('CONTENT'); f.flush()
+        >>> body = MultipartBody(['--PREAMBLE\r\n', _FilePart(f.name), '\r\n--EPILOGUE--\r\n'])
+        >>> [str(buf) for buf in body.buffers(chunksize=4)]
+        ['--PREAMBLE\r\n', 'CONT', 'ENT', '\r\n--EPILOGUE--\r\n']
+        """
+        self.__restart()
+        for index, part in enumerate(self.parts):
+            if not isinstance(part, _FilePart):
+                yield part
+                continue
+            checksum = self.__checksums.get(index)
+            mapped = part.map()
+            try:
+                for offset in range(0, len(mapped), chunksize):
+                    buf = buffer(mapped, offset, chunksize)
+                    if checksum is not None:
+                        checksum.update(buf)
+                    yield buf
+            finally:
+                if mapped:
+                    mapped.close()
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __restart(self):
+        self.__checksums = {}
+        if self.checksum is not None:
+            self.__checksums = dict((index, self.checksum()) for index, part in enumerate(self.parts)
+                                    if isinstance(part, _FilePart))
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
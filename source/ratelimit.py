@@ -0,0 +1,162 @@
+"""Client-side request rate limits and adaptive concurrency control."""
+
+# system imports
+import time
+import urlparse
+import threading
+import contextlib
+
+# code
+ENDPOINT_CLASSES = ('metadata', 'transfer')
+"""The endpoint classes rate limits are configured for."""
+
+def endpoint_class(url):
+    """Classify a request url as file 'transfer' or 'metadata' request.
+
+    >>> endpoint_class('https://demo.virtualskeleton.ch/api/files/3/download')
+    'transfer'
+    >>> endpoint_class('https://demo.virtualskeleton.ch/api//objects/3')
+    'metadata'
+    """
+    path = urlparse.urlsplit(url).path.rstrip('/')
+    if path.endswith('/upload') or path.endswith('/download'):
+        return 'transfer'
+    return 'metadata'
+
+class TokenBucket(object):
+    """Token bucket admitting on average `rate` requests per second with
+    bursts of up to `burst` requests.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    burst : float
+        Capacity of the bucket, at least 1. Defaults to one second worth of
+        tokens.
+    """
+
+    def __init__(self, rate, burst = None):
+        self.rate = float(rate)
+        self.burst = max(1., self.rate if burst is None else float(burst))
+        self.__tokens = self.burst
+        self.__stamp = time.time()
+        self.__lock = threading.Lock()
+
+    def acquire(self, tokens = 1):
+        """Take tokens from the bucket, waiting until they are available.
+
+        Parameters
+        ----------
+        tokens : float
+
+        Returns
+        -------
+        waited : float
+            Seconds spent waiting.
+        """
+        waited = 0.
+        while True:
+            with self.__lock:
+                now = time.time()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__stamp) * self.rate)
+                self.__stamp = now
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return waited
+                delay = (tokens - self.__tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class RateLimiter(object):
+    """Rate limits per endpoint class, shared by all requests of a connecter.
+
+    Parameters
+    ----------
+    rates : dict
+        Requests per second per endpoint class, see `ENDPOINT_CLASSES`.
+        Classes without rate are not limited.
+    bursts : dict
+        Burst size per endpoint class, see `TokenBucket`.
+    """
+
+    def __init__(self, rates = None, bursts = None):
+        rates = rates or {}
+        bursts = bursts or {}
+        self.__buckets = dict((name, TokenBucket(rate, bursts.get(name)))
+                              for name, rate in rates.items() if rate)
+
+    def acquire(self, url):
+        """Wait until a request to url may be sent and return the seconds
+        waited."""
+        bucket = self.__buckets.get(endpoint_class(url))
+        if bucket is None:
+            return 0.
+        return bucket.acquire()
+
+class AIMDController(object):
+    """Adapts the number of concurrent requests to the server load with
+    additive increase and multiplicative decrease.
+
+    Each request completed within `targetlatency` seconds raises the limit
+    by about one per round of `limit` requests. A slower request or a
+    response signaling overload (429 or 503) multiplies the limit by
+    `decrease`, at most once per `targetlatency` seconds, such that one
+    congestion event is not punished for each request in flight.
+
+    Parameters
+    ----------
+    initial : int
+        The initial limit.
+    minimum : int
+    maximum : int
+        Bounds of the limit.
+    targetlatency : float
+        Latency in seconds above which the server is considered overloaded.
+    decrease : float
+        Factor applied to the limit on overload.
+    """
+
+    def __init__(self, initial = 8, minimum = 1, maximum = 64, targetlatency = 1., decrease = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.targetlatency = targetlatency
+        self.decrease = decrease
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.inflight = 0
+        self.__decreased = 0.
+        self.__cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Context manager that blocks while the limit is reached."""
+        with self.__cond:
+            while self.inflight >= int(self.limit):
+                self.__cond.wait()
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self.__cond:
+                self.inflight -= 1
+                self.__cond.notify_all()
+
+    def record(self, latency = None, overloaded = False):
+        """Adjust the limit to the outcome of a request.
+
+        Parameters
+        ----------
+        latency : float
+            Seconds the request took, None if it failed.
+        overloaded : bool
+            Whether the server signaled overload.
+        """
+        with self.__cond:
+            if overloaded or (latency is not None and latency > self.targetlatency):
+                now = time.time()
+                if now - self.__decreased >= self.targetlatency:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.__decreased = now
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1. / self.limit)
+            self.__cond.notify_all()
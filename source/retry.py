@@ -0,0 +1,183 @@
+"""Retry policy with jittered exponential backoff and per-host circuit
+breaker."""
+
+# system imports
+import time
+import random
+import socket
+import httplib
+import urllib2
+import urlparse
+import threading
+import email.utils
+
+# code
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+"""Methods that may be repeated without changing the result."""
+
+TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+"""HTTP status codes signaling a condition that may pass by itself."""
+
+def retry_after(err):
+    """Extract the delay requested by the Retry-After header of an error.
+
+    Parameters
+    ----------
+    err : Exception
+        The error of a failed request.
+
+    Returns
+    -------
+    delay : float or None
+        Seconds to wait or None, if the error carries no valid header.
+
+    >>> import StringIO, mimetools
+    >>> headers = mimetools.Message(StringIO.StringIO('Retry-After: 7\\r\\n\\r\\n'))
+    >>> retry_after(urllib2.HTTPError('http://x', 503, 'Unavailable', headers, None))
+    7.0
+    """
+    headers = getattr(err, 'hdrs', None)
+    value = None if headers is None else headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0., email.utils.mktime_tz(date) - time.time())
+
+def is_transient(err):
+    """Whether a failed request may succeed when repeated, i.e. whether it
+    failed due to the connection, a timeout or a transient server status."""
+    if isinstance(err, urllib2.HTTPError):
+        return err.code in TRANSIENT_STATUSES
+    return isinstance(err, (urllib2.URLError, httplib.HTTPException, socket.error))
+
+class RetryPolicy(object):
+    """Decides whether and when a failed request is repeated.
+
+    Only idempotent requests are repeated and only if they failed with a
+    transient error. The delay before each repetition is drawn uniformly
+    between zero and an exponentially growing bound ("full jitter"), such
+    that clients failing at the same time do not retry in lockstep. A delay
+    requested by the server with Retry-After takes precedence.
+
+    Parameters
+    ----------
+    retries : int
+        Maximum number of repetitions per request. 0 disables retries.
+    backoff : float
+        Upper bound of the delay before the first repetition in seconds,
+        doubled for each further repetition.
+    maxbackoff : float
+        Upper bound of the delay in seconds.
+    maxretryafter : float
+        Longest Retry-After delay in seconds that is waited for. Requests
+        asked to wait longer fail immediately.
+    methods : tuple
+        The HTTP methods that are repeated.
+    """
+
+    def __init__(self, retries = 3, backoff = 0.5, maxbackoff = 30., maxretryafter = 300.,
+                 methods = IDEMPOTENT_METHODS):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.maxretryafter = maxretryafter
+        self.methods = methods
+
+    def delay(self, method, attempt, err):
+        """Return the delay before repeating a failed request.
+
+        Parameters
+        ----------
+        method : string
+            The HTTP method of the request.
+        attempt : int
+            The number of repetitions so far.
+        err : Exception
+            The error of the failed attempt.
+
+        Returns
+        -------
+        delay : float or None
+            Seconds to wait before the next attempt or None, if the request
+            must not be repeated.
+        """
+        if attempt >= self.retries or method not in self.methods or not is_transient(err):
+            return None
+        requested = retry_after(err)
+        if requested is not None:
+            return requested if requested <= self.maxretryafter else None
+        return random.uniform(0, min(self.backoff * 2 ** attempt, self.maxbackoff))
+
+class CircuitBreaker(object):
+    """Per-host circuit breaker.
+
+    After `threshold` consecutive transient failures of requests to a host,
+    the circuit for the host opens and further requests are rejected without
+    contacting the server. Once `cooldown` seconds passed, a single trial
+    request is admitted: its success closes the circuit, its failure opens
+    it for another cooldown period.
+
+    Parameters
+    ----------
+    threshold : int
+        Number of consecutive failures that open the circuit. None or 0
+        disables the breaker.
+    cooldown : float
+        Seconds the circuit stays open.
+    """
+
+    def __init__(self, threshold = 5, cooldown = 30.):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.rejected = 0
+        self.__failures = {}
+        self.__openedAt = {}
+        self.__trials = set()
+        self.__lock = threading.Lock()
+
+    def allow(self, url):
+        """Whether a request to the host of url may be sent now."""
+        if not self.threshold:
+            return True
+        host = urlparse.urlsplit(url).netloc
+        with self.__lock:
+            opened = self.__openedAt.get(host)
+            if opened is None:
+                return True
+            if host not in self.__trials and time.time() - opened >= self.cooldown:
+                self.__trials.add(host)
+                return True
+            self.rejected += 1
+            return False
+
+    def isOpen(self, url):
+        """Whether requests to the host of url are currently rejected."""
+        with self.__lock:
+            return urlparse.urlsplit(url).netloc in self.__openedAt
+
+    def success(self, url):
+        """Record a request to the host of url that reached the server."""
+        if not self.threshold:
+            return
+        host = urlparse.urlsplit(url).netloc
+        with self.__lock:
+            self.__failures.pop(host, None)
+            self.__openedAt.pop(host, None)
+            self.__trials.discard(host)
+
+    def failure(self, url):
+        """Record a transient failure of a request to the host of url."""
+        if not self.threshold:
+            return
+        host = urlparse.urlsplit(url).netloc
+        with self.__lock:
+            failures = self.__failures.get(host, 0) + 1
+            self.__failures[host] = failures
+            if host in self.__trials or failures >= self.threshold:
+                self.__openedAt[host] = time.time()
+                self.__trials.discard(host)
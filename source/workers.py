@@ -0,0 +1,357 @@
+"""Bounded worker pools, per-host concurrency limits, request coalescing and
+transfer reports."""
+
+# system imports
+import time
+import urlparse
+import threading
+import contextlib
+from multiprocessing.pool import ThreadPool
+
+# code
+def run_parallel(func, items, workers = 1):
+    """Apply a function to each item using a bounded pool of threads.
+
+    Parameters
+    ----------
+    func : callable
+        Called once per item. Exceptions raised by func are propagated, hence
+        func should handle expected errors itself.
+    items : sequence
+    workers : int
+        Maximum number of concurrently running calls. With 1, all calls run
+        sequentially in the calling thread.
+
+    Returns
+    -------
+    results : list
+        The return values of func in the order of items.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+
+class HostLimiter(object):
+    """Limits the number of concurrent requests per host.
+
+    Parameters
+    ----------
+    maxperhost : int
+        Maximum number of concurrent requests to a single host. None or 0
+        disables the limit.
+    """
+
+    def __init__(self, maxperhost = None):
+        self.maxperhost = maxperhost
+        self.__semaphores = {}
+        self.__lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        """Context manager that blocks until a request to the host of url may
+        be executed."""
+        if not self.maxperhost:
+            yield
+            return
+        host = urlparse.urlsplit(url).netloc
+        with self.__lock:
+            semaphore = self.__semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.maxperhost)
+                self.__semaphores[host] = semaphore
+        with semaphore:
+            yield
+
+class TransferReport(object):
+    """Thread-safe record of the outcome of a batch of file transfers.
+
+    Attributes
+    ----------
+    completed : list
+        Filenames of the completed transfers.
+    skipped : list
+        Filenames of the transfers skipped because the file already existed.
+    failed : list
+        (url, filename, error) tuples of the failed transfers.
+    bytes : int
+        Total number of bytes transferred.
+    checksums : dict
+        Checksums of the completed transfers by filename, see
+        `VSDConnecter.setChecksums()`.
+    """
+
+    def __init__(self):
+        self.completed = []
+        self.checksums = {}
+        self.skipped = []
+        self.failed = []
+        self.bytes = 0
+        self.start = time.time()
+        self.__lock = threading.Lock()
+
+    @property
+    def ok(self):
+        """True if no transfer failed."""
+        return not self.failed
+
+    @property
+    def elapsed(self):
+        """Seconds since the report was created."""
+        return time.time() - self.start
+
+    @property
+    def throughput(self):
+        """Average transfer rate in bytes per second."""
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.
+
+    def addCompleted(self, filename, nbytes, checksum = None):
+        with self.__lock:
+            self.completed.append(filename)
+            self.bytes += nbytes
+            if checksum is not None:
+                self.checksums[filename] = checksum
+
+    def addSkipped(self, filename):
+        with self.__lock:
+            self.skipped.append(filename)
+
+    def addFailed(self, url, filename, error):
+        with self.__lock:
+            self.failed.append((url, filename, error))
+
+    def merge(self, other):
+        """Add the transfers recorded in another report to this one."""
+        with self.__lock:
+            self.completed.extend(other.completed)
+            self.skipped.extend(other.skipped)
+            self.failed.extend(other.failed)
+            self.bytes += other.bytes
+            self.checksums.update(other.checksums)
+
+    def __str__(self):
+        return '{} completed, {} skipped, {} failed, {:.1f} MiB in {:.1f}s ({:.2f} MiB/s)'.format(
+                len(self.completed), len(self.skipped), len(self.failed),
+                self.bytes / 1048576., self.elapsed, self.throughput / 1048576.)
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key into a single execution.
+
+    While a call for a key is running, further calls for the same key wait
+    for it to complete and receive its result or exception instead of
+    executing the function again.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, func):
+        """Call func, unless a call for key is already in flight.
+
+        Parameters
+        ----------
+        key : hashable
+        func : callable
+            Called without arguments.
+
+        Returns
+        -------
+        result
+            The return value of func, possibly of the call of another thread.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+        return call.result
+
+class _Call(object):
+    """A call in flight of SingleFlight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Prefetch(object):
+    """Executes a call in a background thread while the caller does other
+    work.
+
+    Parameters
+    ----------
+    func : callable
+    args
+        Positional arguments passed to func.
+    """
+
+    def __init__(self, func, *args):
+        self.__result = None
+        self.__error = None
+        self.__thread = threading.Thread(target = self.__run, args = (func, args))
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def result(self):
+        """Wait for the call to complete and return its result or raise its
+        exception."""
+        self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
+        return self.__result
+
+    def __run(self, func, args):
+        try:
+            self.__result = func(*args)
+        except Exception as err:
+            self.__error = err
+
+def run_pipeline(first, second, items, workers = 1, postworkers = 1):
+    """Process items in two stages, each with its own bounded thread pool.
+
+    As soon as the first stage completed for an item, the second stage is
+    started for it, while the first stage continues with the next items.
+
+    Parameters
+    ----------
+    first : callable
+        Called with an item. Exceptions are propagated, hence first should
+        handle expected errors itself.
+    second : callable
+        Called with an item and the return value of first for it.
+    items : sequence
+    workers : int
+        Number of threads of the first stage.
+    postworkers : int
+        Number of threads of the second stage.
+
+    Returns
+    -------
+    results : list
+        The return values of second in the order of items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    firstpool = ThreadPool(max(1, min(workers, len(items))))
+    secondpool = ThreadPool(max(1, min(postworkers, len(items))))
+    pending = [None] * len(items)
+
+    def advance(i):
+        def callback(result):
+            pending[i] = secondpool.apply_async(second, (items[i], result))
+        return callback
+
+    try:
+        firsts = [firstpool.apply_async(first, (item, ), callback = advance(i))
+                  for i, item in enumerate(items)]
+        for result in firsts:
+            result.get()
+        return [result.get() for result in pending]
+    finally:
+        # the callbacks of the first stage submit to the second pool, which
+        # may only be closed once they have all run
+        firstpool.close()
+        firstpool.join()
+        secondpool.close()
+        secondpool.join()
+
+class UploadResult(object):
+    """Outcome of the upload and post-processing of a single file.
+
+    Attributes
+    ----------
+    filename : string
+    source : int or None
+        Id of the object the uploaded object is linked to.
+    reference : int or None
+        Id of the object whose ontology is copied.
+    folder : int or None
+        Id of the folder the uploaded object is added to.
+    oid : int or None
+        Id of the created object, None if the upload failed.
+    steps : list
+        The completed steps, out of 'upload', 'link', 'ontology' and 'folder'.
+    stage : string or None
+        The step that failed.
+    error : Exception or None
+        The error of the failed step.
+    """
+
+    def __init__(self, filename, source = None, reference = None, folder = None):
+        self.filename = filename
+        self.source = source
+        self.reference = reference
+        self.folder = folder
+        self.oid = None
+        self.steps = []
+        self.stage = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def fail(self, stage, error):
+        self.stage = stage
+        self.error = error
+
+    def __repr__(self):
+        if self.ok:
+            return 'UploadResult({!r}, oid={}, steps={})'.format(self.filename, self.oid, self.steps)
+        return 'UploadResult({!r}, oid={}, failed in {}: {})'.format(self.filename, self.oid, self.stage, self.error)
+
+class UploadReport(object):
+    """Outcome of a batch of uploads.
+
+    Attributes
+    ----------
+    results : list of UploadResult
+        In the order of the submitted files.
+    """
+
+    def __init__(self, results, start = None):
+        self.results = list(results)
+        self.start = time.time() if start is None else start
+        self.end = time.time()
+
+    @property
+    def ok(self):
+        """True if all files were uploaded and post-processed."""
+        return all(result.ok for result in self.results)
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def __str__(self):
+        return '{} uploaded, {} failed in {:.1f}s'.format(
+                len(self.succeeded), len(self.failed), self.end - self.start)
@@ -0,0 +1,42 @@
+# nose-tests for the asyncVSD module of connectVSD 0.1
+
+import os
+import sys
+import base64
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import trollius as asyncio
+
+import connectVSD
+from asyncVSD import AsyncVSDConnecter
+from mockVSD import MockVSD
+
+class TestAsyncVSDConnecter:
+
+    def setup(self):
+        self.server = MockVSD(nobjects = 20, nfolders = 5, latency = 0.01)
+        self.server.start()
+        self.loop = asyncio.new_event_loop()
+        self.con = AsyncVSDConnecter(authstr = base64.b64encode('user:password'), maxconcurrent = 4, loop = self.loop)
+        self.con.setUrl(self.server.url)
+
+    def teardown(self):
+        self.con.close()
+        self.con.connecter.setConnectionPool(poolsize = 0)
+        self.loop.close()
+        self.server.stop()
+
+    def test_gather(self):
+        oids = range(1, 21)
+        objs = self.loop.run_until_complete(asyncio.gather(*[self.con.getObject(oid) for oid in oids], loop = self.loop))
+        assert [obj['id'] for obj in objs] == oids
+        assert self.server.counts['object'] == 20
+        folders = self.loop.run_until_complete(asyncio.gather(self.con.getFolder(1), self.con.getFolder(2), loop = self.loop))
+        assert [folder['name'] for folder in folders] == ['Folder1', 'Folder2']
+
+    def test_gather_errors(self):
+        results = self.loop.run_until_complete(asyncio.gather(self.con.getObject(1), self.con.getObject(999),
+                                                              loop = self.loop, return_exceptions = True))
+        assert results[0]['id'] == 1
+        assert isinstance(results[1], connectVSD.ConnectVSDException)
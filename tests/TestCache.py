@@ -0,0 +1,123 @@
+# nose-tests for the cache module of connectVSD 0.1
+
+import os
+import shutil
+import time
+import tempfile
+
+import cache
+
+class TestResponseCache:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def test_hit_miss(self):
+        c = cache.ResponseCache()
+        url = '{}/objects/1'.format(self.__server)
+        assert c.get(url) is None
+        c.put(url, '{"id": 1}')
+        assert c.get('{}//objects/1'.format(self.__server)) == '{"id": 1}'
+        stats = c.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['bytes'] == len('{"id": 1}')
+        
+    def test_ttl(self):
+        c = cache.ResponseCache(ttl = 60, ttls = {'folders': -1})
+        c.put('{}/folders/1'.format(self.__server), '{}')
+        c.put('{}/objects/1'.format(self.__server), '{}')
+        assert c.get('{}/folders/1'.format(self.__server)) is None
+        assert c.get('{}/objects/1'.format(self.__server)) == '{}'
+        assert len(c) == 1
+        
+    def test_lru(self):
+        c = cache.ResponseCache(maxentries = 2)
+        for oid in range(3):
+            c.put('{}/objects/{}'.format(self.__server, oid), '{}')
+            c.get('{}/objects/0'.format(self.__server))
+        assert c.get('{}/objects/0'.format(self.__server)) is not None
+        assert c.get('{}/objects/1'.format(self.__server)) is None
+        assert c.get('{}/objects/2'.format(self.__server)) is not None
+        assert c.stats()['evictions'] == 1
+        
+    def test_maxbytes(self):
+        c = cache.ResponseCache(maxbytes = 10)
+        c.put('{}/objects/1'.format(self.__server), 'x' * 6)
+        c.put('{}/objects/2'.format(self.__server), 'x' * 6)
+        c.put('{}/objects/3'.format(self.__server), 'x' * 11)
+        assert c.get('{}/objects/1'.format(self.__server)) is None
+        assert c.get('{}/objects/2'.format(self.__server)) is not None
+        assert c.get('{}/objects/3'.format(self.__server)) is None
+        
+    def test_invalidate(self):
+        c = cache.ResponseCache()
+        c.put('{}/folders/1'.format(self.__server), '{}')
+        c.put('{}/folders?page=2'.format(self.__server), '{}')
+        c.put('{}/objects/1'.format(self.__server), '{}')
+        c.put('{}/objects/2'.format(self.__server), '{}')
+        c.invalidate('{}//folders/1'.format(self.__server))
+        assert c.get('{}/folders/1'.format(self.__server)) is None
+        assert c.get('{}/folders?page=2'.format(self.__server)) is None
+        c.invalidateData({'object1': {'selfUrl': '{}/objects/1'.format(self.__server)},
+                          'description': ''})
+        assert c.get('{}/objects/1'.format(self.__server)) is None
+        assert c.get('{}/objects/2'.format(self.__server)) is not None
+
+class TestDiskCache:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def teardown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_put_get(self):
+        c = cache.DiskCache(self.directory)
+        url = '{}/objects/1'.format(self.__server)
+        assert c.get(url) is None
+        c.put(url, '{"id": 1}', etag = '"abc"')
+        entry = cache.DiskCache(self.directory).get('{}//objects/1'.format(self.__server))
+        assert entry['body'] == '{"id": 1}'
+        assert entry['etag'] == '"abc"'
+        assert entry['lastmodified'] is None
+        assert not c.isFresh(entry)
+        
+    def test_no_validators(self):
+        c = cache.DiskCache(self.directory)
+        url = '{}/objects/1'.format(self.__server)
+        c.put(url, '{"id": 1}')
+        assert c.get(url) is None
+        
+    def test_maxage(self):
+        c = cache.DiskCache(self.directory, maxage = 60)
+        url = '{}/objects/1'.format(self.__server)
+        c.put(url, '{"id": 1}', lastmodified = 'Mon, 02 Mar 2015 10:00:00 GMT')
+        assert c.isFresh(c.get(url))
+        
+    def test_invalidate_clear(self):
+        c = cache.DiskCache(self.directory)
+        c.put('{}/objects/1'.format(self.__server), '{}', etag = '"a"')
+        c.put('{}/objects/2'.format(self.__server), '{}', etag = '"b"')
+        c.invalidate('{}/objects/1'.format(self.__server))
+        assert c.get('{}/objects/1'.format(self.__server)) is None
+        c.clear()
+        assert c.get('{}/objects/2'.format(self.__server)) is None
+        assert os.path.isdir(self.directory)
+        
+    def test_expire(self):
+        c = cache.DiskCache(self.directory, maxage = 60)
+        listing = '{}/objects?rpp=5&page=2'.format(self.__server)
+        c.put(listing, '{}', etag = '"a"')
+        c.put('{}/objects/2'.format(self.__server), '{}', etag = '"b"')
+        c.put('{}/folders/1'.format(self.__server), '{}', etag = '"c"')
+        c.invalidateData({'object': {'selfUrl': '{}/objects/1'.format(self.__server)}})
+        assert not c.isFresh(c.get(listing))
+        assert c.isFresh(c.get('{}/objects/2'.format(self.__server)))
+        c.expire('{}//folders/1'.format(self.__server))
+        entry = c.get('{}/folders/1'.format(self.__server))
+        assert not c.isFresh(entry)
+        time.sleep(0.01)
+        c.revalidated(entry)
+        assert c.isFresh(c.get('{}/folders/1'.format(self.__server)))
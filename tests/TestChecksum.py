@@ -0,0 +1,66 @@
+# nose-tests for the checksum module of connectVSD 0.1
+
+import hashlib
+import tempfile
+
+import checksum
+
+class TestChecksum:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def __fileObj(self, data, key = 'fileHashCode'):
+        return {'selfUrl': self.__server + '/files/1',
+                'size': len(data),
+                key: hashlib.sha1(data).hexdigest().upper()}
+        
+    def test_incremental(self):
+        c = checksum.Checksum('sha256')
+        for chunk in ('abc', buffer('defgh', 1), ''):
+            c.update(chunk)
+        assert c.size == 7
+        assert c.value() == 'sha256:' + hashlib.sha256('abcefgh').hexdigest()
+        
+    def test_updateFile(self):
+        f = tempfile.NamedTemporaryFile()
+        f.write('0123456789')
+        f.flush()
+        c = checksum.Checksum()
+        c.updateFile(f.name, 4, bufsize = 3)
+        c.update('abc')
+        assert c.size == 7
+        assert c.hexdigest() == hashlib.sha1('0123abc').hexdigest()
+        c = checksum.Checksum(None)
+        c.updateFile(f.name)
+        assert c.size == 10
+        assert c.value() is None
+        
+    def test_verify(self):
+        data = 'x' * 100
+        c = checksum.Checksum('md5', self.__fileObj(data))
+        c.update(data)
+        c.verify()
+        c = checksum.Checksum('md5', self.__fileObj(data, 'anonymizedFileHashCode'))
+        c.update(data)
+        c.verify()
+        
+    def test_mismatch(self):
+        data = 'x' * 100
+        for fileObj in (dict(self.__fileObj(data), size = 101), self.__fileObj('y' * 100)):
+            c = checksum.Checksum(fileObj = fileObj)
+            c.update(data)
+            try:
+                c.verify()
+            except checksum.ChecksumError:
+                pass
+            else:
+                assert False
+        
+    def test_unknown(self):
+        c = checksum.Checksum('md5', {'fileHashCode': 'not a digest'})
+        c.update('x')
+        c.verify()
+        c = checksum.Checksum('md5')
+        c.expected = self.__fileObj('y')
+        c.update('x')
+        c.verify()
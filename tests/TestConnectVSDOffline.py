@@ -0,0 +1,377 @@
+# nose-tests for connectVSD 0.1 against the mock VSD server of the benchmarks
+
+import os
+import sys
+import atexit
+import base64
+import shutil
+import time
+import logging
+import tempfile
+
+from nose.tools import assert_raises
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import connectVSD
+from mockVSD import MockVSD
+
+class TestConnectVSDOffline:
+
+    __server = None
+
+    @classmethod
+    def setup_class(cls):
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def teardown_class(cls):
+        logging.disable(logging.NOTSET)
+
+    def setup(self):
+        self.server = MockVSD(nobjects = 20, nfolders = 5, fanout = 2, filesize = 20000, multifile = 10, nslices = 4)
+        self.server.start()
+        self.con = connectVSD.VSDConnecter(authstr = base64.b64encode('user:password'))
+        self.con.setUrl(self.server.url)
+        self.con.setDownloadRetries(2, backoff = 0.01)
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        self.con.setConnectionPool(poolsize = 0)
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_downloadFile_local_error(self):
+        # a directory in place of the partial file of one slice
+        os.makedirs(os.path.join(self.directory, 'series', 'series_1.dcm.part'))
+        report = self.con.downloadFile(10, os.path.join(self.directory, 'series'), workers = 2)
+        assert len(report.completed) == 3
+        assert len(report.failed) == 1
+        assert report.failed[0][1].endswith('series_1.dcm')
+        assert isinstance(report.failed[0][2], EnvironmentError)
+
+    def test_downloadFolder(self):
+        # object 1 is contained in folders 2 and 3
+        self.server.folders[3]['containedObjects'].append({'selfUrl': '/objects/1'})
+        # a dangling link in place of the directory of the series object 10
+        os.symlink(os.path.join(self.directory, 'missing'), os.path.join(self.directory, 'Term_10-10'))
+        m = connectVSD.Manifest(os.path.join(self.directory, 'manifest.jsonl'))
+        index = self.con.getFolderIndex()
+        report = self.con.downloadFolder(index[1], self.directory, workers = 4, manifest = m)
+        assert len(report.completed) == 22
+        assert len(report.failed) == 1
+        assert report.failed[0][0].endswith('/objects/10')
+        assert self.server.counts['download'] == 22
+        assert len([name for name in report.completed if name.endswith('-1.nii')]) == 1
+        
+        os.remove(os.path.join(self.directory, 'Term_10-10'))
+        report = self.con.downloadFolder(index[1], self.directory, workers = 4, manifest = m)
+        assert report.ok
+        assert len(report.completed) == 4
+        assert len(report.skipped) == 22
+        assert self.server.counts['download'] == 26
+
+    def __folderIDs(self, fid):
+        return sorted(int(entry['selfUrl'].rsplit('/', 1)[-1]) for entry in self.server.folders[fid]['containedObjects'])
+
+    def test_diskcache_revalidation(self):
+        diskcache = self.con.setDiskCache(connectVSD.DiskCache(os.path.join(self.directory, 'cache')))
+        obj = self.con.getObject(1)
+        assert self.con.getObject(1) == obj
+        assert diskcache.stats()['revalidations'] == 1
+        assert self.server.counts['notModified'] == 1
+        
+    def test_diskcache_write_invalidation(self):
+        diskcache = self.con.setDiskCache(connectVSD.DiskCache(os.path.join(self.directory, 'cache'), maxage = 3600))
+        listed = self.con.getFolderList(rpp = 2)
+        self.con.addObjectToFolder(1, 1)
+        self.con.addObjectToFolder(2, 1)
+        assert self.__folderIDs(1) == [1, 2, 5, 10, 15, 20]
+        folder = self.con.getFolder(1)
+        assert sorted(self.con.getFolderIndex()[1].getObjectIDs()) == [1, 2, 5, 10, 15, 20]
+        assert self.con.getFolderList(rpp = 2)['items'][0] == folder
+        assert listed['items'][0] != folder
+
+    def __partial(self, data):
+        with open(os.path.join(self.directory, 'image.nii.part'), 'wb') as f:
+            f.write(data)
+        
+    def __downloaded(self):
+        with open(os.path.join(self.directory, 'image.nii'), 'rb') as f:
+            return f.read()
+
+    def test_download_resume(self):
+        self.__partial(self.server.content(0, 5000))
+        bytesSent = self.server.bytesSent
+        report = self.con.downloadFile(1, os.path.join(self.directory, 'image'))
+        assert report.ok
+        assert self.__downloaded() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 1
+        assert self.server.bytesSent - bytesSent < 20000
+        
+    def test_download_complete_part(self):
+        # left by a run that stopped before renaming the .part file
+        self.__partial(self.server.content(0, 20000))
+        report = self.con.downloadFile(1, os.path.join(self.directory, 'image'))
+        assert report.ok
+        assert self.__downloaded() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 0
+        
+    def test_download_range_not_satisfiable(self):
+        # without the size in the file description, the server rejects the
+        # range of the complete .part file and reports its size
+        del self.server.files[1]['size']
+        self.__partial(self.server.content(0, 20000))
+        report = self.con.downloadFile(1, os.path.join(self.directory, 'image'))
+        assert report.ok
+        assert self.__downloaded() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 1
+        # a .part file that is too long is discarded
+        os.remove(os.path.join(self.directory, 'image.nii'))
+        self.__partial(self.server.content(0, 30000))
+        report = self.con.downloadFile(1, os.path.join(self.directory, 'image'))
+        assert report.ok
+        assert self.__downloaded() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 3
+        
+    def test_download_range_ignored(self):
+        self.server.ignoreRange = True
+        self.__partial('x' * 5000)
+        report = self.con.downloadFile(1, os.path.join(self.directory, 'image'))
+        assert report.ok
+        assert self.__downloaded() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 1
+        
+    def test_iterItems(self):
+        # following nextPageUrl and paging by totalCount, with and without prefetching
+        for nextPageUrls in (True, False):
+            self.server.nextPageUrls = nextPageUrls
+            for prefetch in (True, False):
+                self.server.reset()
+                items = self.con.iterItems('objects', rpp = 3, prefetch = prefetch, fields = ('id',))
+                assert [item['id'] for item in items] == range(1, 21)
+                assert self.server.counts['list'] == 7
+        assert [folder['id'] for folder in self.con.iterFolders(rpp = 5)] == range(1, 6)
+        assert self.server.counts['list'] == 8
+        
+    def __segmentations(self, n):
+        filenames = []
+        for i in range(n):
+            filenames.append(os.path.join(self.directory, 'seg{}.nii'.format(i)))
+            with open(filenames[-1], 'wb') as f:
+                f.write('segmentation {}'.format(i))
+        return filenames
+        
+    def test_uploadSegmentations(self):
+        # one upload response without the file, one that is not JSON
+        self.server.uploadReplies = ['{"relatedObject": {"selfUrl": "/objects/1"}}', 'Internal error']
+        jobs = [(filename, 1, 3, 2) for filename in self.__segmentations(4)]
+        jobs.append((os.path.join(self.directory, 'missing.nii'), 1, 3, 2))
+        report = self.con.uploadSegmentations(jobs, workers = 2, postworkers = 2)
+        assert len(report.succeeded) == 2
+        assert len(report.failed) == 3
+        assert all(result.stage == 'upload' for result in report.failed)
+        assert isinstance(report.results[-1].error, EnvironmentError)
+        oids = sorted(result.oid for result in report.succeeded)
+        assert oids == [21, 22]
+        assert all(result.steps == ['upload', 'link', 'ontology', 'folder'] for result in report.succeeded)
+        assert self.__folderIDs(2) == [1, 6, 11, 16, 21, 22]
+        for oid in oids:
+            obj = self.server.objects[oid]
+            assert obj['type'] == 2
+            assert obj['linkedObjects'] == [{'selfUrl': '/objects/1'}]
+            assert len(obj['ontologyItemRelations']) == 1
+
+    def test_getUploadedObject_fallback(self):
+        # the object is found through the description of the uploaded file
+        self.server.relatedObjects = False
+        upload = self.con.uploadFile(self.__segmentations(1)[0])
+        assert 'relatedObject' not in upload
+        obj = self.con.getUploadedObject(upload, objtype = 2, backoff = 0.01)
+        assert obj['id'] == 21
+        assert self.server.counts['file'] == 1
+
+    def test_getUploadedObject_wrong_reference(self):
+        # the upload response references a neighbouring object
+        upload = self.con.uploadFile(self.__segmentations(1)[0])
+        upload['relatedObject'] = {'selfUrl': '{}/objects/20'.format(self.server.url)}
+        obj = self.con.getUploadedObject(upload, objtype = 2, backoff = 0.01)
+        assert obj['id'] == 21
+        assert self.server.counts['object'] == 2
+        assert self.server.counts['file'] == 1
+
+    def test_getUploadedObject_wrong_type(self):
+        upload = self.con.uploadFile(self.__segmentations(1)[0])
+        assert_raises(connectVSD.ConnectVSDException, self.con.getUploadedObject, upload, objtype = 1, tries = 3, backoff = 0.01)
+        assert self.server.counts['object'] == 3
+        assert_raises(connectVSD.ConnectVSDException, self.con.getUploadedObject, {'id': 1})
+
+    def test_addObjectsToFolder_conflict(self):
+        # another client adds an object between reading and updating the folder
+        self.server.hooks['putFolder'] = lambda: self.server.folders[1]['containedObjects'].append({'selfUrl': '/objects/3'})
+        self.con.addObjectsToFolder([1, 2, 5], 1)
+        assert self.__folderIDs(1) == [1, 2, 3, 5, 10, 15, 20]
+        assert self.server.counts['putFolder'] == 2
+        assert self.server.counts['preconditionFailed'] == 1
+        
+    def test_addObjectsToFolder_without_etags(self):
+        # a stale update of another client overwrites ours
+        def overwrite():
+            self.server.folders[1]['containedObjects'] = [{'selfUrl': '/objects/3'}]
+        self.server.etags = False
+        self.server.hooks['putFolder'] = lambda: self.server.hooks.setdefault('folder', overwrite)
+        self.con.addObjectsToFolder([1, 2], 1)
+        assert self.__folderIDs(1) == [1, 2, 3]
+        assert self.server.counts['putFolder'] == 2
+        assert self.server.counts['folder'] == 4
+
+    def test_setOntologyBasedOnReferenceObjects(self):
+        results = self.con.setOntologyBasedOnReferenceObjects([4, 5, 5], 4)
+        assert results[0] == []
+        assert len(results[1]) == 1
+        assert results[2] is results[1]
+        assert self.server.counts['addRelation'] == 1
+        assert len(self.server.objects[5]['ontologyItemRelations']) == 2
+        # the copied relations are skipped when repeated
+        assert self.con.setOntologyBasedOnReferenceObjects([5], 4) == [[]]
+        assert self.server.counts['addRelation'] == 1
+
+    def test_setRightsBasedOnReferenceObjects(self):
+        rights = [{'selfUrl': '/object-rights/2'}]
+        self.server.newRight('object-group-rights', 3, '/groups/1', rights)
+        self.server.newRight('object-user-rights', 3, '/users/7', rights)
+        self.server.newRight('object-group-rights', 4, '/groups/1', rights)
+        results = self.con.setRightsBasedOnReferenceObjects([4, 6, 6, 3], 3)
+        assert [len(created) for created in results] == [1, 2, 2, 0]
+        assert results[2] is results[1]
+        assert self.server.counts['addRight'] == 3
+        obj = self.server.objects[6]
+        assert len(obj['objectGroupRights']) == len(obj['objectUserRights']) == 1
+        assert self.con.setRightsBasedOnReferenceObjects([4, 6], 3) == [[], []]
+        assert self.server.counts['addRight'] == 3
+
+    def test_getBySelfUrls(self):
+        self.server.overrides['/objects/3'] = (200, 'Internal error')
+        urls = ['{}/objects/{}'.format(self.server.url, oid) for oid in (2, 1, 3, 2, 99, 4)]
+        results = self.con.getBySelfUrls(urls, workers = 4)
+        assert [result['id'] for result in results[:2]] == [2, 1]
+        assert isinstance(results[2], connectVSD.RequestException)
+        assert isinstance(results[2].errors, ValueError)
+        # repeated urls are requested once, but yield independent copies
+        assert results[3] == results[0] and results[3] is not results[0]
+        results[3]['files'].append(None)
+        assert len(results[0]['files']) == 1
+        assert getattr(results[4].errors, 'code', None) == 404
+        assert results[5]['id'] == 4
+        assert self.server.counts['object'] == 5
+
+    def test_retry_after(self):
+        self.con.setRetries(retries = 2, backoff = 0.001)
+        self.server.queued['/objects/1'] = [(503, '', [('Retry-After', '1')])]
+        start = time.time()
+        assert self.con.getObject(1)['id'] == 1
+        assert time.time() - start >= 1
+        assert self.server.counts['object'] == 2
+
+    def test_no_retry_post(self):
+        self.con.setRetries(retries = 2, backoff = 0.001)
+        self.server.queued['/object-links'] = [(503, '')]
+        assert_raises(connectVSD.RequestException, self.con.addLink, 1, 2)
+        assert self.server.counts['link'] == 1
+        assert self.con.addLink(1, 2)['id'] == 1
+
+    def test_circuit_breaker(self):
+        self.con.setRetries(retries = 0)
+        self.con.setCircuitBreaker(threshold = 2, cooldown = 0.5)
+        self.server.queued['/objects/1'] = [(503, '')] * 2
+        for i in range(3):
+            assert_raises(connectVSD.RequestException, self.con.getObject, 1)
+        # the third request failed without reaching the server
+        assert self.server.counts['object'] == 2
+        assert self.con.breaker.isOpen(self.server.url)
+        time.sleep(0.5)
+        assert self.con.getObject(1)['id'] == 1
+        assert not self.con.breaker.isOpen(self.server.url)
+        assert self.con.getObject(2)['id'] == 2
+        assert self.server.counts['object'] == 4
+
+    def test_rate_limit(self):
+        # six requests at 20 per second without bursts take at least 0.25s
+        self.con.setRateLimits(metadata = 20, bursts = {'metadata': 1})
+        start = time.time()
+        assert len(self.con.getBySelfUrls(['{}/objects/{}'.format(self.server.url, oid) for oid in range(1, 7)], workers = 6)) == 6
+        assert time.time() - start >= 0.2
+
+    def test_concurrency_controller(self):
+        self.con.setRetries(retries = 1, backoff = 0.001)
+        controller = self.con.setConcurrencyController(connectVSD.AIMDController(initial = 8))
+        self.server.queued['/objects/1'] = [(429, '')]
+        assert self.con.getObject(1)['id'] == 1
+        assert 4 <= controller.limit < 5
+        assert self.server.counts['object'] == 2
+
+    def test_metrics(self):
+        metrics = self.con.setMetrics(connectVSD.Metrics())
+        self.con.setCache(connectVSD.ResponseCache())
+        for oid in (1, 2, 1):
+            self.con.getObject(oid)
+        self.con.getFolder(1)
+        requests = metrics.snapshot()['requests']
+        assert sorted(requests) == ['GET /api/folders/{id}', 'GET /api/objects/{id}']
+        objects = requests['GET /api/objects/{id}']
+        assert objects['count'] == 2
+        assert objects['statuses'] == {'200': 2}
+        assert objects['cacheHits'] == {'memory': 1}
+        assert requests['GET /api/folders/{id}']['count'] == 1
+        
+    def test_metrics_summary(self):
+        # the summary is printed once, for the metrics installed last
+        handlers = len(atexit._exithandlers)
+        self.con.setMetrics(connectVSD.Metrics(), summary = True)
+        self.con.setMetrics(connectVSD.Metrics(), summary = True)
+        assert len(atexit._exithandlers) == handlers + 1
+        self.con.setMetrics(None)
+        assert not self.con.summary
+
+    def test_cache_write_invalidation(self):
+        self.con.setCache(connectVSD.ResponseCache(ttl = 3600))
+        self.con.getFolder(1)
+        assert self.con.getFolder(1)['containedObjects'] is not None
+        assert self.server.counts['folder'] == 1
+        # the folder is updated through PUT /folders
+        self.con.addObjectToFolder(1, 1)
+        assert len(self.con.getFolder(1)['containedObjects']) == 5
+        self.con.getObject(2)
+        # POST /object-links references both objects in its payload
+        self.con.addLink(1, 2)
+        assert self.con.getObject(2)['linkedObjects'] == [{'selfUrl': '{}/objects/1'.format(self.server.url)}]
+        assert self.server.counts['object'] == 2
+
+    def test_download_stale_part(self):
+        # a .part file of a previous run that does not match the server file
+        os.makedirs(os.path.join(self.directory, 'series'))
+        with open(os.path.join(self.directory, 'series', 'series_0.dcm.part'), 'wb') as f:
+            f.write('x' * 5000)
+        report = self.con.downloadFile(10, os.path.join(self.directory, 'series'), workers = 2)
+        assert report.ok
+        with open(os.path.join(self.directory, 'series', 'series_0.dcm'), 'rb') as f:
+            assert f.read() == self.server.content(0, 20000)
+        assert self.server.counts['file'] == 1
+
+    def test_download_if_range(self):
+        def change():
+            self.server.files[2]['version'] = 1
+        # an interrupted transfer is resumed
+        self.server.cutoffs = [5000]
+        assert self.con.downloadFile(1, os.path.join(self.directory, 'image')).ok
+        assert self.__downloaded() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 2
+        assert self.server.bytesSent < 30000
+        # unless the file changed in between
+        self.server.cutoffs = [5000]
+        self.server.hooks['download'] = lambda: self.server.hooks.setdefault('download', change)
+        assert self.con.downloadFile(2, os.path.join(self.directory, 'image2')).ok
+        with open(os.path.join(self.directory, 'image2.nii'), 'rb') as f:
+            assert f.read() == self.server.content(0, 20000)
+        assert self.server.counts['download'] == 4
+        assert self.server.counts['rangeChanged'] == 1
@@ -0,0 +1,57 @@
+# nose-tests for the decoder module of connectVSD 0.1
+
+import json
+
+import decoder
+
+class TestDecoder:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def __folders(self):
+        return json.dumps({'totalCount': 2,
+                           'nextPageUrl': self.__server + '/folders?page=2',
+                           'items': [{'id': 1,
+                                      'name': 'root',
+                                      'selfUrl': self.__server + '/folders/1',
+                                      'parentFolder': None,
+                                      'containedObjects': [{'selfUrl': self.__server + '/objects/3'}],
+                                      'folderGroupRights': [{'selfUrl': self.__server + '/folder-group-rights/1'}]}]})
+    
+    def test_full(self):
+        body = self.__folders()
+        assert decoder.Decoder().loads(body) == json.loads(body)
+        
+    def test_fields(self):
+        for backend in ('json', None):
+            page = decoder.Decoder(backend).loads(self.__folders(), ['id', 'containedObjects'])
+            assert page['totalCount'] == 2
+            assert page['nextPageUrl'] == self.__server + '/folders?page=2'
+            assert page['items'] == [{'id': 1,
+                                      'selfUrl': self.__server + '/folders/1',
+                                      'containedObjects': [{'selfUrl': self.__server + '/objects/3'}]}]
+        
+    def test_folder_fields(self):
+        folder = decoder.Decoder().loads(self.__folders(), decoder.FOLDER_FIELDS)['items'][0]
+        assert sorted(folder) == ['containedObjects', 'id', 'name', 'parentFolder', 'selfUrl']
+        
+    def test_prune(self):
+        obj = json.loads(self.__folders())
+        assert decoder.prune(obj, frozenset(['items', 'id'])) == {'items': [{'id': 1}]}
+        
+    def test_prune_nested(self):
+        # only the members of the items are pruned, nested values are kept
+        obj = json.loads(self.__folders())
+        obj['items'][0]['parentFolder'] = {'selfUrl': self.__server + '/folders/2', 'name': 'parent'}
+        assert decoder.prune(obj, frozenset(['items', 'parentFolder'])) == {'items': [{'parentFolder': {'selfUrl': self.__server + '/folders/2', 'name': 'parent'}}]}
+        assert decoder.prune([{'id': 1, 'name': 'a'}], frozenset(['id'])) == [{'id': 1}]
+        
+    def test_backend(self):
+        assert decoder.Decoder().backend in decoder.BACKENDS
+        assert decoder.Decoder('json').backend == 'json'
+        try:
+            decoder.Decoder('yaml')
+        except ValueError:
+            pass
+        else:
+            assert False
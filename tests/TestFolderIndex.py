@@ -0,0 +1,84 @@
+# nose-tests for the folderindex module of connectVSD 0.1
+
+import folderindex
+
+class TestFolderIndex:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def folder(self, fid, name, parent = None, objects = ()):
+        return {'id': fid,
+                'name': name,
+                'selfUrl': '{}/folders/{}'.format(self.__server, fid),
+                'parentFolder': None if parent is None else {'selfUrl': '{}/folders/{}'.format(self.__server, parent)},
+                'childFolders': None,
+                'containedObjects': [{'selfUrl': '{}/objects/{}'.format(self.__server, oid)} for oid in objects] or None}
+    
+    def setup(self):
+        # children listed before their parents on purpose
+        self.index = folderindex.FolderIndex({'items': [
+            self.folder(3, '01_Original', 2, (10, 11)),
+            self.folder(4, '02_Segmentation', 2, (12,)),
+            self.folder(2, 'Study', 1, (11,)),
+            self.folder(1, 'MyProjects'),
+            self.folder(5, 'Other'),
+        ]})
+        
+    def test_tree(self):
+        assert len(self.index) == 5
+        assert 3 in self.index
+        assert self.index[3].parentFolder is self.index[2]
+        assert sorted(node.ID for node in self.index[2].childFolders) == [3, 4]
+        assert sorted(node.ID for node in self.index.roots()) == [1, 5]
+        assert [node.ID for node in self.index.walk(2)] == [2, 3, 4]
+        
+    def test_paths(self):
+        assert self.index[3].fullName == 'MyProjects/Study/01_Original'
+        assert self.index[3].getFullName() == 'MyProjects/Study/01_Original'
+        assert self.index.byPath('MyProjects/Study/01_Original') is self.index[3]
+        assert self.index.byPath('MyProjects/Study/03_Missing') is None
+        
+    def test_search(self):
+        assert [node.ID for node in self.index.findPrefix('MyProjects/Study/')] == [3, 4]
+        assert [node.ID for node in self.index.findPrefix('MyProjects')] == [1, 2, 3, 4]
+        assert [node.ID for node in self.index.find('Study/0')] == [3, 4]
+        assert [node.ID for node in self.index.find('Original')] == [3]
+        assert self.index.find('Nothing') == []
+        
+    def test_objects(self):
+        assert self.index[3].getObjectIDs() == (10, 11)
+        assert sorted(node.ID for node in self.index.foldersOf(11)) == [2, 3]
+        assert self.index.foldersOf(99) == []
+        
+    def test_iterable(self):
+        index = folderindex.FolderIndex(iter([self.folder(1, 'A'), self.folder(2, 'B', 1)]))
+        assert index.byPath('A/B').ID == 2
+        
+    def test_update_rename_move(self):
+        study = self.folder(2, 'Study2015', 1, (11,))
+        segmentation = self.folder(4, '02_Segmentation', 5, (12, 13))
+        self.index.update([study, segmentation])
+        assert self.index[3].fullName == 'MyProjects/Study2015/01_Original'
+        assert self.index.byPath('MyProjects/Study/01_Original') is None
+        assert self.index.byPath('MyProjects/Study2015/01_Original') is self.index[3]
+        assert self.index[4].fullName == 'Other/02_Segmentation'
+        assert [node.ID for node in self.index[2].childFolders] == [3]
+        assert [node.ID for node in self.index.find('Segmentation')] == [4]
+        assert [node.ID for node in self.index.foldersOf(13)] == [4]
+        
+    def test_update_add_remove(self):
+        self.index.update([self.folder(7, 'Sub', 6), self.folder(6, 'New', 1, (20,))],
+                          removed = [2])
+        assert 2 not in self.index and 3 not in self.index and 4 not in self.index
+        assert self.index.foldersOf(10) == []
+        assert self.index.findPrefix('MyProjects/Study') == []
+        assert self.index.byPath('MyProjects/New/Sub').ID == 7
+        assert [node.ID for node in self.index.foldersOf(20)] == [6]
+        assert [node.ID for node in self.index.find('MyProjects')] == [1, 6, 7]
+        
+    def test_update_orphan(self):
+        index = folderindex.FolderIndex([self.folder(2, 'B', 1)])
+        assert index[2].fullName == 'B'
+        index.update([self.folder(1, 'A')])
+        assert index[2].fullName == 'A/B'
+        assert index.byPath('B') is None
@@ -0,0 +1,142 @@
+# nose-tests for the keepalive module of connectVSD 0.1
+
+import os
+import time
+import socket
+import urllib2
+import tempfile
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+from nose.tools import assert_raises
+
+import keepalive
+import poster
+
+class DummyConnection:
+    
+    closed = False
+    
+    def close(self):
+        self.closed = True
+
+class TestConnectionPool:
+    
+    __key = ('https', 'demo.virtualskeleton.ch')
+    
+    def test_reuse(self):
+        pool = keepalive.ConnectionPool(maxsize = 2)
+        conn = DummyConnection()
+        assert pool.get(self.__key) is None
+        pool.put(self.__key, conn)
+        assert pool.get(self.__key) is conn
+        assert pool.get(self.__key) is None
+        assert pool.get(('http', 'other.host')) is None
+        
+    def test_maxsize(self):
+        pool = keepalive.ConnectionPool(maxsize = 1)
+        conn1, conn2 = DummyConnection(), DummyConnection()
+        pool.put(self.__key, conn1)
+        pool.put(self.__key, conn2)
+        assert not conn1.closed
+        assert conn2.closed
+        
+    def test_idletimeout(self):
+        pool = keepalive.ConnectionPool(maxsize = 1, idletimeout = -1)
+        conn = DummyConnection()
+        pool.put(self.__key, conn)
+        assert pool.get(self.__key) is None
+        assert conn.closed
+        
+    def test_clear(self):
+        pool = keepalive.ConnectionPool()
+        conn = DummyConnection()
+        pool.put(self.__key, conn)
+        pool.clear()
+        assert conn.closed
+        assert pool.get(self.__key) is None
+
+class TestZeroCopy:
+    
+    def test_send_buffers(self):
+        content = os.urandom(300000)
+        f = tempfile.NamedTemporaryFile()
+        f.write(content)
+        f.flush()
+        body, headers = poster.encode_multipart_stream({'FIELD': 'VALUE'},
+                                                       {'FILE': {'filename': 'F.NII', 'path': f.name}})
+        conn = keepalive.HTTPConnection('localhost')
+        conn.sock, peer = socket.socketpair()
+        received = []
+        reader = threading.Thread(target = lambda: received.extend(iter(lambda: peer.recv(65536), '')))
+        reader.start()
+        conn.send(body)
+        conn.close()
+        reader.join()
+        body.seek(0)
+        assert ''.join(received) == body.read()
+        assert len(''.join(received)) == int(headers['Content-Length'])
+
+class ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class ResendHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers /slow after a delay and closes the connection after /close
+    without announcing it, like a server dropping an idle connection."""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        self.answer()
+        
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.answer()
+        
+    def answer(self):
+        self.server.counts[self.command, self.path] += 1
+        if self.path == '/slow':
+            time.sleep(1)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+        if self.path == '/close':
+            self.close_connection = 1
+        
+    def log_message(self, format, *args):
+        pass
+
+class TestResend:
+    
+    def setup(self):
+        self.server = ThreadingServer(('127.0.0.1', 0), ResendHandler)
+        self.server.counts = collections.Counter()
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.opener = keepalive.build_opener(keepalive.ConnectionPool())
+        
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        
+    def open(self, path, data = None, timeout = 5):
+        return self.opener.open(urllib2.Request(self.url + path, data), timeout = timeout).read()
+        
+    def test_dead_connection(self):
+        assert self.open('/close') == 'ok'
+        time.sleep(0.1)
+        assert self.open('/post', 'data') == 'ok'
+        assert self.server.counts['POST', '/post'] == 1
+        
+    def test_no_resend_on_timeout(self):
+        for data in (None, 'data'):
+            self.open('/ok')
+            assert_raises(urllib2.URLError, self.open, '/slow', data, (5, 0.3))
+        time.sleep(1.5)
+        assert self.server.counts['GET', '/slow'] == 1
+        assert self.server.counts['POST', '/slow'] == 1
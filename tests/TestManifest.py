@@ -0,0 +1,89 @@
+# nose-tests for the manifest module of connectVSD 0.1
+
+import os
+import hashlib
+import shutil
+import tempfile
+
+import manifest
+
+class TestManifest:
+    
+    __url = "https://demo.virtualskeleton.ch/api/files/1"
+    
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'manifest.jsonl')
+        self.filename = os.path.join(self.directory, 'image.nii')
+        with open(self.filename, 'wb') as f:
+            f.write('x' * 10)
+        
+    def teardown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_record(self):
+        m = manifest.Manifest(self.path)
+        assert not m.isCurrent(self.filename, self.__url)
+        m.record(self.filename, 1, self.__url, 10, {'size': 10})
+        m = manifest.Manifest(self.path)
+        assert self.filename in m
+        assert m.get(self.filename)['file'] == 'image.nii'
+        assert m.isCurrent(self.filename, self.__url, {'size': 10})
+        assert m.isCurrent(self.filename, self.__url)
+        
+    def test_changed(self):
+        m = manifest.Manifest(self.path)
+        m.record(self.filename, 1, self.__url, 10, {'size': 10})
+        assert not m.isCurrent(self.filename, self.__url, {'size': 11})
+        assert not m.isCurrent(self.filename, "https://demo.virtualskeleton.ch/api/files/2")
+        
+    def test_truncated(self):
+        m = manifest.Manifest(self.path)
+        m.record(self.filename, 1, self.__url, 10)
+        with open(self.filename, 'wb') as f:
+            f.write('x' * 5)
+        assert not m.isCurrent(self.filename, self.__url)
+        os.remove(self.filename)
+        assert not m.isCurrent(self.filename, self.__url)
+        
+    def test_journal(self):
+        m = manifest.Manifest(self.path)
+        m.record(self.filename, 1, self.__url, 5)
+        m.record(self.filename, 1, self.__url, 10)
+        m.record(os.path.join(self.directory, 'other.nii'), 2, self.__url, 10)
+        m.remove(os.path.join(self.directory, 'other.nii'))
+        with open(self.path, 'ab') as f:
+            f.write('{"file": "trunc')
+        m = manifest.Manifest(self.path)
+        assert len(m) == 1
+        assert m.get(self.filename)['size'] == 10
+        m.compact()
+        assert len(open(self.path).readlines()) == 1
+        
+    def test_checksum(self):
+        m = manifest.Manifest(self.path)
+        m.record(self.filename, 1, self.__url, 10, checksum = 'sha1:94ed6ecbc7e3a0e1fa6cd1b9d0bc8a8f8c1f1b2b')
+        m = manifest.Manifest(self.path)
+        assert m.checksum(self.filename) == 'sha1:94ed6ecbc7e3a0e1fa6cd1b9d0bc8a8f8c1f1b2b'
+        os.utime(self.filename, (0, 0))
+        assert m.checksum(self.filename) is None
+        m.record(self.filename, 1, self.__url, 10)
+        assert m.checksum(self.filename) is None
+        
+    def test_modified(self):
+        m = manifest.Manifest(self.path)
+        m.record(self.filename, 1, self.__url, 10, checksum = 'sha1:' + hashlib.sha1('x' * 10).hexdigest())
+        # touched, but unchanged
+        os.utime(self.filename, (0, 0))
+        assert m.isCurrent(self.filename, self.__url)
+        assert m.checksum(self.filename) is not None
+        assert manifest.Manifest(self.path).isCurrent(self.filename, self.__url)
+        # modified in place with the same size
+        with open(self.filename, 'wb') as f:
+            f.write('y' * 10)
+        os.utime(self.filename, (1, 1))
+        assert not m.isCurrent(self.filename, self.__url)
+        # modified without recorded checksum
+        m.record(self.filename, 1, self.__url, 10)
+        os.utime(self.filename, (2, 2))
+        assert not m.isCurrent(self.filename, self.__url)
@@ -0,0 +1,66 @@
+# nose-tests for the metrics module of connectVSD 0.1
+
+import json
+import StringIO
+
+import metrics
+
+class TestMetrics:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def test_endpoint_template(self):
+        assert metrics.endpoint_template(self.__server + '/objects/1') == '/api/objects/{id}'
+        assert metrics.endpoint_template(self.__server + '//files/5/download') == '/api/files/{id}/download'
+        assert metrics.endpoint_template(self.__server + '/objects?page=2') == '/api/objects'
+        
+    def test_histogram(self):
+        histogram = metrics.Histogram()
+        for latency in [0.001] * 90 + [2.] * 10:
+            histogram.add(latency)
+        assert histogram.count == 100
+        assert histogram.quantile(0.5) == 0.001
+        assert histogram.quantile(0.99) == 2.
+        assert histogram.snapshot()['max'] == 2.
+        assert metrics.Histogram().quantile(0.5) is None
+        
+    def test_snapshot(self):
+        collector = metrics.Metrics()
+        collector.request('GET', self.__server + '/objects/1', 0.1, 200, bytesIn = 100)
+        collector.request('GET', self.__server + '/objects/2', 0.2, 503, error = True)
+        collector.retry('GET', self.__server + '/objects/2')
+        collector.cacheHit('memory', self.__server + '/objects/1')
+        collector.call('downloadFile', 1.5)
+        snapshot = collector.snapshot()
+        endpoint = snapshot['requests']['GET /api/objects/{id}']
+        assert endpoint['count'] == 2
+        assert endpoint['errors'] == 1
+        assert endpoint['retries'] == 1
+        assert endpoint['bytesIn'] == 100
+        assert endpoint['statuses'] == {'200': 1, '503': 1}
+        assert endpoint['cacheHits'] == {'memory': 1}
+        assert snapshot['cache'] == {'memory': 1}
+        assert snapshot['calls']['downloadFile']['count'] == 1
+        out = StringIO.StringIO()
+        collector.export(out)
+        assert json.loads(out.getvalue())['requests'].keys() == ['GET /api/objects/{id}']
+        assert 'downloadFile()' in collector.summary()
+        collector.reset()
+        assert collector.snapshot()['requests'] == {}
+        
+    def test_instrumented(self):
+        
+        class Connecter:
+            
+            @metrics.instrumented
+            def helper(self, x):
+                return x * 2
+            
+            # assigned after the decorator, which refers to the module
+            metrics = None
+        
+        con = Connecter()
+        assert con.helper(2) == 4
+        con.metrics = metrics.Metrics()
+        assert con.helper(3) == 6
+        assert con.metrics.snapshot()['calls']['helper']['count'] == 1
@@ -0,0 +1,60 @@
+# nose-tests for the ratelimit module of connectVSD 0.1
+
+import time
+import threading
+
+import ratelimit
+import workers
+
+class TestRatelimit:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def test_endpoint_class(self):
+        assert ratelimit.endpoint_class(self.__server + '/upload') == 'transfer'
+        assert ratelimit.endpoint_class(self.__server + '/files/1/download') == 'transfer'
+        assert ratelimit.endpoint_class(self.__server + '/objects/1') == 'metadata'
+        
+    def test_tokenbucket(self):
+        bucket = ratelimit.TokenBucket(100, burst = 5)
+        start = time.time()
+        for i in range(5):
+            assert bucket.acquire() == 0.
+        for i in range(10):
+            bucket.acquire()
+        assert time.time() - start >= 0.09
+        
+    def test_ratelimiter(self):
+        limiter = ratelimit.RateLimiter({'metadata': 1000, 'transfer': None})
+        assert limiter.acquire(self.__server + '/objects/1') == 0.
+        for i in range(100):
+            assert limiter.acquire(self.__server + '/upload') == 0.
+        
+    def test_aimd(self):
+        controller = ratelimit.AIMDController(initial = 4, minimum = 2, maximum = 6, targetlatency = 0.5)
+        for i in range(40):
+            controller.record(0.01)
+        assert controller.limit == 6
+        controller.record(overloaded = True)
+        assert controller.limit == 3
+        # one decrease per congestion event
+        controller.record(1.)
+        assert controller.limit == 3
+        
+    def test_aimd_slot(self):
+        controller = ratelimit.AIMDController(initial = 2, targetlatency = 10)
+        lock = threading.Lock()
+        active = [0, 0]
+        
+        def request(i):
+            with controller.slot():
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active[1], active[0])
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+        
+        workers.run_parallel(request, range(10), workers = 6)
+        assert active[1] <= 2
+        assert controller.inflight == 0
@@ -0,0 +1,57 @@
+# nose-tests for the retry module of connectVSD 0.1
+
+import time
+import socket
+import urllib2
+import StringIO
+import mimetools
+
+import retry
+
+class TestRetry:
+    
+    __server = "https://demo.virtualskeleton.ch/api"
+    
+    def __error(self, code, headers = ''):
+        msg = mimetools.Message(StringIO.StringIO(headers + '\r\n'))
+        return urllib2.HTTPError(self.__server + '/objects/1', code, 'Error', msg, None)
+    
+    def test_delay(self):
+        policy = retry.RetryPolicy(retries = 2, backoff = 1., maxbackoff = 1.5)
+        assert 0 <= policy.delay('GET', 0, self.__error(503)) <= 1.
+        assert 0 <= policy.delay('PUT', 1, socket.timeout()) <= 1.5
+        assert policy.delay('GET', 2, self.__error(503)) is None
+        assert policy.delay('POST', 0, self.__error(503)) is None
+        assert policy.delay('GET', 0, self.__error(404)) is None
+        
+    def test_retry_after(self):
+        policy = retry.RetryPolicy(maxretryafter = 10)
+        assert policy.delay('GET', 0, self.__error(429, 'Retry-After: 5\r\n')) == 5.
+        assert policy.delay('GET', 0, self.__error(503, 'Retry-After: 60\r\n')) is None
+        assert retry.retry_after(self.__error(503, 'Retry-After: soon\r\n')) is None
+        
+    def test_circuitbreaker(self):
+        breaker = retry.CircuitBreaker(threshold = 2, cooldown = 0.05)
+        url = self.__server + '/objects/1'
+        breaker.failure(url)
+        assert breaker.allow(url)
+        breaker.failure(url)
+        assert not breaker.allow(url)
+        assert breaker.allow('https://www.virtualskeleton.ch/api/objects/1')
+        time.sleep(0.06)
+        # a single trial request after the cooldown
+        assert breaker.allow(url)
+        assert not breaker.allow(url)
+        breaker.failure(url)
+        assert breaker.isOpen(url)
+        time.sleep(0.06)
+        assert breaker.allow(url)
+        breaker.success(url)
+        assert breaker.allow(url)
+        assert not breaker.isOpen(url)
+        
+    def test_disabled(self):
+        breaker = retry.CircuitBreaker(threshold = 0)
+        for i in range(10):
+            breaker.failure(self.__server)
+        assert breaker.allow(self.__server)
@@ -0,0 +1,110 @@
+# nose-tests for the workers module of connectVSD 0.1
+
+import time
+import threading
+
+from nose.tools import assert_raises
+
+import workers
+
+class TestWorkers:
+    
+    def test_run_parallel(self):
+        items = range(20)
+        assert workers.run_parallel(lambda x: x * 2, items, workers = 1) == [x * 2 for x in items]
+        assert workers.run_parallel(lambda x: x * 2, items, workers = 4) == [x * 2 for x in items]
+        assert workers.run_parallel(lambda x: x, [], workers = 4) == []
+        
+    def test_hostlimiter(self):
+        limiter = workers.HostLimiter(2)
+        lock = threading.Lock()
+        active = [0, 0]
+        
+        def request(url):
+            with limiter.slot(url):
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active[1], active[0])
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+        
+        workers.run_parallel(request, ['https://demo.virtualskeleton.ch/api/objects/{}'.format(i) for i in range(10)], workers = 5)
+        assert active[1] <= 2
+        
+    def test_transferreport(self):
+        report = workers.TransferReport()
+        report.addCompleted('a.nii', 10)
+        report.addSkipped('b.nii')
+        assert report.ok
+        other = workers.TransferReport()
+        other.addFailed('https://demo.virtualskeleton.ch/api/files/1/download', 'c.nii', Exception())
+        other.addCompleted('d.nii', 0, 'sha1:da39a3ee5e6b4b0d3255bfef95601890afd80709')
+        report.merge(other)
+        assert report.checksums == {'d.nii': 'sha1:da39a3ee5e6b4b0d3255bfef95601890afd80709'}
+        assert not report.ok
+        assert report.bytes == 10
+        assert report.completed == ['a.nii', 'd.nii']
+        assert report.skipped == ['b.nii']
+        assert len(report.failed) == 1
+        
+    def test_singleflight(self):
+        flight = workers.SingleFlight()
+        calls = []
+        started = threading.Event()
+        
+        def slow():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return 'result'
+        
+        def request(i):
+            if i > 0:
+                started.wait()
+            return flight.do('key', slow)
+        
+        assert workers.run_parallel(request, range(4), workers = 4) == ['result'] * 4
+        assert len(calls) == 1
+        assert flight.coalesced == 3
+        assert flight.do('key', lambda: 'again') == 'again'
+        
+    def test_run_pipeline(self):
+        order = []
+        
+        def first(x):
+            time.sleep(0.01 * (x % 3))
+            return x * 2
+        
+        def second(x, y):
+            order.append(x)
+            return (x, y)
+        
+        items = range(10)
+        assert workers.run_pipeline(first, second, items, workers = 3, postworkers = 2) == [(x, x * 2) for x in items]
+        assert sorted(order) == items
+        assert workers.run_pipeline(first, second, [], workers = 3) == []
+        
+    def test_run_pipeline_error(self):
+        def first(x):
+            if x == 0:
+                raise KeyError(x)
+            time.sleep(0.05)
+            return x
+        
+        # the remaining items still pass both stages
+        done = []
+        assert_raises(KeyError, workers.run_pipeline, first, lambda x, y: done.append(x), range(4), workers = 4)
+        assert sorted(done) == [1, 2, 3]
+        
+    def test_uploadreport(self):
+        done = workers.UploadResult('a.nii', 1, None, 2)
+        done.oid = 10
+        done.steps.extend(['upload', 'link', 'folder'])
+        failed = workers.UploadResult('b.nii', 1)
+        failed.fail('upload', IOError())
+        report = workers.UploadReport([done, failed])
+        assert not report.ok
+        assert report.succeeded == [done]
+        assert report.failed == [failed]
+        assert failed.stage == 'upload'